@@ -1,23 +1,127 @@
+import asyncio
+import functools
+import hmac
+import io
 import os
+import time
+from collections import Counter
 from datetime import datetime
-from typing import List, Optional
-
-from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    File,
+    Form,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    WebSocket,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from models import instrumentation
 from models.database import (
+    ROUTE_CACHE_SECONDS,
     Flashcard,
+    FlashcardReview,
     InteractiveElement,
+    Lesson,
     Progress,
+    QuestionExposure,
     QuestionPaper,
+    SessionLocal,
+    ShardReadOnly,
     StudyPlan,
     User,
+    engines,
     get_db,
+    get_directory_db,
+    open_session,
+    register_user,
+    route_user,
+    session_factory,
+    unregister_user,
+)
+from models.search import KIND_CODES, search_documents
+from models.versions import VERSIONED_COLLECTIONS, etag_matches, get_versions, make_etag
+from pydantic import BaseModel, Field, field_validator
+from sqlalchemy.orm import Session, undefer
+from utils.archive import full_history as archived_history
+from utils.bulk import KINDS, export_records, guess_format, import_records
+from utils.columnar import cohort_report
+from utils.dashboard import build_dashboard
+from utils.degradation import (
+    regenerate_once,
+    stale_flashcards,
+    stale_lesson,
+    stale_quiz,
+)
+from utils.digest import format_digest, learner_digest
+from utils.irt import (
+    RECALL_THRESHOLD,
+    learner_ability,
+    review_queue,
+    target_difficulty,
+)
+from utils.live_quiz import (
+    LiveQuiz,
+    TooManySessions,
+    create_session,
+    serve_student,
+    serve_teacher,
+)
+from utils.live_quiz import sessions as live_quizzes
+from utils.mastery import (
+    recommend,
+    refit_mastery,
+    serialize_mastery,
+    update_mastery,
+)
+from utils.metrics import registry
+from utils.ollama_client import PROMPT_BUDGETS, OllamaClient
+from utils.profiler import ProfilerBusy, route_endpoint_codes, sample_stacks
+from utils.question_bank import (
+    LOW_WATER_MARK,
+    REFILL_BATCH_SIZE,
+    assemble_quiz,
+    bank_key,
+    display_names,
+    grade_submission,
+    parse_questions,
+    public_question,
+    record_exposures,
+    refill_question_bank,
+    render_quiz,
+    store_questions,
+)
+from utils.quotas import enforce_quota, within_quota
+from utils.retrieval import index_paper, retrieve_paper_context
+from utils.scheduler import build_plan, preference_errors, replan_active_plans
+from utils.timing import (
+    TimedRoute,
+    begin_request,
+    finish_request,
+    instrument_engine,
+    server_timing_header,
+)
+from utils.tokens import CHARS_PER_TOKEN
+from utils.usage import (
+    BUCKET_FORMATS,
+    GROUP_COLUMNS,
+    attribute_user,
+    begin_attribution,
+    usage_report,
 )
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from utils.ollama_client import OllamaClient
 
 app = FastAPI(title="AI Personal Tutor")
+app.router.route_class = TimedRoute
+for shard_engine in engines:
+    instrument_engine(shard_engine)
 
 # Enable CORS
 app.add_middleware(
@@ -29,17 +133,60 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    timings = begin_request()
+    begin_attribution(request.url.path)
+    query_report = instrumentation.begin_request(request.method, request.url.path)
+    started = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing_header(timings, total)
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    finish_request(
+        timings,
+        request.method,
+        request.url.path,
+        route_path,
+        response.status_code,
+        total,
+    )
+    instrumentation.end_request(query_report, route_path)
+    return response
+
+
+@app.exception_handler(ShardReadOnly)
+async def shard_read_only(request: Request, exc: ShardReadOnly):
+    # The user's tenant is being moved between shards
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "This account is being moved; try again shortly"},
+        headers={"Retry-After": str(int(ROUTE_CACHE_SECONDS * 2))},
+    )
+
+
 # Models
 class UserProfile(BaseModel):
     name: str
     email: str
     subjects: dict
+    tenant: Optional[str] = None  # School; its users share a database shard
     preferences: Optional[dict] = None
     learning_goals: Optional[dict] = None
     study_preferences: Optional[dict] = None
 
+    @field_validator("study_preferences")
+    @classmethod
+    def check_study_preferences(cls, value):
+        errors = preference_errors(value)
+        if errors:
+            raise ValueError("; ".join(errors))
+        return value
+
 
 class LessonRequest(BaseModel):
+    user_id: Optional[int] = None
     subject: str
     topic: str
     level: str
@@ -47,17 +194,19 @@ class LessonRequest(BaseModel):
 
 
 class QuizRequest(BaseModel):
+    user_id: Optional[int] = None
     subject: str
     topic: str
     level: str
-    num_questions: int = 5
+    num_questions: int = Field(5, ge=1, le=50)
     question_types: List[str] = ["multiple_choice"]
 
 
 class StudyPlanRequest(BaseModel):
     user_id: int
-    goals: dict
-    duration: int  # in days
+    goals: Optional[dict] = None  # Subject -> goal topics, empty for all
+    duration: int = 7  # in days
+    narrative: bool = False  # Have the LLM write an overview of the plan
 
 
 class ProgressUpdate(BaseModel):
@@ -73,6 +222,24 @@ class ProgressUpdate(BaseModel):
     feedback: Optional[dict] = None
 
 
+class QuizSubmission(BaseModel):
+    user_id: int
+    answers: Dict[int, Optional[str]]  # Bank question id -> answer
+    time_spent: int = 0
+    # As the quiz was requested; progress is recorded under these names
+    subject: Optional[str] = None
+    topic: Optional[str] = None
+
+
+class LiveQuizRequest(BaseModel):
+    user_id: Optional[int] = None  # A student of the class; picks their shard
+    subject: str
+    topic: str
+    level: str
+    num_questions: int = Field(10, ge=1, le=50)
+    question_types: List[str] = ["multiple_choice"]
+
+
 class QuizResponse(BaseModel):
     questions: List[dict]
     answers: List[str]
@@ -82,7 +249,7 @@ class FlashcardRequest(BaseModel):
     user_id: int
     subject: str
     topic: str
-    num_cards: int = 10
+    num_cards: int = Field(10, ge=1, le=50)
 
 
 class InteractiveElementRequest(BaseModel):
@@ -98,6 +265,39 @@ ollama_client = OllamaClient()
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
 
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def conditional_get(
+    http_request: Request,
+    response: Response,
+    db: Session,
+    user_id: int,
+    *collections,
+    extra_versions: Optional[dict] = None,
+) -> Optional[Response]:
+    """Tag a response with the user's data versions for ``collections``.
+
+    Returns a 304 response to send instead when the client's cached copy
+    (``If-None-Match``) is still current; the row tables are never read.
+    """
+    versions = get_versions(db, user_id, collections)
+    versions.update(extra_versions or {})
+    etag = make_etag(user_id, versions)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
 
 # Routes
 @app.get("/")
@@ -105,9 +305,143 @@ async def root():
     return {"message": "Welcome to AI Personal Tutor"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get(
+    "/api/debug/queries",
+    include_in_schema=False,
+    dependencies=[Depends(require_admin)],
+)
+async def debug_queries(limit: int = 50):
+    """Query fingerprints and per-request reports (needs SQL_INSTRUMENTATION=1)."""
+    if not instrumentation.ENABLED:
+        raise HTTPException(status_code=404, detail="SQL instrumentation is disabled")
+    return instrumentation.snapshot(limit)
+
+
+@app.get(
+    "/api/admin/profile",
+    include_in_schema=False,
+    dependencies=[Depends(require_admin)],
+)
+async def profile_process(
+    seconds: float = Query(10.0, gt=0, le=60),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+    route: Optional[str] = None,
+):
+    """Sample the live process and return flamegraph-ready collapsed stacks."""
+    only_codes = None
+    if route is not None:
+        only_codes = route_endpoint_codes(app.routes).get(route)
+        if not only_codes:
+            raise HTTPException(status_code=404, detail=f"Unknown route: {route}")
+    try:
+        stacks = await asyncio.to_thread(
+            sample_stacks, seconds, interval_ms / 1000, only_codes
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        stacks,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
+
+
+@app.get("/api/admin/usage", dependencies=[Depends(require_admin)])
+async def get_usage(
+    bucket: str = "day",
+    group_by: str = "route,model",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_directory_db),
+):
+    """Generation usage rolled up by period, grouped by user, route and/or model."""
+    groups = tuple(g.strip() for g in group_by.split(",") if g.strip())
+    unknown = set(groups) - set(GROUP_COLUMNS)
+    if bucket not in BUCKET_FORMATS or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"bucket must be one of {', '.join(BUCKET_FORMATS)}; "
+            f"group_by may contain {', '.join(GROUP_COLUMNS)}",
+        )
+    return {
+        "bucket": bucket,
+        "group_by": groups,
+        "rows": usage_report(db, bucket, groups, since, until, user_id),
+    }
+
+
+def refit_all_mastery():
+    with SessionLocal() as db:
+        refit_mastery(db)
+
+
+@app.post("/api/admin/import/{kind}", dependencies=[Depends(require_admin)])
+async def bulk_import(
+    kind: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+):
+    """Import NDJSON or CSV records; invalid lines are reported and skipped."""
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown kind {kind!r}")
+    fmt = guess_format(file.filename or "", format)
+    # The upload is spooled to disk, so it is read back in constant memory
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    report = await asyncio.to_thread(import_records, kind, stream, fmt)
+    if kind == "progress" and report["inserted"]:
+        background_tasks.add_task(refit_all_mastery)
+    return {"kind": kind, "format": fmt, **report}
+
+
+@app.get("/api/admin/export/{kind}", dependencies=[Depends(require_admin)])
+async def bulk_export(
+    kind: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: Optional[int] = None,
+):
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown kind {kind!r}")
+    return StreamingResponse(
+        export_records(kind, format, user_id),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
+
+
+@app.get("/api/analytics/cohort", dependencies=[Depends(require_admin)])
+async def get_cohort_analytics(
+    user_ids: Optional[str] = None,
+    subject: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """Class-level score distributions and struggling topics.
+
+    ``user_ids`` is a comma-separated list; omit it for every student. Served
+    from the columnar export (``python -m utils.columnar``).
+    """
+    try:
+        cohort = (
+            [int(u) for u in user_ids.split(",") if u.strip()] if user_ids else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="user_ids must be integers")
+    return await asyncio.to_thread(cohort_report, cohort, subject, since, until)
+
+
 @app.post("/api/profile")
-async def create_profile(profile: UserProfile, db: Session = Depends(get_db)):
+async def create_profile(profile: UserProfile):
+    user_id, shard = register_user(profile.tenant)
     db_user = User(
+        id=user_id,
         name=profile.name,
         email=profile.email,
         subjects=profile.subjects,
@@ -115,67 +449,443 @@ async def create_profile(profile: UserProfile, db: Session = Depends(get_db)):
         learning_goals=profile.learning_goals,
         study_preferences=profile.study_preferences,
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return {"message": "Profile created successfully", "user_id": db_user.id}
+    try:
+        with open_session(shard) as db:
+            db.add(db_user)
+            db.commit()
+    except Exception:
+        unregister_user(user_id)
+        raise
+    return {"message": "Profile created successfully", "user_id": user_id}
 
 
 @app.get("/api/profile/{user_id}")
-async def get_profile(user_id: int, db: Session = Depends(get_db)):
+async def get_profile(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    not_modified = conditional_get(http_request, response, db, user_id, "users")
+    if not_modified:
+        return not_modified
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
+@app.get("/api/users/{user_id}/dashboard")
+async def get_dashboard(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    # Due-card counts change with time alone, so the tag also rolls hourly
+    not_modified = conditional_get(
+        http_request,
+        response,
+        db,
+        user_id,
+        *VERSIONED_COLLECTIONS,
+        extra_versions={"hour": datetime.utcnow().strftime("%Y%m%d%H")},
+    )
+    if not_modified:
+        return not_modified
+    dashboard = build_dashboard(db, user_id)
+    if dashboard is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return dashboard
+
+
+async def create_lesson(
+    db: Session, request: LessonRequest, fresh_only: bool = False
+) -> Tuple[Optional[Lesson], dict]:
+    """Generate and store a lesson; with ``fresh_only`` a cached one is not stored."""
+    references = retrieve_paper_context(
+        db, request.user_id, request.subject, request.topic
+    )
+    response = await ollama_client.generate_lesson(
+        request.subject,
+        request.topic,
+        request.level,
+        request.preferences,
+        reference_material=references,
+        user_id=request.user_id,
+    )
+    if fresh_only and response.get("cached"):
+        return None, response
+
+    lesson = Lesson(
+        user_id=request.user_id,
+        subject=request.subject,
+        topic=request.topic,
+        level=request.level,
+        content=response["response"],
+    )
+    db.add(lesson)
+    db.commit()
+    db.refresh(lesson)
+    return lesson, response
+
+
+async def regenerate_lesson(request: LessonRequest, new_session=SessionLocal):
+    with new_session() as db:
+        await create_lesson(db, request, fresh_only=True)
+
+
 @app.post("/api/lesson")
-async def generate_lesson(request: LessonRequest):
+async def generate_lesson(
+    request: LessonRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    attribute_user(request.user_id)
     try:
-        response = await ollama_client.generate_lesson(
-            request.subject, request.topic, request.level, request.preferences
-        )
-        return {"content": response["response"]}
+        if ollama_client.is_overloaded("mixtral"):
+            lesson = stale_lesson(
+                db, request.user_id, request.subject, request.topic, request.level
+            )
+            if lesson is not None:
+                if within_quota(http_request, db, request.user_id):
+                    background_tasks.add_task(
+                        regenerate_once,
+                        (
+                            "lesson",
+                            request.user_id,
+                            *bank_key(request.subject, request.topic, request.level),
+                        ),
+                        functools.partial(
+                            regenerate_lesson, request, session_factory(db)
+                        ),
+                    )
+                return {
+                    "lesson_id": lesson.id,
+                    "content": lesson.content,
+                    "stale": True,
+                }
+
+        enforce_quota(http_request, db, request.user_id)
+        lesson, response = await create_lesson(db, request)
+        return {
+            "lesson_id": lesson.id,
+            "content": lesson.content,
+            "stale": response.get("stale", False),
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/quiz")
-async def generate_quiz(request: QuizRequest):
+async def generate_quiz(
+    request: QuizRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    attribute_user(request.user_id)
     try:
+        questions, remaining = assemble_quiz(
+            db,
+            request.user_id,
+            request.subject,
+            request.topic,
+            request.level,
+            request.num_questions,
+            request.question_types,
+            target_difficulty=(
+                target_difficulty(learner_ability(db, request.user_id))
+                if request.user_id is not None
+                else None
+            ),
+        )
+        if remaining < max(LOW_WATER_MARK, request.num_questions) and within_quota(
+            http_request, db, request.user_id, REFILL_BATCH_SIZE
+        ):
+            background_tasks.add_task(
+                refill_question_bank,
+                ollama_client,
+                request.subject,
+                request.topic,
+                request.level,
+                request.question_types,
+                session_factory=session_factory(db),
+            )
+        if questions is not None:
+            return {
+                "content": render_quiz(questions),
+                "questions": [public_question(q) for q in questions],
+                "source": "bank",
+            }
+
+        if ollama_client.is_overloaded("deepseek-r1"):
+            # Repeat questions the user has seen rather than queue behind the
+            # backend; the refill above tops the bank up
+            questions = stale_quiz(
+                db,
+                request.subject,
+                request.topic,
+                request.level,
+                request.num_questions,
+                request.question_types,
+            )
+            if questions:
+                if request.user_id is not None:
+                    record_exposures(db, request.user_id, [q.id for q in questions])
+                return {
+                    "content": render_quiz(questions),
+                    "questions": [public_question(q) for q in questions],
+                    "source": "bank",
+                    "stale": True,
+                }
+
+        enforce_quota(http_request, db, request.user_id, request.num_questions)
+        references = retrieve_paper_context(
+            db, request.user_id, request.subject, request.topic
+        )
         response = await ollama_client.generate_quiz(
             request.subject,
             request.topic,
             request.level,
             request.num_questions,
             request.question_types,
+            reference_material=references,
+        )
+        # Stored in the bank like any other question, so answers can be graded
+        questions = store_questions(
+            db,
+            request.subject,
+            request.topic,
+            request.level,
+            parse_questions(response["response"]),
         )
-        return {"content": response["response"]}
+        if not questions:
+            raise HTTPException(
+                status_code=502, detail="The generated quiz could not be read"
+            )
+        if request.user_id is not None:
+            record_exposures(db, request.user_id, [q.id for q in questions])
+        return {
+            "content": render_quiz(questions),
+            "questions": [public_question(q) for q in questions],
+            "source": "live",
+            "stale": response.get("stale", False),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def record_quiz_results(
+    db: Session,
+    user_id: int,
+    results: List[dict],
+    time_spent: int,
+    names: Optional[Tuple[str, str]] = None,
+) -> List[dict]:
+    """One progress row per topic covered by a graded quiz; the caller commits.
+
+    Bank keys are normalized, so rows are stored under display names (see
+    ``display_names``); ``names`` are the subject and topic as requested.
+    """
+    by_topic = {}
+    for result in results:
+        by_topic.setdefault((result["subject"], result["topic"]), []).append(result)
+    spellings = display_names(db, user_id, by_topic, names)
+    mastery = []
+    for key, topic_results in by_topic.items():
+        subject, topic = spellings[key]
+        difficulty = Counter(r["difficulty"] for r in topic_results)
+        db_progress = Progress(
+            user_id=user_id,
+            subject=subject,
+            topic=topic,
+            score=100.0 * sum(r["correct"] for r in topic_results) / len(topic_results),
+            time_spent=time_spent * len(topic_results) // len(results),
+            difficulty_level=difficulty.most_common(1)[0][0],
+        )
+        db.add(db_progress)
+        db.flush()
+        row = update_mastery(db, db_progress)
+        if row is not None:
+            mastery.append(serialize_mastery(row))
+    replan_active_plans(db, user_id, [(m["subject"], m["topic"]) for m in mastery])
+    return mastery
+
+
+@app.post("/api/quiz/submit")
+async def submit_quiz(submission: QuizSubmission, db: Session = Depends(get_db)):
+    """Grade answers to bank questions and record the outcomes."""
+    try:
+        results = grade_submission(db, submission.user_id, submission.answers)
+        if not results:
+            raise HTTPException(status_code=404, detail="No matching questions")
+        names = (
+            (submission.subject, submission.topic)
+            if submission.subject and submission.topic
+            else None
+        )
+        mastery = record_quiz_results(
+            db, submission.user_id, results, submission.time_spent, names
+        )
+        db.commit()
+
+        correct = sum(r["correct"] for r in results)
+        return {
+            "score": round(100.0 * correct / len(results), 1),
+            "correct": correct,
+            "total": len(results),
+            "results": results,
+            "mastery": mastery,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def save_live_quiz(quiz: LiveQuiz):
+    """Record a finished live quiz: one transaction per shard of its students."""
+    by_shard = {}
+    for participant in quiz.participants.values():
+        results = quiz.results(participant)
+        if results:
+            shard, _ = route_user(participant.user_id)
+            by_shard.setdefault(shard, []).append((participant, results))
+    for shard, graded in by_shard.items():
+        with open_session(shard) as db:
+            # Question ids refer to the bank of the shard the quiz came from
+            if shard == quiz.shard:
+                db.add_all(
+                    QuestionExposure(
+                        user_id=participant.user_id,
+                        question_id=result["question_id"],
+                        correct=result["correct"],
+                    )
+                    for participant, results in graded
+                    for result in results
+                )
+            for participant, results in graded:
+                record_quiz_results(
+                    db,
+                    participant.user_id,
+                    results,
+                    quiz.time_spent(participant),
+                    quiz.names,
+                )
+            db.commit()
+
+
+@app.post("/api/live-quiz", dependencies=[Depends(require_admin)])
+async def create_live_quiz(request: LiveQuizRequest, db: Session = Depends(get_db)):
+    """Open a live quiz on bank questions; students join with the returned code."""
+    questions = stale_quiz(
+        db,
+        request.subject,
+        request.topic,
+        request.level,
+        request.num_questions,
+        request.question_types,
+    )
+    if not questions:
+        raise HTTPException(
+            status_code=404, detail="No bank questions for this topic yet"
+        )
+    try:
+        quiz = await create_session(
+            questions,
+            db.info.get("shard", 0),
+            save_live_quiz,
+            (request.subject, request.topic),
+        )
+    except TooManySessions as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "code": quiz.code,
+        "questions": len(questions),
+        "socket": f"/ws/live-quiz/{quiz.code}",
+    }
+
+
+def load_student(user_id: int) -> Optional[User]:
+    shard, _ = route_user(user_id)
+    with open_session(shard) as db:
+        return db.get(User, user_id)
+
+
+@app.websocket("/ws/live-quiz/{code}")
+async def live_quiz_socket(
+    websocket: WebSocket,
+    code: str,
+    user_id: Optional[int] = None,
+    token: Optional[str] = None,
+):
+    """Students connect with their ``user_id``, the teacher with the admin token."""
+    quiz = live_quizzes.get(code.upper())
+    if quiz is None:
+        await websocket.close(code=4404, reason="No such live quiz")
+        return
+    if token is not None:
+        if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            await websocket.close(code=4403, reason="Invalid admin token")
+            return
+        await websocket.accept()
+        await serve_teacher(quiz, websocket)
+        return
+    user = await asyncio.to_thread(load_student, user_id) if user_id else None
+    if user is None:
+        await websocket.close(code=4404, reason="User not found")
+        return
+    await websocket.accept()
+    await serve_student(quiz, websocket, user.id, user.name)
+
+
 @app.post("/api/study-plan")
-async def create_study_plan(request: StudyPlanRequest, db: Session = Depends(get_db)):
+async def create_study_plan(
+    request: StudyPlanRequest, http_request: Request, db: Session = Depends(get_db)
+):
+    attribute_user(request.user_id)
     try:
         user = db.query(User).filter(User.id == request.user_id).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        response = await ollama_client.generate_study_plan(user.dict(), request.goals)
+        plan = build_plan(db, user, request.goals, request.duration)
+        narrative = None
+        if request.narrative:
+            enforce_quota(http_request, db, request.user_id)
+            response = await ollama_client.generate_study_plan(
+                format_digest(learner_digest(db, user)), plan["topics"]
+            )
+            narrative = response["response"]
 
         study_plan = StudyPlan(
             user_id=request.user_id,
-            plan=response["response"],
+            plan={"topics": plan["topics"], "narrative": narrative},
             duration=request.duration,
             status="Active",
             progress=0.0,
+            goals=plan["goals"],
+            schedule=plan["schedule"],
+            milestones=plan["milestones"],
         )
         db.add(study_plan)
         db.commit()
         db.refresh(study_plan)
 
-        return {"message": "Study plan created successfully", "plan_id": study_plan.id}
+        return {
+            "message": "Study plan created successfully",
+            "plan_id": study_plan.id,
+            "narrative": narrative,
+            **plan,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -193,34 +903,48 @@ async def update_progress(progress: ProgressUpdate, db: Session = Depends(get_db
             feedback=progress.feedback,
         )
         db.add(db_progress)
+        db.flush()
+        mastery = update_mastery(db, db_progress)
+        if mastery is not None:
+            replan_active_plans(
+                db, progress.user_id, [(mastery.subject, mastery.topic)]
+            )
         db.commit()
-        db.refresh(db_progress)
-
-        # Get learning recommendations
-        recommendations = await ollama_client.get_learning_recommendations(
-            progress.dict()
-        )
 
         return {
             "message": "Progress updated successfully",
-            "recommendations": recommendations["response"],
+            "mastery": serialize_mastery(mastery) if mastery else None,
+            "recommendations": recommend(db, progress.user_id),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/recommendations/{user_id}")
+async def get_recommendations(
+    user_id: int, limit: int = Query(5, ge=1, le=50), db: Session = Depends(get_db)
+):
+    return {"user_id": user_id, "recommendations": recommend(db, user_id, limit)}
+
+
 @app.post("/api/upload-paper")
 async def upload_question_paper(
+    http_request: Request,
     file: UploadFile = File(...),
     subject: str = Form(...),
     user_id: int = Form(...),
     db: Session = Depends(get_db),
 ):
+    attribute_user(user_id)
     try:
+        content = await file.read()
+        # Analysis cost grows with the part of the paper that fits the prompt
+        analyzed = min(len(content), PROMPT_BUDGETS["paper_analysis"] * CHARS_PER_TOKEN)
+        enforce_quota(http_request, db, user_id, analyzed / 1000)
+
         # Save the file
         file_path = f"uploads/{user_id}_{file.filename}"
         with open(file_path, "wb") as buffer:
-            content = await file.read()
             buffer.write(content)
 
         # Analyze the paper
@@ -241,6 +965,8 @@ async def upload_question_paper(
             },
         )
         db.add(paper)
+        db.flush()
+        index_paper(db, paper, content)
         db.commit()
         db.refresh(paper)
 
@@ -248,35 +974,114 @@ async def upload_question_paper(
             "message": "Paper uploaded and analyzed successfully",
             "analysis": analysis["response"],
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/progress/{user_id}")
-async def get_progress(user_id: int, db: Session = Depends(get_db)):
+async def get_progress(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    full_history: bool = False,
+    db: Session = Depends(get_db),
+):
+    # Archived rows are read from the archive database on request
+    if full_history:
+        return await asyncio.to_thread(
+            archived_history, "progress", user_id, bind=db.get_bind()
+        )
+    not_modified = conditional_get(http_request, response, db, user_id, "progress")
+    if not_modified:
+        return not_modified
     progress = db.query(Progress).filter(Progress.user_id == user_id).all()
     return progress
 
 
 @app.get("/api/study-plans/{user_id}")
-async def get_study_plans(user_id: int, db: Session = Depends(get_db)):
-    plans = db.query(StudyPlan).filter(StudyPlan.user_id == user_id).all()
-    return plans
+async def get_study_plans(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    include_content: bool = False,
+    db: Session = Depends(get_db),
+):
+    not_modified = conditional_get(
+        http_request,
+        response,
+        db,
+        user_id,
+        "study_plans",
+        extra_versions={"content": int(include_content)},
+    )
+    if not_modified:
+        return not_modified
+    # Large compressed columns are only loaded when asked for
+    query = db.query(StudyPlan).filter(StudyPlan.user_id == user_id)
+    if include_content:
+        query = query.options(undefer(StudyPlan.plan))
+    return query.all()
 
 
 @app.get("/api/question-papers/{user_id}")
-async def get_question_papers(user_id: int, db: Session = Depends(get_db)):
-    papers = db.query(QuestionPaper).filter(QuestionPaper.user_id == user_id).all()
-    return papers
+async def get_question_papers(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    include_content: bool = False,
+    db: Session = Depends(get_db),
+):
+    not_modified = conditional_get(
+        http_request,
+        response,
+        db,
+        user_id,
+        "question_papers",
+        extra_versions={"content": int(include_content)},
+    )
+    if not_modified:
+        return not_modified
+    query = db.query(QuestionPaper).filter(QuestionPaper.user_id == user_id)
+    if include_content:
+        query = query.options(undefer(QuestionPaper.analysis))
+    return query.all()
+
+
+@app.get("/api/search")
+async def search(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    unknown = set(kinds or []) - set(KIND_CODES)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown search types: {', '.join(sorted(unknown))}",
+        )
+    return search_documents(db, user_id, q, kinds, limit, offset)
 
 
 @app.post("/api/interactive-element")
 async def create_interactive_element(
-    request: InteractiveElementRequest, db: Session = Depends(get_db)
+    request: InteractiveElementRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
 ):
+    attribute_user(request.user_id)
+    enforce_quota(http_request, db, request.user_id)
     try:
         response = await ollama_client.generate_interactive_element(
-            request.subject, request.topic, request.element_type
+            request.subject,
+            request.topic,
+            request.element_type,
+            user_id=request.user_id,
         )
 
         element = InteractiveElement(
@@ -302,79 +1107,204 @@ async def create_interactive_element(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/flashcards")
-async def generate_flashcards(request: FlashcardRequest, db: Session = Depends(get_db)):
-    try:
-        response = await ollama_client.generate_flashcards(
-            request.subject, request.topic, request.num_cards
+async def create_flashcards(
+    db: Session, request: FlashcardRequest, fresh_only: bool = False
+) -> Tuple[List[Flashcard], int, dict]:
+    """Generate, de-duplicate and store cards; returns (cards, skipped, response).
+
+    With ``fresh_only`` nothing is stored from a cached generation.
+    """
+    response = await ollama_client.generate_flashcards(
+        request.subject, request.topic, request.num_cards, user_id=request.user_id
+    )
+    if fresh_only and response.get("cached"):
+        return [], 0, response
+
+    cards = [
+        (card_data.split("\n")[0], "\n".join(card_data.split("\n")[1:]))
+        for card_data in response["response"].split("\n\n")
+        if card_data.strip()
+    ]
+    kept = await ollama_client.filter_duplicate_flashcards(
+        request.user_id, request.subject, cards
+    )
+
+    flashcards = []
+    for index, _ in kept:
+        front, back = cards[index]
+        card = Flashcard(
+            user_id=request.user_id,
+            subject=request.subject,
+            topic=request.topic,
+            front=front,
+            back=back,
+            difficulty="Medium",
+            category="Concept",
+            review_count=0,
+            mastery_level=0.0,
         )
+        db.add(card)
+        flashcards.append(card)
 
-        flashcards = []
-        for card_data in response["response"].split("\n\n"):
-            if card_data.strip():
-                card = Flashcard(
-                    user_id=request.user_id,
-                    subject=request.subject,
-                    topic=request.topic,
-                    front=card_data.split("\n")[0],
-                    back="\n".join(card_data.split("\n")[1:]),
-                    difficulty="Medium",
-                    category="Concept",
-                    review_count=0,
-                    mastery_level=0.0,
-                )
-                db.add(card)
-                flashcards.append(card)
+    db.commit()
+    ollama_client.remember_flashcards(
+        request.user_id,
+        request.subject,
+        [(card.id, embedding) for card, (_, embedding) in zip(flashcards, kept)],
+    )
+    return flashcards, len(cards) - len(flashcards), response
 
-        db.commit()
+
+async def regenerate_flashcards(request: FlashcardRequest, new_session=SessionLocal):
+    with new_session() as db:
+        await create_flashcards(db, request, fresh_only=True)
+
+
+@app.post("/api/flashcards")
+async def generate_flashcards(
+    request: FlashcardRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    attribute_user(request.user_id)
+    try:
+        if ollama_client.is_overloaded("mixtral"):
+            flashcards = stale_flashcards(
+                db, request.user_id, request.subject, request.topic
+            )
+            if flashcards:
+                if within_quota(http_request, db, request.user_id, request.num_cards):
+                    background_tasks.add_task(
+                        regenerate_once,
+                        (
+                            "flashcards",
+                            request.user_id,
+                            *bank_key(request.subject, request.topic, ""),
+                        ),
+                        functools.partial(
+                            regenerate_flashcards, request, session_factory(db)
+                        ),
+                    )
+                return {
+                    "message": "Generation is busy; showing your existing flashcards",
+                    "duplicates_skipped": 0,
+                    "flashcards": [
+                        {"id": f.id, "front": f.front, "back": f.back}
+                        for f in flashcards
+                    ],
+                    "stale": True,
+                }
+
+        enforce_quota(http_request, db, request.user_id, request.num_cards)
+        flashcards, skipped, response = await create_flashcards(db, request)
         return {
             "message": f"{len(flashcards)} flashcards created successfully",
+            "duplicates_skipped": skipped,
             "flashcards": [
                 {"id": f.id, "front": f.front, "back": f.back} for f in flashcards
             ],
+            "stale": response.get("stale", False),
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/flashcards/{user_id}")
-async def get_flashcards(user_id: int, db: Session = Depends(get_db)):
+async def get_flashcards(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    not_modified = conditional_get(http_request, response, db, user_id, "flashcards")
+    if not_modified:
+        return not_modified
     flashcards = db.query(Flashcard).filter(Flashcard.user_id == user_id).all()
     return flashcards
 
 
+@app.get("/api/flashcards/{user_id}/review-queue")
+async def get_review_queue(
+    user_id: int, limit: int = Query(20, ge=1, le=100), db: Session = Depends(get_db)
+):
+    flashcards = review_queue(db, user_id, limit)
+    return [
+        {"id": f.id, "front": f.front, "back": f.back, "difficulty": f.difficulty}
+        for f in flashcards
+    ]
+
+
 @app.post("/api/flashcards/{flashcard_id}/review")
 async def review_flashcard(
-    flashcard_id: int, mastery_level: float, db: Session = Depends(get_db)
+    flashcard_id: int,
+    mastery_level: float,
+    user_id: int,  # Card ids are per shard, so the owner picks the shard
+    db: Session = Depends(get_db),
 ):
     flashcard = db.query(Flashcard).filter(Flashcard.id == flashcard_id).first()
-    if not flashcard:
+    if not flashcard or flashcard.user_id != user_id:
         raise HTTPException(status_code=404, detail="Flashcard not found")
 
     flashcard.mastery_level = mastery_level
     flashcard.review_count += 1
     flashcard.last_reviewed = datetime.utcnow()
+    db.add(
+        FlashcardReview(
+            flashcard_id=flashcard.id,
+            user_id=flashcard.user_id,
+            mastery_level=mastery_level,
+            correct=mastery_level >= RECALL_THRESHOLD,
+            reviewed_at=flashcard.last_reviewed,
+        )
+    )
 
     db.commit()
     return {"message": "Flashcard reviewed successfully"}
 
 
 @app.get("/api/interactive-elements/{user_id}")
-async def get_interactive_elements(user_id: int, db: Session = Depends(get_db)):
-    elements = (
-        db.query(InteractiveElement).filter(InteractiveElement.user_id == user_id).all()
+async def get_interactive_elements(
+    user_id: int,
+    http_request: Request,
+    response: Response,
+    full_history: bool = False,
+    include_content: bool = False,
+    db: Session = Depends(get_db),
+):
+    if full_history:
+        return await asyncio.to_thread(
+            archived_history, "interactive_elements", user_id, bind=db.get_bind()
+        )
+    not_modified = conditional_get(
+        http_request,
+        response,
+        db,
+        user_id,
+        "interactive_elements",
+        extra_versions={"content": int(include_content)},
     )
-    return elements
+    if not_modified:
+        return not_modified
+    query = db.query(InteractiveElement).filter(InteractiveElement.user_id == user_id)
+    if include_content:
+        query = query.options(undefer(InteractiveElement.content))
+    return query.all()
 
 
 @app.post("/api/interactive-elements/{element_id}/complete")
 async def complete_interactive_element(
-    element_id: int, feedback: dict, db: Session = Depends(get_db)
+    element_id: int,
+    feedback: dict,
+    user_id: int,  # Element ids are per shard, so the owner picks the shard
+    db: Session = Depends(get_db),
 ):
     element = (
         db.query(InteractiveElement).filter(InteractiveElement.id == element_id).first()
     )
-    if not element:
+    if not element or element.user_id != user_id:
         raise HTTPException(status_code=404, detail="Interactive element not found")
 
     element.completion_status = True
@@ -0,0 +1,226 @@
+"""Pre-generate syllabus content ahead of time.
+
+Usage:
+    python -m app.pregenerate syllabus.json \\
+        --backend http://gpu1:11434 --backend http://gpu2:11434 --concurrency 2
+
+The syllabus file lists subjects with their topics and levels:
+
+    {"subjects": [{"name": "Physics",
+                   "levels": ["Beginner", "Advanced"],
+                   "topics": ["Newton's laws", "Thermodynamics"]}]}
+
+For every subject x topic x level this fills the shared lessons table, tops up
+the question bank and warms the generation cache (lessons and flashcard
+decks), so peak-hour requests are served without waiting on the GPUs.
+Completed tasks are recorded in a checkpoint file; re-running the command
+resumes where it stopped.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Set, Tuple
+
+from models.database import Lesson, SessionLocal
+from utils.ollama_client import OllamaClient
+from utils.question_bank import bank_key, bank_size, refill_question_bank
+from utils.usage import begin_attribution
+
+Task = Tuple[str, str, str, str]  # (kind, subject, topic, level)
+
+# Give up on a topic's question bank after this many empty batches in a row
+MAX_EMPTY_BATCHES = 3
+
+
+def load_syllabus(path: str) -> List[Task]:
+    with open(path) as f:
+        syllabus = json.load(f)
+    tasks: List[Task] = []
+    for subject in syllabus["subjects"]:
+        levels = subject.get("levels") or ["Beginner"]
+        for topic in subject["topics"]:
+            for level in levels:
+                tasks.append(("lesson", subject["name"], topic, level))
+                tasks.append(("quiz_bank", subject["name"], topic, level))
+            # Flashcard decks are not level specific
+            tasks.append(("flashcards", subject["name"], topic, ""))
+    return tasks
+
+
+def task_id(task: Task) -> str:
+    return "|".join(task)
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f)["done"])
+
+    def mark_done(self, task: Task):
+        self.done.add(task_id(task))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+
+async def run_task(client: OllamaClient, task: Task, args) -> None:
+    kind, subject, topic, level = task
+    if kind == "lesson":
+        response = await client.generate_lesson(subject, topic, level)
+        with SessionLocal() as db:
+            exists = (
+                db.query(Lesson.id)
+                .filter(
+                    Lesson.user_id.is_(None),
+                    Lesson.subject == subject,
+                    Lesson.topic == topic,
+                    Lesson.level == level,
+                )
+                .first()
+            )
+            if not exists:
+                db.add(
+                    Lesson(
+                        subject=subject,
+                        topic=topic,
+                        level=level,
+                        content=response["response"],
+                    )
+                )
+                db.commit()
+    elif kind == "quiz_bank":
+        empty_batches = 0
+        while empty_batches < MAX_EMPTY_BATCHES:
+            with SessionLocal() as db:
+                if bank_size(db, subject, topic, level) >= args.questions:
+                    return
+            added = await refill_question_bank(client, subject, topic, level)
+            empty_batches = 0 if added else empty_batches + 1
+        raise RuntimeError(f"no usable questions generated for {bank_key(*task[1:])}")
+    elif kind == "flashcards":
+        await client.generate_flashcards(subject, topic, args.cards)
+
+
+async def worker(
+    name: str,
+    client: OllamaClient,
+    queue: asyncio.Queue,
+    checkpoint: Checkpoint,
+    args,
+    totals: Dict,
+):
+    while True:
+        task = await queue.get()
+        started = time.perf_counter()
+        try:
+            await run_task(client, task, args)
+            checkpoint.mark_done(task)
+            totals["done"] += 1
+            status = "ok"
+        except Exception as e:
+            totals["failed"] += 1
+            status = f"failed: {e}"
+        finally:
+            queue.task_done()
+        print(
+            f"[{totals['done'] + totals['failed']}/{totals['total']}] {name} "
+            f"{' / '.join(filter(None, task))} "
+            f"{time.perf_counter() - started:.1f}s {status}",
+            flush=True,
+        )
+
+
+async def pregenerate(args) -> None:
+    begin_attribution("pregenerate")
+    checkpoint = Checkpoint(args.checkpoint)
+    tasks = [
+        t for t in load_syllabus(args.syllabus) if task_id(t) not in checkpoint.done
+    ]
+    totals = {"total": len(tasks), "done": 0, "failed": 0}
+    print(f"{len(tasks)} tasks to run ({len(checkpoint.done)} already done)")
+    if not tasks:
+        return
+
+    # One client per backend, all sharing the first client's cache indexes
+    clients = [OllamaClient(base_url) for base_url in args.backend[:1]]
+    for base_url in args.backend[1:]:
+        client = OllamaClient(base_url, cache_dir=None)
+        client.generation_index = clients[0].generation_index
+        client.flashcard_index = clients[0].flashcard_index
+        clients.append(client)
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait(task)
+
+    started = time.perf_counter()
+    workers = [
+        asyncio.create_task(
+            worker(f"{client.base_url}#{i}", client, queue, checkpoint, args, totals)
+        )
+        for client in clients
+        for i in range(args.concurrency)
+    ]
+    await queue.join()
+    for w in workers:
+        w.cancel()
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"\nFinished in {elapsed:.1f}s: {totals['done']} done, {totals['failed']} failed"
+    )
+    print(f"Throughput: {totals['done'] / elapsed * 60:.1f} tasks/min")
+    for client in clients:
+        stats = client.stats
+        print(
+            f"  {client.base_url}: {stats['requests']} generations, "
+            f"{stats['cache_hits']} cache hits, "
+            f"{stats['eval_count'] / elapsed:.1f} tokens/s generated"
+        )
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("syllabus", help="Path to the syllabus JSON file")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help="Ollama base URL; repeat for several backends",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Concurrent generations per backend",
+    )
+    parser.add_argument(
+        "--questions",
+        type=int,
+        default=30,
+        help="Question bank size to reach per topic and level",
+    )
+    parser.add_argument(
+        "--cards", type=int, default=10, help="Cards per flashcard deck"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="pregenerate.checkpoint.json",
+        help="Progress file used to resume interrupted runs",
+    )
+    args = parser.parse_args()
+    args.backend = args.backend or [
+        os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+    ]
+    asyncio.run(pregenerate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
+import itertools
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import httpx
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Constants
 API_URL = "http://localhost:8000"
 SUBJECTS = ["Mathematics", "Physics", "Chemistry", "Biology", "Computer Science"]
 LEVELS = ["Beginner", "Moderate", "Advanced"]
 QUESTION_TYPES = ["multiple_choice", "true_false", "short_answer", "essay"]
+PLAN_DURATIONS = {"1 Week": 7, "2 Weeks": 14, "1 Month": 30, "3 Months": 90}
+# Seconds a GET response is reused across reruns before it is revalidated
+READ_CACHE_TTL = 30
+# Responses kept with their ETag for conditional revalidation
+VALIDATOR_CACHE_SIZE = 256
 
 # Page config
 st.set_page_config(
@@ -146,6 +156,108 @@ if "quiz_answers" not in st.session_state:
     st.session_state.quiz_answers = {}
 
 
+@st.cache_resource
+def get_http_client() -> httpx.Client:
+    """Pooled keep-alive client shared by every session and rerun."""
+    return httpx.Client(
+        base_url=API_URL,
+        # Generation endpoints can take minutes to respond
+        timeout=httpx.Timeout(10.0, read=600.0),
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+
+
+class ValidatorCache:
+    """Bounded map of path -> (ETag, body) for conditional GETs."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry:
+                self.entries.move_to_end(path)
+            return entry
+
+    def put(self, path: str, etag: str, body):
+        with self.lock:
+            self.entries[path] = (etag, body)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_validator_cache() -> ValidatorCache:
+    return ValidatorCache(VALIDATOR_CACHE_SIZE)
+
+
+@st.cache_resource
+def get_write_marks() -> dict:
+    """Per user, a number that changes whenever that user posts a write."""
+    return {}
+
+
+# Shared by every session, so no two writes get the same mark
+write_counter = itertools.count(1)
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def cached_get(path: str, user_id, write_mark: int):
+    """GET ``path`` and return ``(status_code, json_body)``.
+
+    The cache is shared by every session; ``user_id`` and ``write_mark`` are
+    only part of the key, so one user's writes invalidate just their reads.
+    Once the TTL expires the request carries the last ETag, and a 304 reuses
+    the stored body instead of downloading it again.
+    """
+    validators = get_validator_cache()
+    cached = validators.get(path)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = get_http_client().get(path, headers=headers)
+    if response.status_code == 304 and cached:
+        return 200, cached[1]
+    body = response.json() if response.status_code == 200 else None
+    if response.status_code == 200 and "ETag" in response.headers:
+        validators.put(path, response.headers["ETag"], body)
+    return response.status_code, body
+
+
+def api_get(path: str):
+    """GET ``path`` for the signed-in user, cached across reruns."""
+    user_id = st.session_state.user_id
+    return cached_get(path, user_id, get_write_marks().get(user_id, 0))
+
+
+def api_post(path: str, **kwargs) -> httpx.Response:
+    """POST ``path`` and drop this user's cached reads, which it may have changed.
+
+    Superseded entries are not removed, they just stop being read and expire
+    with the TTL.
+    """
+    response = get_http_client().post(path, **kwargs)
+    get_write_marks()[st.session_state.user_id] = next(write_counter)
+    return response
+
+
+def prefetch(*paths: str):
+    """Warm the read cache for independent GETs concurrently."""
+    ctx = get_script_run_ctx()
+
+    def fetch(path):
+        add_script_run_ctx(ctx=ctx)
+        try:
+            api_get(path)
+        except httpx.HTTPError:
+            pass  # The page reports the error when it reads the path
+
+    with ThreadPoolExecutor(max_workers=len(paths) or 1) as executor:
+        list(executor.map(fetch, paths))
+
+
 def show_profile_page():
     st.title("👤 User Profile")
 
@@ -168,8 +280,8 @@ def show_profile_page():
             if st.button("Save Profile", key="save_profile"):
                 with st.spinner("Saving profile..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/profiles",
+                        response = api_post(
+                            "/api/profiles",
                             json={"name": name, "subject_levels": subject_levels},
                         )
                         if response.status_code == 200:
@@ -215,8 +327,8 @@ def show_lessons_page():
             if st.button("Generate Lesson"):
                 with st.spinner("Generating lesson..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/lessons",
+                        response = api_post(
+                            "/api/lessons",
                             json={
                                 "user_id": st.session_state.user_id,
                                 "subject": subject,
@@ -236,11 +348,11 @@ def show_lessons_page():
         with col2:
             st.subheader("Recent Lessons")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/progress/{st.session_state.user_id}"
+                status, dashboard = api_get(
+                    f"/api/users/{st.session_state.user_id}/dashboard"
                 )
-                if response.status_code == 200:
-                    progress = response.json()
+                if status == 200:
+                    progress = dashboard["subjects"]
                     if progress:
                         for subject, data in progress.items():
                             with st.expander(f"{subject} Progress"):
@@ -264,8 +376,8 @@ def show_lessons_page():
 
         if st.button("Mark as Complete"):
             try:
-                response = httpx.post(
-                    f"{API_URL}/api/progress",
+                response = api_post(
+                    "/api/progress",
                     json={
                         "user_id": st.session_state.user_id,
                         "subject": lesson["subject"],
@@ -296,23 +408,31 @@ def show_quizzes_page():
             st.subheader("Generate New Quiz")
             subject = st.selectbox("Subject", SUBJECTS)
             topic = st.text_input("Topic", placeholder="Enter a topic")
+            level = st.selectbox("Level", LEVELS)
             num_questions = st.slider("Number of Questions", 1, 20, 5)
 
             if st.button("Generate Quiz"):
                 with st.spinner("Generating quiz..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/quizzes",
+                        response = api_post(
+                            "/api/quiz",
                             json={
                                 "user_id": st.session_state.user_id,
                                 "subject": subject,
                                 "topic": topic,
+                                "level": level,
                                 "num_questions": num_questions,
                             },
                         )
                         if response.status_code == 200:
                             quiz = response.json()
-                            st.session_state.current_quiz = quiz
+                            st.session_state.current_quiz = {
+                                **quiz,
+                                "subject": subject,
+                                "topic": topic,
+                            }
+                            st.session_state.quiz_answers = {}
+                            st.session_state.quiz_started = time.time()
                             st.success("Quiz generated successfully!")
                         else:
                             st.error("Error generating quiz")
@@ -322,11 +442,11 @@ def show_quizzes_page():
         with col2:
             st.subheader("Quiz History")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/progress/{st.session_state.user_id}"
+                status, dashboard = api_get(
+                    f"/api/users/{st.session_state.user_id}/dashboard"
                 )
-                if response.status_code == 200:
-                    progress = response.json()
+                if status == 200:
+                    progress = dashboard["subjects"]
                     if progress:
                         for subject, data in progress.items():
                             with st.expander(f"{subject} Quiz History"):
@@ -341,7 +461,7 @@ def show_quizzes_page():
             except Exception as e:
                 st.error(f"Error: {str(e)}")
 
-    if "current_quiz" in st.session_state:
+    if st.session_state.current_quiz:
         show_quiz_interface()
 
 
@@ -350,47 +470,50 @@ def show_quiz_interface():
     st.markdown("---")
     st.subheader(f"Quiz: {quiz['topic']}")
 
-    if "answers" not in st.session_state:
-        st.session_state.answers = {}
-        st.session_state.score = 0
-
     for i, question in enumerate(quiz["questions"]):
         st.markdown(f"### Question {i+1}")
         st.markdown(question["question"])
 
-        options = question["options"]
-        selected_option = st.radio(
-            "Select your answer:", options, key=f"q_{i}", index=None
-        )
+        if question["options"]:
+            answer = st.radio(
+                "Select your answer:",
+                question["options"],
+                key=f"q_{question['id']}",
+                index=None,
+            )
+        else:
+            answer = st.text_input("Your answer:", key=f"q_{question['id']}")
 
-        if selected_option:
-            st.session_state.answers[i] = selected_option
+        if answer:
+            st.session_state.quiz_answers[question["id"]] = answer
 
     if st.button("Submit Quiz"):
-        score = 0
-        for i, question in enumerate(quiz["questions"]):
-            if st.session_state.answers.get(i) == question["correct_answer"]:
-                score += 1
-
-        st.session_state.score = (score / len(quiz["questions"])) * 100
-        st.success(f"Quiz completed! Your score: {st.session_state.score:.1f}%")
-
         try:
-            response = httpx.post(
-                f"{API_URL}/api/progress",
+            # Graded on the server against the stored answer key
+            response = api_post(
+                "/api/quiz/submit",
                 json={
                     "user_id": st.session_state.user_id,
+                    "answers": {
+                        question["id"]: st.session_state.quiz_answers.get(
+                            question["id"]
+                        )
+                        for question in quiz["questions"]
+                    },
+                    "time_spent": int(time.time() - st.session_state.quiz_started),
                     "subject": quiz["subject"],
                     "topic": quiz["topic"],
-                    "quiz_score": st.session_state.score,
                 },
             )
             if response.status_code == 200:
-                st.success("Progress saved!")
-                del st.session_state.current_quiz
-                del st.session_state.answers
+                score = response.json()["score"]
+                st.success(f"Quiz completed! Your score: {score:.1f}%")
+                st.session_state.current_quiz = None
+                st.session_state.quiz_answers = {}
                 time.sleep(1)
                 st.experimental_rerun()
+            else:
+                st.error("Error submitting quiz")
         except Exception as e:
             st.error(f"Error: {str(e)}")
 
@@ -407,18 +530,18 @@ def show_study_plan_page():
 
         with col1:
             st.subheader("Generate Study Plan")
-            time_frame = st.selectbox(
-                "Time Frame", ["1 Week", "2 Weeks", "1 Month", "3 Months"]
-            )
+            time_frame = st.selectbox("Time Frame", list(PLAN_DURATIONS))
+            narrative = st.checkbox("Include an AI-written overview")
 
             if st.button("Generate Plan"):
                 with st.spinner("Generating study plan..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/study-plan",
+                        response = api_post(
+                            "/api/study-plan",
                             json={
                                 "user_id": st.session_state.user_id,
-                                "time_frame": time_frame,
+                                "duration": PLAN_DURATIONS[time_frame],
+                                "narrative": narrative,
                             },
                         )
                         if response.status_code == 200:
@@ -433,11 +556,8 @@ def show_study_plan_page():
         with col2:
             st.subheader("Study Goals")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/profiles/{st.session_state.user_id}"
-                )
-                if response.status_code == 200:
-                    profile = response.json()
+                status, profile = api_get(f"/api/profiles/{st.session_state.user_id}")
+                if status == 200:
                     st.markdown("### Current Levels")
                     for subject, level in profile["subject_levels"].items():
                         st.markdown(f"**{subject}**: {level}")
@@ -450,7 +570,24 @@ def show_study_plan_page():
         st.markdown("---")
         st.subheader("Your Study Plan")
         plan = st.session_state.current_plan
-        st.markdown(plan["plan"])
+        if plan.get("narrative"):
+            st.markdown(plan["narrative"])
+        for day in plan["schedule"]:
+            if not day["sessions"]:
+                continue
+            st.markdown(f"**{day['date']}**")
+            for session in day["sessions"]:
+                start = f"{session['start']} · " if session["start"] else ""
+                st.markdown(
+                    f"- {start}{session['minutes']} min: "
+                    f"{session['activity'].title()} {session['topic']} "
+                    f"({session['subject']})"
+                )
+        if plan["unscheduled"]:
+            st.info(
+                "Not enough time for: "
+                + ", ".join(t["topic"] for t in plan["unscheduled"])
+            )
 
 
 def show_progress_page():
@@ -461,9 +598,9 @@ def show_progress_page():
         return
 
     try:
-        response = httpx.get(f"{API_URL}/api/progress/{st.session_state.user_id}")
-        if response.status_code == 200:
-            progress = response.json()
+        status, dashboard = api_get(f"/api/users/{st.session_state.user_id}/dashboard")
+        if status == 200:
+            progress = dashboard["subjects"]
             if progress:
                 for subject, data in progress.items():
                     with st.expander(f"{subject} Progress", expanded=True):
@@ -507,8 +644,8 @@ def show_question_papers_page():
                 with st.spinner("Uploading and analyzing..."):
                     try:
                         files = {"file": (file.name, file, file.type)}
-                        response = httpx.post(
-                            f"{API_URL}/api/upload-paper",
+                        response = api_post(
+                            "/api/upload-paper",
                             files=files,
                             data={
                                 "subject": subject,
@@ -528,11 +665,10 @@ def show_question_papers_page():
         with col2:
             st.subheader("Uploaded Papers")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/question-papers/{st.session_state.user_id}"
+                status, papers = api_get(
+                    f"/api/question-papers/{st.session_state.user_id}?include_content=true"
                 )
-                if response.status_code == 200:
-                    papers = response.json()
+                if status == 200:
                     if papers:
                         for paper in papers:
                             with st.expander(paper["subject"]):
@@ -565,8 +701,8 @@ def show_flashcards_page():
             if st.button("Generate Flashcards"):
                 with st.spinner("Generating flashcards..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/flashcards",
+                        response = api_post(
+                            "/api/flashcards",
                             json={
                                 "user_id": st.session_state.user_id,
                                 "subject": subject,
@@ -587,23 +723,17 @@ def show_flashcards_page():
         with col2:
             st.subheader("Flashcard Stats")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/flashcards/{st.session_state.user_id}"
+                status, dashboard = api_get(
+                    f"/api/users/{st.session_state.user_id}/dashboard"
                 )
-                if response.status_code == 200:
-                    flashcards = response.json()
-                    if flashcards:
-                        total_cards = len(flashcards)
-                        mastered_cards = sum(
-                            1
-                            for card in flashcards
-                            if card.get("mastery_level", 0) >= 0.8
-                        )
+                if status == 200:
+                    total_cards = dashboard["flashcards"]["total"]
+                    if total_cards:
+                        mastered_cards = dashboard["flashcards"]["mastered"]
                         st.metric("Total Cards", total_cards)
                         st.metric("Mastered Cards", mastered_cards)
-                        st.progress(
-                            mastered_cards / total_cards if total_cards > 0 else 0
-                        )
+                        st.metric("Due for Review", dashboard["flashcards"]["due"])
+                        st.progress(mastered_cards / total_cards)
                     else:
                         st.info("No flashcards available")
                 else:
@@ -632,9 +762,10 @@ def show_flashcards_page():
                 )
                 if st.button("Save Review", key=f"review_{card['id']}"):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/flashcards/{card['id']}/review",
+                        response = api_post(
+                            f"/api/flashcards/{card['id']}/review",
                             json={"mastery_level": mastery},
+                            params={"user_id": st.session_state.user_id},
                         )
                         if response.status_code == 200:
                             st.success("Review saved!")
@@ -663,8 +794,8 @@ def show_interactive_elements_page():
             if st.button("Generate Element"):
                 with st.spinner("Generating interactive element..."):
                     try:
-                        response = httpx.post(
-                            f"{API_URL}/api/interactive-element",
+                        response = api_post(
+                            "/api/interactive-element",
                             json={
                                 "user_id": st.session_state.user_id,
                                 "subject": subject,
@@ -683,23 +814,18 @@ def show_interactive_elements_page():
         with col2:
             st.subheader("Interactive Elements Stats")
             try:
-                response = httpx.get(
-                    f"{API_URL}/api/interactive-elements/{st.session_state.user_id}"
+                status, dashboard = api_get(
+                    f"/api/users/{st.session_state.user_id}/dashboard"
                 )
-                if response.status_code == 200:
-                    elements = response.json()
-                    if elements:
-                        total_elements = len(elements)
-                        completed_elements = sum(
-                            1 for e in elements if e["completion_status"]
-                        )
+                if status == 200:
+                    total_elements = dashboard["interactive_elements"]["total"]
+                    if total_elements:
+                        completed_elements = dashboard["interactive_elements"][
+                            "completed"
+                        ]
                         st.metric("Total Elements", total_elements)
                         st.metric("Completed Elements", completed_elements)
-                        st.progress(
-                            completed_elements / total_elements
-                            if total_elements > 0
-                            else 0
-                        )
+                        st.progress(completed_elements / total_elements)
                     else:
                         st.info("No interactive elements available")
                 else:
@@ -722,9 +848,10 @@ def show_interactive_elements_page():
             feedback = st.text_area("Feedback", key=f"feedback_{element['id']}")
             if st.button("Mark as Complete", key=f"complete_{element['id']}"):
                 try:
-                    response = httpx.post(
-                        f"{API_URL}/api/interactive-elements/{element['id']}/complete",
+                    response = api_post(
+                        f"/api/interactive-elements/{element['id']}/complete",
                         json={"time_spent": time_spent * 60, "feedback": feedback},
+                        params={"user_id": st.session_state.user_id},
                     )
                     if response.status_code == 200:
                         st.success("Element completed!")
@@ -735,17 +862,19 @@ def show_interactive_elements_page():
                     st.error(f"Error: {str(e)}")
 
 
+# GET paths each page reads besides the dashboard, fetched alongside it
+PAGE_READS = {
+    "📅 Study Plan": ["/api/profiles/{user_id}"],
+    "📄 Question Papers": ["/api/question-papers/{user_id}?include_content=true"],
+}
+
+
 # Main app
 def main():
     # Sidebar navigation
     st.sidebar.title("🎓 AI Personal Tutor")
     st.sidebar.markdown("---")
 
-    if st.session_state.user_id:
-        st.sidebar.success(f"Logged in as User #{st.session_state.user_id}")
-    else:
-        st.sidebar.info("Please create a profile to get started")
-
     page = st.sidebar.radio(
         "Navigation",
         [
@@ -760,6 +889,27 @@ def main():
         ],
     )
 
+    st.sidebar.markdown("---")
+    if st.session_state.user_id:
+        user_id = st.session_state.user_id
+        prefetch(
+            f"/api/users/{user_id}/dashboard",
+            *(path.format(user_id=user_id) for path in PAGE_READS.get(page, [])),
+        )
+        st.sidebar.success(f"Logged in as User #{user_id}")
+        try:
+            status, dashboard = api_get(f"/api/users/{user_id}/dashboard")
+            if status == 200:
+                counts = dashboard["counts"]
+                st.sidebar.markdown(f"**Study sessions**: {counts['progress_entries']}")
+                st.sidebar.markdown(
+                    f"**Flashcards due**: {dashboard['flashcards']['due']}"
+                )
+        except Exception as e:
+            st.sidebar.error(f"Error: {str(e)}")
+    else:
+        st.sidebar.info("Please create a profile to get started")
+
     st.sidebar.markdown("---")
     st.sidebar.markdown("### About")
     st.sidebar.info(
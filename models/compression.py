@@ -0,0 +1,155 @@
+"""Dictionary-based compression for large generated text columns.
+
+Generated lessons, plans and analyses repeat the same phrasing, markdown and
+JSON keys, so a preset dictionary trained on them lets zlib compress even a
+few kilobytes well. Compressed values are stored as blobs:
+
+    0x01 | dictionary id (2 bytes, big-endian; 0 = none) | raw deflate stream
+
+Short values, and values that do not shrink, stay plain text. Readers accept
+both, so rows written before compression was enabled keep working and the
+migration in ``utils.compression_dictionary`` can convert them in place.
+
+This module holds no database state: ``models.database`` registers a loader
+that returns the stored dictionaries.
+"""
+
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional, Union
+
+FORMAT = 1
+HEADER_BYTES = 3
+LEVEL = 9
+# Values shorter than this are not worth compressing
+MIN_COMPRESS_BYTES = 128
+# zlib can only refer back 32 KB, so a larger dictionary is never used
+DICTIONARY_SIZE = 32 * 1024
+# Dictionary entries are runs of this many words seen in several samples
+SEGMENT_WORDS = 4
+MIN_DOCUMENT_FREQUENCY = 3
+
+_WORDS = re.compile(rb"\S+\s*")
+
+_lock = threading.Lock()
+_dictionaries: Dict[int, bytes] = {}
+_current = 0
+_loaded = False
+_loader: Optional[Callable[[], Dict[int, bytes]]] = None
+
+
+def set_loader(loader: Callable[[], Dict[int, bytes]]) -> None:
+    """Register the function returning ``{dictionary id: dictionary}``."""
+    global _loader, _loaded
+    _loader = loader
+    _loaded = False
+
+
+def reload() -> None:
+    """Re-read the dictionaries; new values use the highest id."""
+    global _dictionaries, _current, _loaded
+    with _lock:
+        _dictionaries = dict(_loader()) if _loader else {}
+        _current = max(_dictionaries, default=0)
+        _loaded = True
+
+
+def _ensure_loaded():
+    if not _loaded:
+        reload()
+
+
+def current_dictionary() -> int:
+    _ensure_loaded()
+    return _current
+
+
+def compress(text: str) -> Union[str, bytes]:
+    """The stored form of ``text``: a compressed blob, or the text itself."""
+    data = text.encode("utf-8")
+    if len(data) < MIN_COMPRESS_BYTES:
+        return text
+    _ensure_loaded()
+    dictionary_id = _current
+    if dictionary_id:
+        compressor = zlib.compressobj(
+            LEVEL, zlib.DEFLATED, -15, zdict=_dictionaries[dictionary_id]
+        )
+    else:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -15)
+    blob = (
+        bytes([FORMAT])
+        + dictionary_id.to_bytes(2, "big")
+        + compressor.compress(data)
+        + compressor.flush()
+    )
+    return blob if len(blob) < len(data) else text
+
+
+def decompress(value: Union[str, bytes, None]) -> Optional[str]:
+    """Text from a stored value; plain text is returned unchanged."""
+    if value is None or isinstance(value, str):
+        return value
+    if not value or value[0] != FORMAT:
+        raise ValueError("Unknown compressed value format")
+    dictionary_id = int.from_bytes(value[1:HEADER_BYTES], "big")
+    if dictionary_id:
+        if dictionary_id not in _dictionaries:
+            # Trained by another process since this one loaded them
+            reload()
+        if dictionary_id not in _dictionaries:
+            raise ValueError(
+                f"Compressed value needs dictionary {dictionary_id}, "
+                "which is not in compression_dictionaries"
+            )
+        decompressor = zlib.decompressobj(-15, zdict=_dictionaries[dictionary_id])
+    else:
+        decompressor = zlib.decompressobj(-15)
+    data = decompressor.decompress(value[HEADER_BYTES:]) + decompressor.flush()
+    return data.decode("utf-8")
+
+
+def is_current(value: Union[str, bytes, None]) -> bool:
+    """Whether ``value`` is already stored as ``compress`` would store it now."""
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) < MIN_COMPRESS_BYTES
+    return int.from_bytes(value[1:HEADER_BYTES], "big") == current_dictionary()
+
+
+def train_dictionary(samples: Iterable[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """A zlib preset dictionary from runs of words common across ``samples``.
+
+    Runs are scored by document frequency times length. zlib encodes nearer
+    matches more cheaply, so the best runs go at the end of the dictionary.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        words = _WORDS.findall(sample.encode("utf-8"))
+        counts.update(
+            {
+                b"".join(words[i : i + SEGMENT_WORDS])
+                for i in range(len(words) - SEGMENT_WORDS + 1)
+            }
+        )
+    ranked = sorted(
+        (
+            (count * len(segment), segment)
+            for segment, count in counts.items()
+            if count >= MIN_DOCUMENT_FREQUENCY
+        ),
+        reverse=True,
+    )
+    chosen = []
+    total = 0
+    for _, segment in ranked:
+        if total + len(segment) > size:
+            continue
+        if any(segment in other for other in chosen[-64:]):
+            continue
+        chosen.append(segment)
+        total += len(segment)
+    return b"".join(reversed(chosen))
@@ -1,5 +1,12 @@
+import functools
+import json
+import os
+import time
+import zlib
 from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from models import compression, instrumentation
 from sqlalchemy import (
     JSON,
     Boolean,
@@ -7,15 +14,53 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
     create_engine,
+    delete,
+    event,
+    func,
+    insert,
+    select,
+    update,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import Session, deferred, relationship, sessionmaker
+from sqlalchemy.types import TypeDecorator
+from starlette.requests import Request
 
 Base = declarative_base()
+# Tables of the shard directory, which lives in one database only
+DirectoryBase = declarative_base()
+
+
+class CompressedText(TypeDecorator):
+    """Text stored compressed by ``models.compression`` once it is large."""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compression.compress(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return compression.decompress(value)
+
+
+class CompressedJSON(CompressedText):
+    """JSON serialized as ``JSON`` columns do, then stored compressed."""
+
+    def process_bind_param(self, value, dialect):
+        return super().process_bind_param(
+            json.dumps(value) if value is not None else None, dialect
+        )
+
+    def process_result_value(self, value, dialect):
+        text = super().process_result_value(value, dialect)
+        return json.loads(text) if text is not None else None
 
 
 class User(Base):
@@ -37,6 +82,7 @@ class User(Base):
     study_plans = relationship("StudyPlan", back_populates="user")
     flashcards = relationship("Flashcard", back_populates="user")
     interactive_elements = relationship("InteractiveElement", back_populates="user")
+    lessons = relationship("Lesson", back_populates="user")
 
 
 class Progress(Base):
@@ -55,6 +101,12 @@ class Progress(Base):
     confidence_level = Column(Float)  # User's confidence in the topic
     notes = Column(Text)  # User's personal notes
 
+    __table_args__ = (
+        Index("ix_progress_user_completed", "user_id", "completed_at"),
+        # Retention scans in utils.archive
+        Index("ix_progress_completed", "completed_at"),
+    )
+
     # Relationships
     user = relationship("User", back_populates="progress")
 
@@ -66,13 +118,15 @@ class QuestionPaper(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     subject = Column(String)
     file_path = Column(String)
-    analysis = Column(JSON)
+    analysis = deferred(Column(CompressedJSON))
     paper_metadata = Column(JSON)  # Changed from metadata to paper_metadata
     tags = Column(JSON)
     difficulty_rating = Column(Float)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_public = Column(Boolean, default=False)
 
+    __table_args__ = (Index("ix_question_papers_user", "user_id"),)
+
     # Relationships
     user = relationship("User", back_populates="question_papers")
 
@@ -83,7 +137,7 @@ class StudyPlan(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
-    plan = Column(JSON)  # Study plan details
+    plan = deferred(Column(CompressedJSON))  # Study plan details
     duration = Column(Integer)  # Duration in days
     status = Column(String)  # Active, Completed, Archived
     progress = Column(Float)  # Completion percentage
@@ -92,6 +146,8 @@ class StudyPlan(Base):
     resources = Column(JSON)  # Recommended resources
     milestones = Column(JSON)  # Progress milestones
 
+    __table_args__ = (Index("ix_study_plans_user", "user_id"),)
+
     # Relationships
     user = relationship("User", back_populates="study_plans")
 
@@ -113,6 +169,8 @@ class Flashcard(Base):
     review_count = Column(Integer, default=0)
     mastery_level = Column(Float)  # 0-1 scale
 
+    __table_args__ = (Index("ix_flashcards_user", "user_id", "last_reviewed"),)
+
     # Relationships
     user = relationship("User", back_populates="flashcards")
 
@@ -125,7 +183,7 @@ class InteractiveElement(Base):
     subject = Column(String, nullable=False)
     topic = Column(String, nullable=False)
     element_type = Column(String)  # Quiz, Simulation, Exercise, etc.
-    content = Column(JSON)  # Interactive content
+    content = deferred(Column(CompressedJSON))  # Interactive content
     created_at = Column(DateTime, default=datetime.utcnow)
     difficulty_level = Column(String)
     learning_objectives = Column(JSON)
@@ -133,20 +191,459 @@ class InteractiveElement(Base):
     completion_status = Column(Boolean, default=False)
     time_spent = Column(Integer)  # Time spent in seconds
 
+    __table_args__ = (
+        Index("ix_interactive_elements_user", "user_id"),
+        Index("ix_interactive_elements_created", "created_at"),
+    )
+
     # Relationships
     user = relationship("User", back_populates="interactive_elements")
 
 
-# Create database engine
-engine = create_engine("sqlite:///ai_tutor.db")
-Base.metadata.create_all(engine)
+class Lesson(Base):
+    __tablename__ = "lessons"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))  # None for shared lessons
+    subject = Column(String, nullable=False)
+    topic = Column(String, nullable=False)
+    level = Column(String)
+    content = deferred(Column(CompressedText, nullable=False))  # Lesson text
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_lessons_user", "user_id"),
+        # Case-insensitive lookup of existing lessons on a topic
+        Index("ix_lessons_topic", func.lower(subject), func.lower(topic)),
+    )
+
+    # Relationships
+    user = relationship("User", back_populates="lessons")
+
+
+class Question(Base):
+    __tablename__ = "questions"
+
+    id = Column(Integer, primary_key=True)
+    # Normalized (lower-case, single-spaced) keys for bank lookups
+    subject = Column(String, nullable=False)
+    topic = Column(String, nullable=False)
+    level = Column(String, nullable=False)
+    question_type = Column(String, default="multiple_choice")
+    question = Column(Text, nullable=False)
+    options = Column(JSON)  # Answer choices, empty for open questions
+    correct_answer = Column(Text, nullable=False)
+    explanation = Column(Text)
+    difficulty = Column(String)  # Easy, Medium, Hard
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_questions_bank", "subject", "topic", "level", "difficulty"),
+    )
+
+
+class QuestionExposure(Base):
+    __tablename__ = "question_exposures"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    served_at = Column(DateTime, default=datetime.utcnow)
+    correct = Column(Boolean)  # None until the answer is graded
+
+    __table_args__ = (Index("ix_question_exposures_user", "user_id", "question_id"),)
+
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    # Bumped by triggers on every write to a user's rows in a collection
+    user_id = Column(Integer, primary_key=True)
+    collection = Column(String, primary_key=True)  # Source table name
+    version = Column(Integer, nullable=False, default=0)
+
+
+class TopicMastery(Base):
+    __tablename__ = "topic_mastery"
+
+    # Knowledge-tracing estimate per user and topic, maintained by utils.mastery
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    subject = Column(String, primary_key=True)  # Normalized like question bank keys
+    topic = Column(String, primary_key=True)
+    mastery = Column(Float, nullable=False)  # Probability the topic is known
+    attempts = Column(Integer, nullable=False, default=0)
+    last_score = Column(Float)  # 0-1
+    last_practiced = Column(DateTime)
+
+
+class ArchivedSummary(Base):
+    __tablename__ = "archived_summary"
+
+    # Aggregates of rows moved to the archive database by utils.archive
+    user_id = Column(Integer, primary_key=True)
+    collection = Column(String, primary_key=True)  # Source table name
+    subject = Column(String, primary_key=True)  # As stored in the source rows
+    topic = Column(String, primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+    scored = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    completed = Column(Integer, nullable=False, default=0)
+    time_spent = Column(Integer, nullable=False, default=0)  # Seconds
+    last_at = Column(DateTime)
+
+
+class MasteryBaseline(Base):
+    __tablename__ = "mastery_baseline"
+
+    # Knowledge-tracing state after the archived progress rows, the starting
+    # point when utils.mastery refits from the rows still in progress
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    subject = Column(String, primary_key=True)  # Normalized
+    topic = Column(String, primary_key=True)
+    mastery = Column(Float, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_score = Column(Float)  # 0-1
+    last_practiced = Column(DateTime)
+
+
+class CompressionDictionary(Base):
+    __tablename__ = "compression_dictionaries"
+
+    # Preset dictionaries for compressed columns; values name the id they
+    # were compressed with, so old dictionaries are kept
+    id = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    samples = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FlashcardReview(Base):
+    __tablename__ = "flashcard_reviews"
+
+    # One row per review, the outcome data for difficulty calibration
+    id = Column(Integer, primary_key=True)
+    flashcard_id = Column(Integer, ForeignKey("flashcards.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    mastery_level = Column(Float)  # Self-rated recall, 0-1
+    correct = Column(Boolean, nullable=False)
+    reviewed_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_flashcard_reviews_card", "flashcard_id"),)
+
 
-# Create session
-SessionLocal = sessionmaker(bind=engine)
+class ItemCalibration(Base):
+    __tablename__ = "item_calibration"
+
+    # 2PL item-response-theory parameters fitted by utils.irt
+    kind = Column(String, primary_key=True)  # question or flashcard
+    item_id = Column(Integer, primary_key=True)
+    subject = Column(String, nullable=False)  # Normalized keys
+    topic = Column(String, nullable=False)
+    level = Column(String, nullable=False, default="")
+    difficulty = Column(Float, nullable=False)  # b, on the ability scale
+    discrimination = Column(Float, nullable=False)  # a
+    responses = Column(Integer, nullable=False, default=0)
+    calibrated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "ix_item_calibration_lookup",
+            "kind",
+            "subject",
+            "topic",
+            "level",
+            "difficulty",
+        ),
+    )
+
+
+class LearnerAbility(Base):
+    __tablename__ = "learner_ability"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    ability = Column(Float, nullable=False)  # theta, on the same scale as b
+    responses = Column(Integer, nullable=False, default=0)
+    calibrated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GenerationUsage(Base):
+    __tablename__ = "generation_usage"
+
+    # One row per hour, user, route and model; written by utils.usage
+    bucket_start = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, primary_key=True)  # 0 when no user is known
+    route = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    # Ollama-reported durations in seconds
+    load_seconds = Column(Float, nullable=False, default=0.0)
+    prompt_eval_seconds = Column(Float, nullable=False, default=0.0)
+    eval_seconds = Column(Float, nullable=False, default=0.0)
+    total_seconds = Column(Float, nullable=False, default=0.0)
+
+
+class ShardDirectory(DirectoryBase):
+    __tablename__ = "shard_directory"
+
+    # Allocates user ids across shards and records where each user lives
+    user_id = Column(Integer, primary_key=True)
+    tenant = Column(String, index=True)  # School; its users share a shard
+    shard = Column(Integer, nullable=False)
+    read_only = Column(Boolean, nullable=False, default=False)  # While moving
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ShardReadOnly(Exception):
+    """The user's data is being moved to another shard; retry shortly."""
+
+
+# SQLite files holding user data. Each has the full schema, its own engine
+# and pool, and its own write lock; users are placed by the shard directory.
+SHARD_PATHS = [
+    path.strip()
+    for path in os.getenv("DATABASE_SHARDS", "ai_tutor.db").split(",")
+    if path.strip()
+]
+# Shard that ``engine``/``SessionLocal`` and the maintenance commands use
+SHARD = int(os.getenv("DATABASE_SHARD", "0"))
+DIRECTORY_PATH = os.getenv("SHARD_DIRECTORY", SHARD_PATHS[0])
+# How long a process trusts a cached directory entry; moves wait this long
+ROUTE_CACHE_SECONDS = 5.0
+MAX_CACHED_ROUTES = 100000
+
+
+def _register_functions(dbapi_connection, connection_record):
+    # Lets triggers and raw SQL read compressed columns
+    dbapi_connection.create_function(
+        "decompress", 1, compression.decompress, deterministic=True
+    )
+
+
+def _reset_query_only(dbapi_connection, connection_record):
+    # get_db makes sessions of moving users read-only
+    if dbapi_connection is not None:
+        dbapi_connection.execute("PRAGMA query_only = OFF")
+
+
+def _create_shard_engine(path: str):
+    shard_engine = create_engine(f"sqlite:///{path}")
+    event.listen(shard_engine, "connect", _register_functions)
+    event.listen(shard_engine, "checkin", _reset_query_only)
+    if instrumentation.ENABLED:
+        instrumentation.install(shard_engine)
+    Base.metadata.create_all(shard_engine)
+
+    # create_all skips tables that already exist, so add indexes introduced
+    # later. Existing names come from sqlite_master because reflection
+    # cannot see expression-based indexes.
+    with shard_engine.connect() as conn:
+        existing_indexes = {
+            row[0]
+            for row in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(shard_engine)
+    return shard_engine
+
+
+# Create database engines
+engines = [_create_shard_engine(path) for path in SHARD_PATHS]
+engine = engines[SHARD]
+if DIRECTORY_PATH in SHARD_PATHS:
+    directory_engine = engines[SHARD_PATHS.index(DIRECTORY_PATH)]
+else:
+    directory_engine = create_engine(f"sqlite:///{DIRECTORY_PATH}")
+
+
+def _ensure_directory():
+    """Create the directory, registering users that predate it."""
+    with directory_engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'shard_directory'"
+        ).first()
+        DirectoryBase.metadata.create_all(conn)
+    if exists:
+        return
+    for shard, shard_engine in enumerate(engines):
+        with shard_engine.connect() as conn:
+            user_ids = conn.execute(select(User.id)).scalars().all()
+        if user_ids:
+            with directory_engine.begin() as conn:
+                conn.execute(
+                    insert(ShardDirectory),
+                    [{"user_id": user_id, "shard": shard} for user_id in user_ids],
+                )
+
+
+_ensure_directory()
+
+
+def _load_dictionaries():
+    # Shared by all shards, so moved rows stay readable
+    with directory_engine.connect() as conn:
+        return dict(
+            conn.execute(
+                select(CompressionDictionary.id, CompressionDictionary.data)
+            ).all()
+        )
+
+
+compression.set_loader(_load_dictionaries)
+
+# Create sessions
+shard_sessions = [sessionmaker(bind=shard_engine) for shard_engine in engines]
+SessionLocal = shard_sessions[SHARD]
+DirectorySession = sessionmaker(bind=directory_engine)
+
+_routes: Dict[int, Tuple[float, int, bool]] = {}
+
+
+def route_user(user_id: int) -> Tuple[int, bool]:
+    """``(shard, read_only)`` for a user; unknown users map to ``SHARD``."""
+    if len(engines) == 1:
+        return 0, False
+    now = time.monotonic()
+    cached = _routes.get(user_id)
+    if cached and now - cached[0] < ROUTE_CACHE_SECONDS:
+        return cached[1], cached[2]
+    with directory_engine.connect() as conn:
+        row = conn.execute(
+            select(ShardDirectory.shard, ShardDirectory.read_only).where(
+                ShardDirectory.user_id == user_id
+            )
+        ).first()
+    shard, read_only = (row.shard, row.read_only) if row else (SHARD, False)
+    if len(_routes) >= MAX_CACHED_ROUTES:
+        _routes.clear()
+    _routes[user_id] = (now, shard, read_only)
+    return shard, read_only
+
+
+def register_user(tenant: Optional[str] = None) -> Tuple[int, int]:
+    """Allocate a user id and pick its shard; returns ``(user_id, shard)``.
+
+    Users join their tenant's shard. A new tenant is placed by a hash of its
+    name and a user without a tenant by its id.
+    """
+    with directory_engine.begin() as conn:
+        shard = None
+        if tenant:
+            shard = conn.execute(
+                select(ShardDirectory.shard)
+                .where(ShardDirectory.tenant == tenant)
+                .limit(1)
+            ).scalar()
+            if shard is None:
+                shard = zlib.crc32(tenant.encode()) % len(engines)
+        user_id = conn.execute(
+            insert(ShardDirectory).values(tenant=tenant, shard=shard or 0)
+        ).inserted_primary_key[0]
+        if shard is None:
+            shard = user_id % len(engines)
+            conn.execute(
+                update(ShardDirectory)
+                .where(ShardDirectory.user_id == user_id)
+                .values(shard=shard)
+            )
+    return user_id, shard
+
+
+def register_users(
+    user_ids: List[Optional[int]], shard: int = SHARD
+) -> Tuple[List[Optional[int]], Set[int]]:
+    """Register imported users on ``shard``, allocating ids given as None.
+
+    Returns their ids, with None for ids that already live on another shard,
+    and the ids this call added to the directory.
+    """
+    with directory_engine.begin() as conn:
+        explicit = [user_id for user_id in user_ids if user_id is not None]
+        existing = dict(
+            conn.execute(
+                select(ShardDirectory.user_id, ShardDirectory.shard).where(
+                    ShardDirectory.user_id.in_(explicit)
+                )
+            ).all()
+        )
+        new = {user_id for user_id in explicit if user_id not in existing}
+        if new:
+            conn.execute(
+                insert(ShardDirectory),
+                [{"user_id": user_id, "shard": shard} for user_id in new],
+            )
+        registered = []
+        for user_id in user_ids:
+            if user_id is None:
+                user_id = conn.execute(
+                    insert(ShardDirectory).values(shard=shard)
+                ).inserted_primary_key[0]
+                new.add(user_id)
+            elif existing.get(user_id, shard) != shard:
+                user_id = None
+            registered.append(user_id)
+    return registered, new
+
+
+def unregister_user(user_id: int) -> None:
+    """Release an id whose user row could not be created."""
+    with directory_engine.begin() as conn:
+        conn.execute(delete(ShardDirectory).where(ShardDirectory.user_id == user_id))
+
+
+def open_session(shard: int) -> Session:
+    db = shard_sessions[shard]()
+    db.info["shard"] = shard
+    return db
+
+
+def session_factory(db: Session) -> Callable[[], Session]:
+    """Opens sessions on the same shard as ``db``, for background work."""
+    return functools.partial(open_session, db.info.get("shard", SHARD))
+
+
+async def _request_user(request: Request) -> Optional[int]:
+    """The user a request acts for: path, query string, JSON or form body."""
+    value = request.path_params.get("user_id") or request.query_params.get("user_id")
+    if value is None and request.method in ("POST", "PUT", "PATCH"):
+        content_type = request.headers.get("content-type", "")
+        try:
+            if content_type.startswith("application/json"):
+                body = await request.json()
+                value = body.get("user_id") if isinstance(body, dict) else None
+            elif content_type.startswith(("multipart/", "application/x-www-form")):
+                value = (await request.form()).get("user_id")
+        except ValueError:
+            value = None
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def get_db(request: Request):
+    """A session on the shard of the user the request is for."""
+    user_id = await _request_user(request)
+    shard, read_only = route_user(user_id) if user_id is not None else (SHARD, False)
+    if read_only and request.method not in ("GET", "HEAD"):
+        raise ShardReadOnly()
+    db = open_session(shard)
+    if read_only:
+        db.connection().exec_driver_sql("PRAGMA query_only = ON")
+    try:
+        yield db
+    finally:
+        db.close()
 
 
-def get_db():
-    db = SessionLocal()
+def get_directory_db():
+    db = DirectorySession()
     try:
         yield db
     finally:
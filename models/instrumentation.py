@@ -0,0 +1,194 @@
+"""Opt-in SQL query instrumentation.
+
+Enabled with ``SQL_INSTRUMENTATION=1``. Every statement is reduced to a
+fingerprint (literals and IN-lists collapsed) and counted per request and
+process-wide. Slow statements are logged with the shape, never the values,
+of their bound parameters, optionally with SQLite's ``EXPLAIN QUERY PLAN``,
+and requests that run one fingerprint more than ``SQL_N_PLUS_ONE_THRESHOLD``
+times are flagged as likely N+1 lazy loading.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("ai_tutor.sql")
+
+ENABLED = os.getenv("SQL_INSTRUMENTATION", "").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+EXPLAIN_SLOW_QUERIES = os.getenv("SQL_EXPLAIN_SLOW", "").lower() in ("1", "true", "yes")
+RECENT_REQUESTS = 100
+MAX_FINGERPRINTS = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    statement = _WHITESPACE.sub(" ", statement.strip())
+    statement = _LITERALS.sub("?", statement)
+    return _IN_LISTS.sub("(?+)", statement)
+
+
+def parameter_shape(parameters, executemany: bool) -> str:
+    """Describe bound parameters by type only, e.g. ``3 x (int, str)``."""
+
+    def shape(params) -> str:
+        if isinstance(params, dict):
+            return (
+                "{"
+                + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items())
+                + "}"
+            )
+        return "(" + ", ".join(type(v).__name__ for v in params or ()) + ")"
+
+    if executemany:
+        params = list(parameters or [])
+        return f"{len(params)} x {shape(params[0]) if params else '()'}"
+    return shape(parameters)
+
+
+class QueryReport:
+    __slots__ = ("method", "path", "queries", "slow")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        # fingerprint -> [count, total seconds]
+        self.queries: Dict[str, List] = {}
+        self.slow: List[Dict] = []
+
+
+_current: ContextVar[Optional[QueryReport]] = ContextVar("query_report", default=None)
+_lock = threading.Lock()
+_totals: Dict[str, List] = {}  # fingerprint -> [count, total seconds, max seconds]
+_recent: deque = deque(maxlen=RECENT_REQUESTS)
+
+
+def begin_request(method: str, path: str) -> Optional[QueryReport]:
+    if not ENABLED:
+        return None
+    report = QueryReport(method, path)
+    _current.set(report)
+    return report
+
+
+def end_request(report: Optional[QueryReport], route: str) -> None:
+    """Store the request's summary and log suspected N+1 patterns."""
+    if report is None:
+        return
+    n_plus_one = [
+        {"fingerprint": fp, "count": count}
+        for fp, (count, _) in report.queries.items()
+        if count > N_PLUS_ONE_THRESHOLD
+    ]
+    summary = {
+        "method": report.method,
+        "path": report.path,
+        "route": route,
+        "queries": sum(count for count, _ in report.queries.values()),
+        "db_ms": round(sum(t for _, t in report.queries.values()) * 1000, 2),
+        "fingerprints": {
+            fp: {"count": count, "total_ms": round(t * 1000, 2)}
+            for fp, (count, t) in report.queries.items()
+        },
+        "slow": report.slow,
+        "n_plus_one": n_plus_one,
+    }
+    with _lock:
+        _recent.append(summary)
+    for suspect in n_plus_one:
+        logger.warning(json.dumps({"event": "n_plus_one", "route": route, **suspect}))
+
+
+def _explain(cursor, statement: str, parameters) -> Optional[List[str]]:
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    try:
+        plan = cursor.connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters or ()
+        ).fetchall()
+        return [row[-1] for row in plan]
+    except Exception:
+        return None
+
+
+def install(engine) -> None:
+    """Attach the instrumentation listeners to ``engine``."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("instrumented_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["instrumented_started"].pop()
+        fp = fingerprint(statement)
+        with _lock:
+            totals = _totals.get(fp)
+            if totals is None and len(_totals) < MAX_FINGERPRINTS:
+                totals = _totals[fp] = [0, 0.0, 0.0]
+            if totals is not None:
+                totals[0] += 1
+                totals[1] += elapsed
+                totals[2] = max(totals[2], elapsed)
+
+        report = _current.get()
+        if report is not None:
+            entry = report.queries.setdefault(fp, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            slow = {
+                "fingerprint": fp,
+                "duration_ms": round(elapsed * 1000, 2),
+                "parameters": parameter_shape(parameters, executemany),
+            }
+            if EXPLAIN_SLOW_QUERIES and not executemany:
+                slow["plan"] = _explain(cursor, statement, parameters)
+            if report is not None:
+                slow["path"] = report.path
+                report.slow.append(slow)
+            logger.warning(json.dumps({"event": "slow_query", **slow}))
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        # A statement that raised never reaches after_cursor_execute
+        conn = context.connection
+        if conn is not None and context.execution_context is not None:
+            started = conn.info.get("instrumented_started")
+            if started:
+                started.pop()
+
+
+def snapshot(limit: int = 50) -> Dict:
+    """Process-wide top fingerprints and the most recent request reports."""
+    with _lock:
+        top = sorted(_totals.items(), key=lambda item: item[1][1], reverse=True)
+        recent = list(_recent)
+    return {
+        "enabled": ENABLED,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "n_plus_one_threshold": N_PLUS_ONE_THRESHOLD,
+        "top_fingerprints": [
+            {
+                "fingerprint": fp,
+                "count": count,
+                "total_ms": round(total * 1000, 2),
+                "max_ms": round(worst * 1000, 2),
+            }
+            for fp, (count, total, worst) in top[:limit]
+        ],
+        "recent_requests": recent[::-1],
+    }
@@ -0,0 +1,306 @@
+"""SQLite FTS5 full-text indexes.
+
+``search_index`` covers flashcards, lessons and paper analyses. It is kept in
+sync by triggers on the source tables, so every write path (ORM, bulk
+inserts, raw SQL) updates it without extra application code. Each document's
+rowid encodes its source table: ``id * 4 + kind code``.
+
+The index stores no copy of the text: it is an external-content table over
+the ``search_source`` view, which decompresses lesson and paper text on the
+fly, and expression indexes on ``id * 4 + kind code`` keep the per-document
+lookups for highlighting cheap.
+
+``paper_chunks`` holds passages of uploaded question papers for retrieval,
+keyed by ``paper_id * MAX_CHUNKS_PER_PAPER + chunk number``.
+"""
+
+import re
+import zlib
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from models.database import engine, engines
+
+KIND_CODES = {"flashcard": 1, "lesson": 2, "paper": 3}
+
+SHARED_OWNER = "shared"
+
+MIN_PREFIX_LENGTH = 3
+
+MAX_CHUNKS_PER_PAPER = 10000
+
+# Column weights for bm25(): owner, kind, subject, title, body
+RANK_WEIGHTS = (0.0, 0.0, 2.0, 4.0, 1.0)
+
+# Lesson content and paper analyses may be compressed (models.compression)
+_PAPER_ANALYSIS = """CASE WHEN json_valid(decompress({row}.analysis))
+        THEN coalesce(json_extract(decompress({row}.analysis), '$'), '')
+        ELSE coalesce(decompress({row}.analysis), '') END"""
+
+# (table, kind, watched columns, subject, title, body) per indexed source
+_SOURCES = [
+    (
+        "flashcards",
+        "flashcard",
+        "user_id, subject, topic, front, back",
+        "{row}.subject || ' ' || {row}.topic",
+        "{row}.front",
+        "{row}.back",
+    ),
+    (
+        "lessons",
+        "lesson",
+        "user_id, subject, topic, level, content",
+        "{row}.subject || ' ' || coalesce({row}.level, '')",
+        "{row}.topic",
+        "decompress({row}.content)",
+    ),
+    (
+        "question_papers",
+        "paper",
+        "user_id, subject, analysis, paper_metadata",
+        "coalesce({row}.subject, '')",
+        "coalesce(json_extract({row}.paper_metadata, '$.filename'), '')",
+        _PAPER_ANALYSIS,
+    ),
+]
+
+
+def _row_values(kind: str, subject: str, title: str, body: str, row: str) -> str:
+    return (
+        f"{row}.id * 4 + {KIND_CODES[kind]}, "
+        f"coalesce('u' || {row}.user_id, '{SHARED_OWNER}'), '{kind}', "
+        f"{subject.format(row=row)}, {title.format(row=row)}, {body.format(row=row)}"
+    )
+
+
+def _schema_statements() -> List[str]:
+    source = " UNION ALL ".join(
+        f"SELECT {_row_values(kind, subject, title, body, table)} FROM {table}"
+        for table, kind, _, subject, title, body in _SOURCES
+    )
+    statements = [
+        "CREATE VIEW IF NOT EXISTS search_source"
+        f"(doc_id, owner, kind, subject, title, body) AS {source}",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            owner, kind, subject, title, body,
+            content = 'search_source', content_rowid = 'doc_id',
+            tokenize = 'porter unicode61', prefix = '3 4'
+        )""",
+    ]
+    columns = "rowid, owner, kind, subject, title, body"
+    for table, kind, watched, subject, title, body in _SOURCES:
+        code = KIND_CODES[kind]
+        insert = (
+            f"INSERT INTO search_index({columns}) "
+            f"VALUES ({_row_values(kind, subject, title, body, 'new')});"
+        )
+        # External-content rows are removed by re-sending their indexed values
+        delete = (
+            f"INSERT INTO search_index(search_index, {columns}) "
+            f"VALUES ('delete', {_row_values(kind, subject, title, body, 'old')});"
+        )
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_search_rowid "
+            f"ON {table}(id * 4 + {code})",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_search_ai
+                AFTER INSERT ON {table} BEGIN {insert} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_search_au
+                AFTER UPDATE OF {watched} ON {table} BEGIN {delete} {insert} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {table}_search_ad
+                AFTER DELETE ON {table} BEGIN {delete} END""",
+        ]
+    statements += [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS paper_chunks USING fts5(
+            scope, paper_id UNINDEXED, body, tokenize = 'porter unicode61'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS question_papers_chunks_ad
+            AFTER DELETE ON question_papers BEGIN
+                DELETE FROM paper_chunks
+                WHERE rowid >= old.id * {MAX_CHUNKS_PER_PAPER}
+                AND rowid < (old.id + 1) * {MAX_CHUNKS_PER_PAPER};
+            END""",
+    ]
+    return statements
+
+
+def rebuild_search_index(bind=engine) -> None:
+    """Re-populate the index from the source tables."""
+    with bind.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO search_index(search_index) VALUES ('rebuild')"
+        )
+
+
+def ensure_search_schema(bind=engine) -> None:
+    """Create the FTS table and sync triggers, backfilling on first creation."""
+    with bind.begin() as conn:
+        definition = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE name = 'search_index'"
+        ).scalar()
+        exists = definition is not None
+        if exists and "search_source" not in definition:
+            # Replace an index that kept its own copy of the text
+            for table, *_ in _SOURCES:
+                for suffix in ("ai", "au", "ad"):
+                    conn.exec_driver_sql(
+                        f"DROP TRIGGER IF EXISTS {table}_search_{suffix}"
+                    )
+            conn.exec_driver_sql("DROP TABLE search_index")
+            exists = False
+        for statement in _schema_statements():
+            conn.exec_driver_sql(statement)
+    if not exists:
+        rebuild_search_index(bind)
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def build_match_query(
+    user_id: int, query: str, kinds: Optional[List[str]] = None
+) -> Optional[str]:
+    """Turn free text into an FTS5 MATCH expression scoped to one user.
+
+    User input is reduced to quoted word tokens so it can never inject FTS
+    syntax; a last token of three or more characters is matched as a prefix
+    for search-as-you-type, served by the index's prefix tables.
+    """
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    words = " ".join(_quote(term) for term in terms)
+    if len(terms[-1]) >= MIN_PREFIX_LENGTH:
+        words += "*"
+    owners = f"{_quote(f'u{user_id}')} OR {_quote(SHARED_OWNER)}"
+    expression = f"owner : ({owners}) AND {{subject title body}} : ({words})"
+    if kinds:
+        expression += " AND kind : (" + " OR ".join(_quote(k) for k in kinds) + ")"
+    return expression
+
+
+def search_documents(
+    db: Session,
+    user_id: int,
+    query: str,
+    kinds: Optional[List[str]] = None,
+    limit: int = 20,
+    offset: int = 0,
+    highlight: tuple = ("<mark>", "</mark>"),
+) -> Dict:
+    """Ranked, highlighted and paginated search over a user's content."""
+    match = build_match_query(user_id, query, kinds)
+    results = []
+    has_more = False
+    if match:
+        # Rank on the index alone, then read text only for the page shown
+        ranked = db.execute(
+            text(f"""SELECT rowid,
+                    bm25(search_index, {', '.join(map(str, RANK_WEIGHTS))}) AS score
+                FROM search_index
+                WHERE search_index MATCH :match
+                ORDER BY score
+                LIMIT :limit OFFSET :offset"""),
+            {"match": match, "limit": limit + 1, "offset": offset},
+        ).all()
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+        details = {}
+        if ranked:
+            details = {
+                row.rowid: row
+                for row in db.execute(
+                    text(
+                        """SELECT rowid, kind, subject,
+                            highlight(search_index, 3, :open, :close) AS title,
+                            snippet(search_index, 4, :open, :close, '…', 16)
+                                AS snippet
+                        FROM search_index
+                        WHERE search_index MATCH :match AND rowid IN :rowids"""
+                    ).bindparams(bindparam("rowids", expanding=True)),
+                    {
+                        "open": highlight[0],
+                        "close": highlight[1],
+                        "match": match,
+                        "rowids": [row.rowid for row in ranked],
+                    },
+                )
+            }
+        results = [
+            {
+                "type": details[row.rowid].kind,
+                "id": row.rowid // 4,
+                "subject": details[row.rowid].subject,
+                "title": details[row.rowid].title,
+                "snippet": details[row.rowid].snippet,
+                "score": -row.score,
+            }
+            for row in ranked
+        ]
+    return {
+        "query": query,
+        "results": results,
+        "limit": limit,
+        "offset": offset,
+        "has_more": has_more,
+    }
+
+
+def scope_token(user_id: int, subject: str) -> str:
+    """Single FTS token identifying one user's papers for one subject."""
+    return f"p{user_id}x{zlib.crc32(subject.strip().lower().encode()):08x}"
+
+
+def index_paper_chunks(
+    db: Session, paper_id: int, user_id: int, subject: str, chunks: List[str]
+) -> None:
+    """Replace the stored passages of one paper."""
+    base = paper_id * MAX_CHUNKS_PER_PAPER
+    db.execute(
+        text("DELETE FROM paper_chunks WHERE rowid >= :lo AND rowid < :hi"),
+        {"lo": base, "hi": base + MAX_CHUNKS_PER_PAPER},
+    )
+    if not chunks:
+        return
+    scope = scope_token(user_id, subject)
+    db.execute(
+        text(
+            "INSERT INTO paper_chunks(rowid, scope, paper_id, body) "
+            "VALUES (:rowid, :scope, :paper_id, :body)"
+        ),
+        [
+            {"rowid": base + i, "scope": scope, "paper_id": paper_id, "body": chunk}
+            for i, chunk in enumerate(chunks[:MAX_CHUNKS_PER_PAPER])
+        ],
+    )
+
+
+def search_paper_chunks(
+    db: Session, user_id: int, subject: str, query: str, limit: int = 5
+) -> List[Dict]:
+    """Best-matching passages from a user's papers for a subject, by bm25."""
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return []
+    match = (
+        f"scope : {_quote(scope_token(user_id, subject))} AND body : ("
+        + " OR ".join(_quote(term) for term in terms)
+        + ")"
+    )
+    rows = db.execute(
+        text("""SELECT paper_id, body, bm25(paper_chunks) AS score
+            FROM paper_chunks WHERE paper_chunks MATCH :match
+            ORDER BY score LIMIT :limit"""),
+        {"match": match, "limit": limit},
+    ).all()
+    return [
+        {"paper_id": row.paper_id, "text": row.body, "score": -row.score}
+        for row in rows
+    ]
+
+
+for _engine in engines:
+    ensure_search_schema(_engine)
@@ -0,0 +1,88 @@
+"""Per-user, per-collection data versions for conditional GETs.
+
+Triggers on each user-scoped table bump ``data_versions`` on every insert,
+update and delete, whatever the write path. A version lookup is a single
+primary-key read, so list endpoints can answer ``If-None-Match`` with a 304
+without touching the row tables.
+"""
+
+import hashlib
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from models.database import DataVersion, engine, engines
+
+# Collection name (source table) -> column holding the owning user's id
+VERSIONED_COLLECTIONS = {
+    "users": "id",
+    "progress": "user_id",
+    "flashcards": "user_id",
+    "study_plans": "user_id",
+    "question_papers": "user_id",
+    "interactive_elements": "user_id",
+    "lessons": "user_id",
+}
+
+
+def _bump(collection: str, user_column: str) -> str:
+    return f"""INSERT INTO data_versions(user_id, collection, version)
+        VALUES ({user_column}, '{collection}', 1)
+        ON CONFLICT(user_id, collection) DO UPDATE SET version = version + 1;"""
+
+
+def _trigger_statements():
+    for table, column in VERSIONED_COLLECTIONS.items():
+        yield f"""CREATE TRIGGER IF NOT EXISTS {table}_version_ai
+            AFTER INSERT ON {table} WHEN new.{column} IS NOT NULL
+            BEGIN {_bump(table, f'new.{column}')} END"""
+        yield f"""CREATE TRIGGER IF NOT EXISTS {table}_version_au
+            AFTER UPDATE ON {table}
+            BEGIN
+                {_bump(table, f'coalesce(new.{column}, old.{column})')}
+            END"""
+        yield f"""CREATE TRIGGER IF NOT EXISTS {table}_version_ad
+            AFTER DELETE ON {table} WHEN old.{column} IS NOT NULL
+            BEGIN {_bump(table, f'old.{column}')} END"""
+
+
+def ensure_version_triggers(bind=engine) -> None:
+    with bind.begin() as conn:
+        for statement in _trigger_statements():
+            conn.exec_driver_sql(statement)
+
+
+def get_versions(
+    db: Session, user_id: int, collections: Iterable[str]
+) -> Dict[str, int]:
+    collections = list(collections)
+    versions = dict.fromkeys(collections, 0)
+    rows = db.query(DataVersion.collection, DataVersion.version).filter(
+        DataVersion.user_id == user_id, DataVersion.collection.in_(collections)
+    )
+    versions.update(rows)
+    return versions
+
+
+def make_etag(user_id: int, versions: Dict[str, int]) -> str:
+    if len(versions) == 1:
+        [(collection, version)] = versions.items()
+        return f'W/"{collection}-{user_id}-{version}"'
+    digest = hashlib.sha1(repr(sorted(versions.items())).encode()).hexdigest()[:16]
+    return f'W/"{user_id}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ``If-None-Match`` header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+for _engine in engines:
+    ensure_version_triggers(_engine)
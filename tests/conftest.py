@@ -0,0 +1,33 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# Point every database at a scratch directory before any module opens one
+_scratch = tempfile.mkdtemp(prefix="ai_tutor_tests_")
+os.environ.setdefault(
+    "DATABASE_SHARDS",
+    ",".join(os.path.join(_scratch, name) for name in ("shard0.db", "shard1.db")),
+)
+os.environ.setdefault("DATABASE_SHARD", "0")
+os.environ.setdefault("QUOTA_DB_PATH", os.path.join(_scratch, "quotas.db"))
+os.environ.setdefault("COLUMNAR_DIR", os.path.join(_scratch, "columnar"))
+os.environ.setdefault("GENERATION_CACHE_DIR", os.path.join(_scratch, "cache"))
+
+_emails = itertools.count()
+
+
+@pytest.fixture
+def make_user():
+    """Create a user on the shard the directory assigns; returns its id."""
+    from models.database import User, open_session, register_user
+
+    def create(tenant=None) -> int:
+        user_id, shard = register_user(tenant)
+        with open_session(shard) as db:
+            db.add(User(id=user_id, name="Test", email=f"u{next(_emails)}@example.com"))
+            db.commit()
+        return user_id
+
+    return create
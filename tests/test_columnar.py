@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from models import database
+from models.database import Progress, open_session, route_user
+from utils import columnar, rebalance
+
+
+def add_progress(user_id: int, topic: str, score: float, count: int = 1):
+    with open_session(route_user(user_id)[0]) as db:
+        db.add_all(
+            Progress(
+                user_id=user_id,
+                subject="Physics",
+                topic=topic,
+                score=score,
+                time_spent=60,
+                completed_at=datetime(2026, 3, 1),
+            )
+            for _ in range(count)
+        )
+        db.commit()
+
+
+def user_on(shard: int, make_user) -> int:
+    while True:
+        user_id = make_user()
+        if route_user(user_id)[0] == shard:
+            return user_id
+
+
+def export_all(root):
+    for shard in range(2):
+        columnar.export(shard, root)
+
+
+def test_cohort_report_merges_shards(tmp_path, make_user):
+    first, second = user_on(0, make_user), user_on(1, make_user)
+    add_progress(first, "Newton's laws", 40, 3)
+    add_progress(second, "newton's  laws", 80, 3)
+    export_all(str(tmp_path))
+
+    report = columnar.cohort_report([first, second], root=str(tmp_path))
+    assert report["progress"]["events"] == 6
+    assert report["progress"]["students"] == 2
+    [topic] = report["progress"]["struggling_topics"]
+    assert topic["topic"] == "newton's laws"
+    assert topic["mean_score"] == 60.0
+
+    # Exporting again adds nothing
+    export_all(str(tmp_path))
+    again = columnar.cohort_report([first, second], root=str(tmp_path))
+    assert again["progress"]["events"] == 6
+
+
+def test_subject_filter_uses_each_shards_dictionary(tmp_path, make_user):
+    user_id = user_on(1, make_user)
+    add_progress(user_id, "Optics", 70)
+    export_all(str(tmp_path))
+    report = columnar.cohort_report([user_id], "physics", root=str(tmp_path))
+    assert report["progress"]["events"] == 1
+    report = columnar.cohort_report([user_id], "chemistry", root=str(tmp_path))
+    assert report["progress"]["events"] == 0
+
+
+def test_moved_users_are_counted_once(make_user):
+    user_id = user_on(0, make_user)
+    add_progress(user_id, "Waves", 50, 2)
+    export_all(columnar.COLUMNAR_DIR)
+
+    rebalance.move(1, user_id=user_id, wait=0)
+    database._routes.clear()  # Cached routes would expire after the wait
+    assert route_user(user_id)[0] == 1
+    export_all(columnar.COLUMNAR_DIR)
+    report = columnar.cohort_report([user_id])
+    assert report["progress"]["events"] == 2
@@ -0,0 +1,52 @@
+import pytest
+
+from models import compression
+
+LESSON = (
+    "## Key concepts\n\nNewton's second law states that force equals mass "
+    "times acceleration. For example, a 2 kg cart accelerating at 3 m/s^2 "
+    "needs a net force of 6 N. "
+) * 4
+
+
+@pytest.fixture
+def dictionaries():
+    """Swap in an in-memory dictionary store for the duration of a test."""
+    stored = {}
+    previous = compression._loader
+    compression.set_loader(lambda: stored)
+    yield stored
+    compression.set_loader(previous)
+
+
+def test_short_values_stay_plain(dictionaries):
+    assert compression.compress("short") == "short"
+    assert compression.decompress("short") == "short"
+    assert compression.decompress(None) is None
+
+
+def test_round_trip_without_dictionary(dictionaries):
+    blob = compression.compress(LESSON)
+    assert isinstance(blob, bytes) and len(blob) < len(LESSON)
+    assert compression.decompress(blob) == LESSON
+    assert compression.is_current(blob)
+
+
+def test_round_trip_with_trained_dictionary(dictionaries):
+    dictionaries[1] = compression.train_dictionary([LESSON] * 5)
+    compression.reload()
+    blob = compression.compress(LESSON)
+    assert int.from_bytes(blob[1:3], "big") == 1
+    assert compression.decompress(blob) == LESSON
+
+    dictionaries[2] = dictionaries[1]
+    compression.reload()
+    assert not compression.is_current(blob)
+    assert compression.decompress(blob) == LESSON
+
+
+def test_unknown_dictionary_is_an_error(dictionaries):
+    with pytest.raises(ValueError):
+        compression.decompress(bytes([compression.FORMAT, 0, 9]) + b"\x03\x00")
+    with pytest.raises(ValueError):
+        compression.decompress(b"\x07data")
@@ -0,0 +1,24 @@
+import pytest
+from models import instrumentation
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from utils.timing import instrument_engine
+
+
+def test_failed_statements_leave_no_start_times():
+    engine = create_engine("sqlite://")
+    instrumentation.install(engine)
+    instrument_engine(engine)
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+        assert conn.info["instrumented_started"] == []
+        assert conn.info["query_started"] == []
+
+
+def test_fingerprint_ignores_literals():
+    assert instrumentation.fingerprint(
+        "SELECT * FROM users WHERE id = 1"
+    ) == instrumentation.fingerprint("SELECT * FROM users WHERE id = 42")
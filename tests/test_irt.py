@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from utils import irt
+
+
+@pytest.mark.parametrize(
+    "b, label", [(-1.0, "Easy"), (-0.5, "Medium"), (0.5, "Medium"), (1.2, "Hard")]
+)
+def test_difficulty_label(b, label):
+    assert irt.difficulty_label(b) == label
+
+
+def test_target_difficulty_gives_target_success():
+    ability = 0.8
+    b = irt.target_difficulty(ability)
+    assert 1 / (1 + np.exp(-(ability - b))) == pytest.approx(irt.TARGET_SUCCESS)
+
+
+def test_fit_2pl_recovers_orderings():
+    rng = np.random.default_rng(0)
+    true_ability = np.array([-1.5, 0.0, 1.5] * 200)
+    true_difficulty = np.array([-1.5, -0.5, 0.5, 1.5])
+    users, items = (grid.ravel() for grid in np.meshgrid(np.arange(600), np.arange(4)))
+    p = 1 / (1 + np.exp(-(true_ability[users] - true_difficulty[items])))
+    outcomes = rng.random(len(p)) < p
+
+    ability, difficulty, discrimination = irt.fit_2pl(users, items, outcomes, 600, 4)
+
+    assert np.all(np.diff(difficulty) > 0)
+    means = [ability[i::3].mean() for i in range(3)]
+    assert means[0] < means[1] < means[2]
+    assert np.all(discrimination > 0)
+
+
+def test_fit_2pl_warm_start_keeps_shapes():
+    users = np.array([0, 0, 1, 1])
+    items = np.array([0, 1, 0, 1])
+    outcomes = np.array([1, 0, 1, 1])
+    ability, difficulty, _ = irt.fit_2pl(users, items, outcomes, 2, 2, epochs=5)
+    warm = irt.fit_2pl(
+        users,
+        items,
+        outcomes,
+        2,
+        2,
+        ability=ability,
+        difficulty=difficulty,
+        epochs=irt.WARM_START_EPOCHS,
+    )
+    assert [part.shape for part in warm] == [(2,), (2,), (2,)]
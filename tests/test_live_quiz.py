@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from models.database import Question
+from utils.live_quiz import RIGHT, UNSEEN, WRONG, LiveQuiz
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+def make_quiz():
+    questions = [
+        Question(
+            id=n,
+            subject="physics",
+            topic="motion",
+            level="beginner",
+            question=f"Question {n}?",
+            options=["yes", "no"],
+            correct_answer="yes",
+            difficulty="Easy",
+        )
+        for n in range(1, 4)
+    ]
+    saved = []
+    return LiveQuiz("ABC123", questions, 0, saved.append), saved
+
+
+def test_answer_before_start_is_rejected():
+    quiz, _ = make_quiz()
+
+    async def run():
+        student = await quiz.join(7, "Ada", FakeSocket())
+        assert quiz.answer(student, -1, "yes") is None
+        assert quiz.answer(student, 0, "yes") is None
+        return student
+
+    student = asyncio.run(run())
+    assert list(student.states) == [UNSEEN] * 3
+    assert quiz.results(student) == []
+
+
+def test_only_the_current_question_is_graded_once():
+    quiz, _ = make_quiz()
+    socket = FakeSocket()
+
+    async def run():
+        student = await quiz.join(7, "Ada", socket)
+        await quiz.advance()
+        assert quiz.answer(student, 1, "yes") is None
+        assert quiz.answer(student, 0, "no") is False
+        assert quiz.answer(student, 0, "yes") is None
+        await quiz.advance()
+        assert quiz.answer(student, 0, "yes") is None
+        assert quiz.answer(student, 1, "a") is True
+        return student
+
+    student = asyncio.run(run())
+    assert list(student.states) == [WRONG, RIGHT, UNSEEN]
+    assert [r["question_id"] for r in quiz.results(student)] == [1, 2]
+    # Questions go out without their answer
+    assert all("correct_answer" not in m["question"] for m in socket.sent)
+
+
+def test_end_persists_once_and_rejects_answers():
+    quiz, saved = make_quiz()
+    socket = FakeSocket()
+
+    async def run():
+        student = await quiz.join(7, "Ada", socket)
+        await quiz.advance()
+        await quiz.end()
+        await quiz.end()
+        return student
+
+    student = asyncio.run(run())
+    assert saved == [quiz]
+    assert quiz.answer(student, 0, "yes") is None
+    assert socket.sent[-1]["type"] == "ended"
+
+
+def test_leaderboard_ranks_by_correct_answers():
+    quiz, _ = make_quiz()
+
+    async def run():
+        ada = await quiz.join(7, "Ada", FakeSocket())
+        bob = await quiz.join(8, "Bob", FakeSocket())
+        await quiz.advance()
+        quiz.answer(ada, 0, "no")
+        quiz.answer(bob, 0, "yes")
+
+    asyncio.run(run())
+    board = quiz.leaderboard()
+    assert [entry["name"] for entry in board["entries"]] == ["Bob", "Ada"]
+    assert board["answered"] == 2
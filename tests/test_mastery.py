@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from utils import mastery
+
+
+def reference_trace(evidence, initial=mastery.P_INIT):
+    state = initial
+    for value in evidence:
+        state = mastery.bkt_step(state, value)
+    return state
+
+
+def test_score_evidence_clips_to_unit_range():
+    assert mastery.score_evidence([-10, 50, 140]).tolist() == [0.0, 0.5, 1.0]
+
+
+def test_correct_answers_raise_mastery():
+    assert mastery.bkt_step(0.3, 1.0) > 0.3 > mastery.bkt_step(0.3, 0.0)
+
+
+def test_trace_matches_sequential_updates():
+    sequences = [[1.0, 0.0, 1.0, 1.0], [0.0], [], [0.5, 1.0]]
+    groups = np.repeat(np.arange(len(sequences)), [len(s) for s in sequences])
+    evidence = np.concatenate([np.asarray(s, dtype=np.float64) for s in sequences])
+
+    state = mastery.trace(groups, evidence, len(sequences))
+
+    assert state == pytest.approx([reference_trace(s) for s in sequences])
+
+
+def test_trace_continues_from_initial_state():
+    groups = np.array([0, 1, 1])
+    evidence = np.array([1.0, 0.0, 1.0])
+    initial = np.array([0.9, 0.1])
+
+    state = mastery.trace(groups, evidence, 2, initial=initial)
+
+    assert state == pytest.approx(
+        [reference_trace([1.0], 0.9), reference_trace([0.0, 1.0], 0.1)]
+    )
@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+
+from utils.ollama_client import OllamaClient
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return dict(self.payload)
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeHTTP:
+    def __init__(self):
+        self.generations = 0
+
+    async def post(self, url, json):
+        if url.endswith("/api/embeddings"):
+            return FakeResponse({"embedding": [1.0, 0.0, 0.0]})
+        self.generations += 1
+        return FakeResponse({"response": f"reply {self.generations}"})
+
+
+def make_client(tmp_path):
+    client = OllamaClient(cache_dir=str(tmp_path))
+    client.client = FakeHTTP()
+    return client
+
+
+def test_plain_generations_are_cached(tmp_path):
+    client = make_client(tmp_path)
+    key = client._cache_key("interactive_element", "mixtral", "Physics", "Newton")
+    first = asyncio.run(client._generate("mixtral", "prompt", key))
+    second = asyncio.run(client._generate("mixtral", "prompt", key))
+    assert second["response"] == first["response"]
+    assert second["cached"] is True
+
+
+def test_follow_ups_bypass_the_shared_cache(tmp_path):
+    client = make_client(tmp_path)
+    key = client._cache_key("interactive_element", "mixtral", "Physics", "Newton")
+    lesson = asyncio.run(client._generate("mixtral", "prompt", key, context=[1, 2]))
+    other = asyncio.run(client._generate("mixtral", "prompt", key))
+    assert other["response"] != lesson["response"]
+    assert "cached" not in other
+    assert len(client.generation_index.search(key[0], np.ones(3, np.float32))) == 1
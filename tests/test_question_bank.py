@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import pytest
+from models.database import Progress, Question, open_session, route_user
+from utils.question_bank import (
+    _mix_counts,
+    display_names,
+    grade_answer,
+    grade_submission,
+    parse_questions,
+    public_question,
+    record_exposures,
+    store_questions,
+)
+
+
+def question(**fields) -> Question:
+    return Question(
+        **{
+            "subject": "physics",
+            "topic": "motion",
+            "level": "beginner",
+            "question": "Which is a vector?",
+            "options": ["Speed", "Velocity", "Mass"],
+            "correct_answer": "Velocity",
+            **fields,
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "answer, correct",
+    [
+        ("Velocity", True),
+        ("  velocity ", True),
+        ("B", True),
+        ("b)", True),
+        ("a", False),
+        ("d", False),
+        ("Speed", False),
+        (None, False),
+    ],
+)
+def test_grade_answer(answer, correct):
+    assert grade_answer(question(), answer) is correct
+
+
+def test_grade_answer_without_options():
+    assert grade_answer(question(options=[], correct_answer="9.8"), "9.8")
+    assert not grade_answer(question(options=[], correct_answer="9.8"), "a")
+
+
+def test_parse_questions_keeps_well_formed_ones():
+    text = """<think>draft</think>{"questions": [
+        {"question": "Q1", "options": ["a", "b"], "correct_answer": "b",
+         "difficulty": "hard"},
+        {"question": "Q2", "options": ["a"], "correct_answer": "c"},
+        {"question": "", "correct_answer": "x"},
+        {"question": "Q4", "correct_answer": "4", "difficulty": "Unknown"}
+    ]}"""
+    parsed = parse_questions(text)
+    assert [q["question"] for q in parsed] == ["Q1", "Q4"]
+    assert [q["difficulty"] for q in parsed] == ["Hard", "Medium"]
+    assert parse_questions("not json") == []
+
+
+def test_mix_counts_adds_up():
+    for n in range(1, 30):
+        counts = _mix_counts(n)
+        assert sum(counts.values()) == n
+    assert _mix_counts(10) == {"Easy": 3, "Medium": 5, "Hard": 2}
+
+
+def test_public_question_hides_the_key():
+    shown = public_question(question(id=1, explanation="Direction matters"))
+    assert "correct_answer" not in shown and "explanation" not in shown
+
+
+def test_grade_submission_only_grades_served_questions(make_user):
+    user_id = make_user()
+    with open_session(route_user(user_id)[0]) as db:
+        served, unserved = store_questions(
+            db,
+            "Physics",
+            "Grading",
+            "Beginner",
+            [
+                {"question": f"Q{n}", "options": ["x", "y"], "correct_answer": "y"}
+                for n in range(2)
+            ],
+        )
+        record_exposures(db, user_id, [served.id])
+        results = grade_submission(db, user_id, {served.id: "b", unserved.id: "y"})
+        db.commit()
+        assert [(r["question_id"], r["correct"]) for r in results] == [
+            (served.id, True)
+        ]
+        # Each exposure is graded once
+        assert grade_submission(db, user_id, {served.id: "y"}) == []
+
+
+def test_store_questions_reuses_identical_questions():
+    with open_session(0) as db:
+        batch = [{"question": "Same?", "options": [], "correct_answer": "yes"}]
+        first = store_questions(db, "Physics", "Reuse", "Beginner", batch)
+        second = store_questions(db, " physics", "REUSE ", "beginner", batch)
+        assert [q.id for q in first] == [q.id for q in second]
+
+
+def test_display_names_follow_the_users_own_spelling(make_user):
+    user_id = make_user()
+    with open_session(route_user(user_id)[0]) as db:
+        db.add(
+            Progress(
+                user_id=user_id,
+                subject="Physics",
+                topic="Newton",
+                score=50,
+                completed_at=datetime(2026, 1, 1),
+            )
+        )
+        db.commit()
+        names = display_names(
+            db,
+            user_id,
+            [("physics", "newton"), ("physics", "optics")],
+            ("PHYSICS", "Optics"),
+        )
+    assert names == {
+        ("physics", "newton"): ("Physics", "Newton"),
+        ("physics", "optics"): ("Physics", "Optics"),
+    }
@@ -0,0 +1,102 @@
+import pytest
+from fastapi import HTTPException
+from models.database import SessionLocal, open_session, route_user
+from starlette.requests import Request
+from utils import quotas
+from utils.quotas import BucketStore, enforce_quota, request_cost, within_quota
+
+
+def make_request(path: str, address: str = "10.0.0.1") -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "scheme": "http",
+            "server": ("testserver", 80),
+            "path": path,
+            "query_string": b"",
+            "headers": [],
+            "client": (address, 1234),
+        }
+    )
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = BucketStore(str(tmp_path / "quotas.db"))
+    monkeypatch.setattr(quotas, "store", store)
+    monkeypatch.setattr(quotas, "QUOTAS_ENABLED", True)
+    return store
+
+
+def charge(request: Request, user_id: int, units: float):
+    # A session on the user's shard, as get_db would open
+    with open_session(route_user(user_id)[0]) as db:
+        enforce_quota(request, db, user_id, units)
+
+
+def test_request_cost_is_weighted_by_units():
+    assert request_cost("/api/flashcards", 10) == 12
+    assert request_cost("/api/lesson") == 8
+    assert request_cost("/unknown") == 1
+
+
+def test_take_charges_all_buckets_or_none(store):
+    buckets = [("a", 10, 1.0), ("b", 5, 1.0)]
+    assert store.take(buckets, 4, now=0)[0]
+    allowed, remaining, retry_after = store.take(buckets, 4, now=0)
+    assert not allowed
+    assert remaining == 1
+    assert retry_after == 3
+    # Bucket "a" was not charged for the refused request
+    assert store.take([("a", 10, 1.0)], 6, now=0)[0]
+
+
+def test_take_refills_over_time(store):
+    buckets = [("a", 10, 1.0)]
+    assert store.take(buckets, 10, now=0)[0]
+    assert not store.take(buckets, 5, now=4)[0]
+    assert store.take(buckets, 5, now=5)[0]
+
+
+def test_oversized_request_is_refused(store, make_user):
+    with pytest.raises(HTTPException) as error:
+        charge(make_request("/api/flashcards"), make_user(), 500)
+    assert error.value.status_code == 413
+
+
+def test_unknown_user_is_not_charged(store):
+    with pytest.raises(HTTPException) as error, SessionLocal() as db:
+        enforce_quota(make_request("/api/flashcards"), db, 10**9, 1)
+    assert error.value.status_code == 404
+    assert store._connect().execute("SELECT count(*) FROM buckets").fetchone()[0] == 0
+
+
+def test_client_address_is_limited_across_user_ids(store, make_user, monkeypatch):
+    config = {
+        **quotas.DEFAULT_CONFIG,
+        "client": {"capacity": 30, "refill_per_minute": 0},
+    }
+    monkeypatch.setattr(quotas, "load_config", lambda: config)
+    users = [make_user() for _ in range(3)]
+    request = make_request("/api/flashcards", "10.0.0.2")
+    charge(request, users[0], 10)
+    charge(request, users[1], 10)
+    with pytest.raises(HTTPException) as error:
+        charge(request, users[2], 10)
+    assert error.value.status_code == 429
+    # Another address is unaffected
+    charge(make_request("/api/flashcards", "10.0.0.3"), users[2], 10)
+
+
+def test_within_quota_reports_refusals(store, make_user, monkeypatch):
+    config = {
+        **quotas.DEFAULT_CONFIG,
+        "client": {"capacity": 10, "refill_per_minute": 0},
+    }
+    monkeypatch.setattr(quotas, "load_config", lambda: config)
+    user_id = make_user()
+    request = make_request("/api/lesson", "10.0.0.4")
+    with open_session(route_user(user_id)[0]) as db:
+        assert within_quota(request, db, user_id)
+        assert not within_quota(request, db, user_id)
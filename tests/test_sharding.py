@@ -0,0 +1,109 @@
+import asyncio
+import zlib
+
+import pytest
+from sqlalchemy import select
+from starlette.requests import Request
+
+from models import database
+from models.database import (
+    Progress,
+    ShardReadOnly,
+    User,
+    get_db,
+    open_session,
+    register_user,
+    register_users,
+    route_user,
+    session_factory,
+)
+from utils import rebalance
+
+
+@pytest.fixture(autouse=True)
+def fresh_routes():
+    database._routes.clear()
+    yield
+    database._routes.clear()
+
+
+def request_for(user_id: int, method: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": method,
+            "path": "/",
+            "headers": [],
+            "query_string": f"user_id={user_id}".encode(),
+            "path_params": {},
+        }
+    )
+
+
+def test_users_without_tenant_are_spread_by_id():
+    for _ in range(4):
+        user_id, shard = register_user()
+        assert shard == user_id % 2
+        assert route_user(user_id) == (shard, False)
+
+
+def test_tenant_users_share_a_shard():
+    first_id, shard = register_user("acme-school")
+    assert shard == zlib.crc32(b"acme-school") % 2
+    second_id, second_shard = register_user("acme-school")
+    assert second_shard == shard
+    assert route_user(second_id)[0] == route_user(first_id)[0]
+
+
+def test_unknown_users_route_to_the_default_shard():
+    assert route_user(10**9) == (database.SHARD, False)
+
+
+def test_register_users_skips_ids_on_other_shards():
+    user_id, shard = register_user()
+    other = 1 - shard
+    registered, new = register_users([user_id, None], shard=other)
+    assert registered[0] is None
+    assert registered[1] is not None and route_user(registered[1])[0] == other
+    assert new == {registered[1]}
+
+
+def test_session_factory_stays_on_the_shard():
+    with open_session(1) as db:
+        with session_factory(db)() as background:
+            assert background.info["shard"] == 1
+
+
+def test_moving_users_are_read_only(make_user):
+    user_id = make_user()
+    rebalance._set_directory([user_id], read_only=True)
+    database._routes.clear()
+    with pytest.raises(ShardReadOnly):
+        asyncio.run(get_db(request_for(user_id, "POST")).__anext__())
+    sessions = get_db(request_for(user_id, "GET"))
+    db = asyncio.run(sessions.__anext__())
+    assert db.info["shard"] == route_user(user_id)[0]
+    assert db.connection().exec_driver_sql("PRAGMA query_only").scalar() == 1
+    asyncio.run(sessions.aclose())
+    rebalance._set_directory([user_id], read_only=False)
+
+
+def test_move_copies_rows_and_updates_the_directory(make_user):
+    user_id = make_user()
+    source = route_user(user_id)[0]
+    with open_session(source) as db:
+        db.add(Progress(user_id=user_id, subject="Physics", topic="Optics"))
+        db.commit()
+
+    rebalance.move(1 - source, user_id=user_id, wait=0)
+    database._routes.clear()
+
+    shard, read_only = route_user(user_id)
+    assert (shard, read_only) == (1 - source, False)
+    with open_session(source) as db:
+        assert db.get(User, user_id) is None
+    with open_session(shard) as db:
+        topics = db.scalars(
+            select(Progress.topic).where(Progress.user_id == user_id)
+        ).all()
+    assert topics == ["Optics"]
@@ -0,0 +1,328 @@
+"""Hot/cold retention for progress and interactive-element history.
+
+Rows older than ``RETENTION_DAYS`` are moved out of the main database into a
+separate SQLite file (``ARCHIVE_DB_PATH``) so the hot database stays small.
+Before a row leaves, it is folded into the tables that outlive it:
+
+- ``archived_summary`` keeps per-topic counts, score sums and time spent,
+  which the dashboard and prompt digests add to the live aggregates;
+- ``mastery_baseline`` keeps the knowledge-tracing state after the archived
+  progress rows, so ``utils.mastery`` refits give the same estimates;
+- the columnar analytics copy is refreshed first, so cohort reports keep
+  every event.
+
+Rows move in chunks, one transaction per chunk, and a chunk is only deleted
+from the hot database in the transaction that copied it. ``full_history``
+reads both databases for the rare request that needs everything.
+
+    python -m utils.archive
+    python -m utils.archive --days 365 --vacuum
+"""
+
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from models.database import (
+    ArchivedSummary,
+    InteractiveElement,
+    MasteryBaseline,
+    Progress,
+    engine,
+)
+from sqlalchemy import (
+    Column,
+    Index,
+    MetaData,
+    Table,
+    case,
+    delete,
+    func,
+    insert,
+    null,
+    select,
+    union_all,
+)
+from sqlalchemy.dialects.sqlite import insert as upsert
+from utils import columnar
+from utils.mastery import P_INIT, score_evidence, trace
+from utils.question_bank import normalize_key
+
+# Defaults to a file next to the shard, so each shard has its own archive
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH")
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "180"))
+CHUNK_SIZE = 5000
+SCHEMA = "archive"
+
+# Collection -> (hot model, timestamp column used for retention)
+COLLECTIONS = {
+    "progress": (Progress, Progress.completed_at),
+    "interactive_elements": (InteractiveElement, InteractiveElement.created_at),
+}
+
+_metadata = MetaData()
+# Same columns as the hot tables, without foreign keys: archived rows may
+# outlive their user
+ARCHIVE_TABLES = {
+    name: Table(
+        name,
+        _metadata,
+        *(
+            Column(column.name, column.type, primary_key=column.primary_key)
+            for column in model.__table__.columns
+        ),
+        schema=SCHEMA,
+    )
+    for name, (model, _) in COLLECTIONS.items()
+}
+for _name, (_, _timestamp) in COLLECTIONS.items():
+    _table = ARCHIVE_TABLES[_name]
+    Index(f"ix_archive_{_name}_user", _table.c.user_id, _table.c[_timestamp.name])
+
+
+def archive_path(bind=engine) -> str:
+    """The archive file for the shard ``bind`` is connected to."""
+    return ARCHIVE_DB_PATH or (os.path.splitext(bind.url.database)[0] + "_archive.db")
+
+
+@contextmanager
+def attached(path: Optional[str] = None, bind=engine):
+    """A connection to ``bind`` with its archive attached as ``archive``."""
+    path = path or archive_path(bind)
+    with bind.connect() as conn:
+        conn.exec_driver_sql(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+        try:
+            _metadata.create_all(conn)
+            conn.commit()
+            yield conn
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql(f"DETACH DATABASE {SCHEMA}")
+
+
+def _fold_summary(conn, collection: str, ids: List[int]):
+    model, timestamp = COLLECTIONS[collection]
+    completed = (
+        func.count()
+        if model is Progress
+        else func.sum(case((model.completion_status.is_(True), 1), else_=0))
+    )
+    score = model.score if model is Progress else null()
+    rows = conn.execute(
+        select(
+            model.user_id,
+            model.subject,
+            model.topic,
+            func.count().label("entries"),
+            func.count(score).label("scored"),
+            func.coalesce(func.sum(score), 0.0).label("score_sum"),
+            completed.label("completed"),
+            func.coalesce(func.sum(model.time_spent), 0).label("time_spent"),
+            func.max(timestamp).label("last_at"),
+        )
+        .where(model.id.in_(ids), model.user_id.isnot(None))
+        .group_by(model.user_id, model.subject, model.topic)
+    ).all()
+    if not rows:
+        return
+    stmt = upsert(ArchivedSummary)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            ArchivedSummary.user_id,
+            ArchivedSummary.collection,
+            ArchivedSummary.subject,
+            ArchivedSummary.topic,
+        ],
+        set_={
+            "entries": ArchivedSummary.entries + new.entries,
+            "scored": ArchivedSummary.scored + new.scored,
+            "score_sum": ArchivedSummary.score_sum + new.score_sum,
+            "completed": ArchivedSummary.completed + new.completed,
+            "time_spent": ArchivedSummary.time_spent + new.time_spent,
+            "last_at": func.max(
+                func.coalesce(ArchivedSummary.last_at, new.last_at),
+                func.coalesce(new.last_at, ArchivedSummary.last_at),
+            ),
+        },
+    )
+    conn.execute(stmt, [{**row._asdict(), "collection": collection} for row in rows])
+
+
+def _fold_baseline(conn, ids: List[int]):
+    """Advance ``mastery_baseline`` over the scored progress rows in ``ids``."""
+    rows = conn.execute(
+        select(
+            Progress.user_id,
+            Progress.subject,
+            Progress.topic,
+            Progress.score,
+            Progress.completed_at,
+        )
+        .where(
+            Progress.id.in_(ids),
+            Progress.score.isnot(None),
+            Progress.user_id.isnot(None),
+        )
+        .order_by(Progress.completed_at, Progress.id)
+    ).all()
+    if not rows:
+        return
+    keys: Dict[tuple, int] = {}
+    groups = np.empty(len(rows), dtype=np.int64)
+    for i, row in enumerate(rows):
+        key = (row.user_id, normalize_key(row.subject), normalize_key(row.topic))
+        groups[i] = keys.setdefault(key, len(keys))
+    evidence = score_evidence([row.score for row in rows])
+
+    existing = {
+        (b.user_id, b.subject, b.topic): b
+        for b in conn.execute(
+            select(MasteryBaseline).where(
+                MasteryBaseline.user_id.in_({key[0] for key in keys})
+            )
+        )
+    }
+    initial = np.full(len(keys), P_INIT)
+    for key, g in keys.items():
+        if key in existing:
+            initial[g] = existing[key].mastery
+
+    # trace() wants events grouped; a stable sort keeps time order within each
+    order = np.argsort(groups, kind="stable")
+    mastery = trace(groups[order], evidence[order], len(keys), initial)
+    attempts = np.bincount(groups, minlength=len(keys))
+    last = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(last, groups, np.arange(len(groups)))
+
+    stmt = upsert(MasteryBaseline)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            MasteryBaseline.user_id,
+            MasteryBaseline.subject,
+            MasteryBaseline.topic,
+        ],
+        set_={
+            column: getattr(stmt.excluded, column)
+            for column in ("mastery", "attempts", "last_score", "last_practiced")
+        },
+    )
+    conn.execute(
+        stmt,
+        [
+            {
+                "user_id": key[0],
+                "subject": key[1],
+                "topic": key[2],
+                "mastery": float(mastery[g]),
+                "attempts": int(attempts[g])
+                + (existing[key].attempts if key in existing else 0),
+                "last_score": float(evidence[last[g]]),
+                "last_practiced": rows[last[g]].completed_at,
+            }
+            for key, g in keys.items()
+        ],
+    )
+
+
+def _archive_collection(conn, collection: str, cutoff: datetime) -> int:
+    model, timestamp = COLLECTIONS[collection]
+    table = model.__table__
+    columns = [column.name for column in table.columns]
+    moved = 0
+    while True:
+        with conn.begin():
+            ids = list(
+                conn.execute(
+                    select(model.id)
+                    .where(timestamp < cutoff)
+                    .order_by(timestamp, model.id)
+                    .limit(CHUNK_SIZE)
+                ).scalars()
+            )
+            if not ids:
+                return moved
+            conn.execute(
+                insert(ARCHIVE_TABLES[collection]).from_select(
+                    columns,
+                    select(*table.columns).where(model.id.in_(ids)),
+                )
+            )
+            _fold_summary(conn, collection, ids)
+            if model is Progress:
+                _fold_baseline(conn, ids)
+            conn.execute(delete(model).where(model.id.in_(ids)))
+        moved += len(ids)
+
+
+def archive_history(
+    days: int = RETENTION_DAYS,
+    path: Optional[str] = None,
+    now: Optional[datetime] = None,
+) -> Dict:
+    """Move rows older than ``days`` to the archive; returns rows moved."""
+    started = time.perf_counter()
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    columnar.export()
+    report = {"cutoff": cutoff.isoformat()}
+    with attached(path) as conn:
+        for collection in COLLECTIONS:
+            report[collection] = _archive_collection(conn, collection, cutoff)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def full_history(
+    collection: str, user_id: int, path: Optional[str] = None, bind=engine
+) -> List[Dict]:
+    """A user's rows from both databases of shard ``bind``, oldest first."""
+    model, timestamp = COLLECTIONS[collection]
+    hot = select(*model.__table__.columns).where(model.user_id == user_id)
+    path = path or archive_path(bind)
+    if not os.path.exists(path):
+        with bind.connect() as conn:
+            rows = conn.execute(hot.order_by(timestamp, model.id))
+            return [dict(row._mapping) for row in rows]
+    cold_table = ARCHIVE_TABLES[collection]
+    cold = select(*cold_table.columns).where(cold_table.c.user_id == user_id)
+    both = union_all(cold, hot).subquery()
+    with attached(path, bind) as conn:
+        rows = conn.execute(select(both).order_by(both.c[timestamp.name], both.c.id))
+        return [dict(row._mapping) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=RETENTION_DAYS,
+        help="Archive rows older than this many days",
+    )
+    parser.add_argument(
+        "--archive", default=archive_path(), help="Archive file of the shard"
+    )
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rebuild the hot database afterwards to return the freed pages",
+    )
+    args = parser.parse_args()
+    report = archive_history(args.days, args.archive)
+    print(
+        f"Archived {report['progress']} progress and "
+        f"{report['interactive_elements']} interactive-element rows older than "
+        f"{report['cutoff']} in {report['seconds']}s"
+    )
+    if args.vacuum:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""Bulk import and export of users and their learning history.
+
+Records are NDJSON (one JSON object per line) or CSV with a header row; in
+CSV, JSON-valued fields (``subjects``, ``tags``, ``analysis``...) hold JSON
+text. Imports read the input line by line, validate each record and insert
+valid ones in large batches, one transaction per batch, so memory stays
+flat whatever the file size. Invalid records are reported with their line
+number and skipped. History records name their user by ``user_id`` or by
+``user_email``.
+
+Exports stream rows through a server-side cursor in the same formats. Both
+work on the shard selected by ``DATABASE_SHARD``; imported users are
+registered on it in the shard directory.
+
+    python -m utils.bulk import users users.csv
+    python -m utils.bulk import progress history.ndjson
+    python -m utils.bulk export progress progress.csv --user-id 42
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from typing import IO, Any, Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from models.database import (
+    Flashcard,
+    Progress,
+    QuestionPaper,
+    SessionLocal,
+    User,
+    engine,
+    register_users,
+    unregister_user,
+)
+from pydantic import (
+    BaseModel,
+    Field,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+from sqlalchemy import insert, select
+from utils.mastery import refit_mastery
+from utils.scheduler import preference_errors
+
+BATCH_SIZE = 5000
+# Errors listed in an import report; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+FORMATS = ("ndjson", "csv")
+
+
+# Record schemas mirror the column defaults: every batch is one executemany,
+# so all records must carry the same keys.
+class UserRecord(BaseModel):
+    id: Optional[int] = None
+    name: str
+    email: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    subjects: Optional[dict] = None
+    preferences: Optional[dict] = None
+    is_active: bool = True
+    learning_goals: Optional[dict] = None
+    study_preferences: Optional[dict] = None
+
+    @field_validator("study_preferences")
+    @classmethod
+    def check_study_preferences(cls, value):
+        errors = preference_errors(value)
+        if errors:
+            raise ValueError("; ".join(errors))
+        return value
+
+
+class OwnedRecord(BaseModel):
+    user_id: Optional[int] = None
+    user_email: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_owner(self):
+        if self.user_id is None and not self.user_email:
+            raise ValueError("user_id or user_email is required")
+        return self
+
+
+class ProgressRecord(OwnedRecord):
+    subject: str
+    topic: str
+    score: Optional[float] = None
+    completed_at: datetime = Field(default_factory=datetime.utcnow)
+    time_spent: Optional[int] = None
+    difficulty_level: Optional[str] = None
+    feedback: Optional[dict] = None
+    learning_style: Optional[str] = None
+    confidence_level: Optional[float] = None
+    notes: Optional[str] = None
+
+
+class FlashcardRecord(OwnedRecord):
+    subject: str
+    topic: str
+    front: str
+    back: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_reviewed: Optional[datetime] = None
+    difficulty: Optional[str] = None
+    category: Optional[str] = None
+    tags: Optional[list] = None
+    review_count: int = 0
+    mastery_level: Optional[float] = None
+
+
+class PaperRecord(OwnedRecord):
+    subject: Optional[str] = None
+    file_path: Optional[str] = None
+    analysis: Optional[Any] = None
+    paper_metadata: Optional[dict] = None
+    tags: Optional[list] = None
+    difficulty_rating: Optional[float] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    is_public: bool = False
+
+
+# Kind -> (table model, record schema)
+KINDS: Dict[str, Tuple[Any, Type[BaseModel]]] = {
+    "users": (User, UserRecord),
+    "progress": (Progress, ProgressRecord),
+    "flashcards": (Flashcard, FlashcardRecord),
+    "papers": (QuestionPaper, PaperRecord),
+}
+
+JSON_FIELDS = {
+    "subjects",
+    "preferences",
+    "learning_goals",
+    "study_preferences",
+    "feedback",
+    "tags",
+    "analysis",
+    "paper_metadata",
+}
+
+
+def _parse_ndjson(stream: IO[str]) -> Iterator[Tuple[int, Any]]:
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, e
+
+
+def _parse_csv(stream: IO[str]) -> Iterator[Tuple[int, Any]]:
+    reader = csv.DictReader(stream)
+    for row in reader:
+        # Empty cells mean "not given"; JSON fields hold JSON text
+        record = {}
+        try:
+            for field, value in row.items():
+                if value is None or value == "":
+                    continue
+                record[field] = json.loads(value) if field in JSON_FIELDS else value
+        except ValueError as e:
+            yield reader.line_num, e
+            continue
+        yield reader.line_num, record
+
+
+def parse_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """``(line number, record dict or parse error)`` pairs from a text stream."""
+    return _parse_csv(stream) if fmt == "csv" else _parse_ndjson(stream)
+
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in e['loc']) or 'record'}: {e['msg']}"
+            for e in error.errors()
+        )
+    return str(error)
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        self.started = time.perf_counter()
+
+    def fail(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> Dict:
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "seconds": round(time.perf_counter() - self.started, 3),
+        }
+
+
+def _resolve_owners(
+    conn, batch: List[Tuple[int, Dict]], report: ImportReport
+) -> List[Tuple[int, Dict]]:
+    """Map ``user_email`` to ``user_id`` and drop records of unknown users."""
+    emails = {r["user_email"] for _, r in batch if r.get("user_email")}
+    ids = {r["user_id"] for _, r in batch if r.get("user_id") is not None}
+    by_email, known = {}, set()
+    if emails:
+        by_email = dict(
+            conn.execute(
+                select(User.email, User.id).where(User.email.in_(emails))
+            ).all()
+        )
+    if ids:
+        known = set(conn.execute(select(User.id).where(User.id.in_(ids))).scalars())
+    resolved = []
+    for line, record in batch:
+        email = record.pop("user_email", None)
+        if record.get("user_id") is None:
+            if email not in by_email:
+                report.fail(line, f"user_email: no user with email {email!r}")
+                continue
+            record["user_id"] = by_email[email]
+        elif record["user_id"] not in known:
+            report.fail(line, f"user_id: no user with id {record['user_id']}")
+            continue
+        resolved.append((line, record))
+    return resolved
+
+
+def _register(
+    batch: List[Tuple[int, Dict]], report: ImportReport
+) -> Tuple[List[Tuple[int, Dict]], Set[int]]:
+    """Register imported users on this shard in the shard directory.
+
+    Returns the records with their ids and the ids this batch added to the
+    directory, which are released again if their row is rejected.
+    """
+    ids, added = register_users([r.get("id") for _, r in batch])
+    registered = []
+    for (line, record), user_id in zip(batch, ids):
+        if user_id is None:
+            report.fail(line, f"id: user {record['id']} lives on another shard")
+            continue
+        record["id"] = user_id
+        registered.append((line, record))
+    return registered, added
+
+
+def import_records(
+    kind: str, stream: IO[str], fmt: str = "ndjson", batch_size: int = BATCH_SIZE
+) -> Dict:
+    """Validate and insert every record from ``stream``; returns a report.
+
+    Each batch is one transaction. A batch that violates a database
+    constraint (e.g. a duplicate email) is retried row by row, so only the
+    offending records are rejected.
+    """
+    model, schema = KINDS[kind]
+    report = ImportReport()
+    batch: List[Tuple[int, Dict]] = []
+    with engine.connect() as conn:
+
+        def flush():
+            added = set()
+            if model is User:
+                rows, added = _register(batch, report)
+            else:
+                with conn.begin():
+                    rows = _resolve_owners(conn, batch, report)
+            try:
+                if rows:
+                    with conn.begin():
+                        conn.execute(insert(model), [r for _, r in rows])
+                report.inserted += len(rows)
+            except Exception:
+                inserted = set()
+                for line, row in rows:
+                    try:
+                        with conn.begin():
+                            conn.execute(insert(model), [row])
+                        report.inserted += 1
+                        inserted.add(row.get("id"))
+                    except Exception as e:
+                        report.fail(line, str(getattr(e, "orig", e)))
+                # An id repeated in the batch stays if any of its rows went in
+                for user_id in added - inserted:
+                    unregister_user(user_id)
+            batch.clear()
+
+        for line, record in parse_records(stream, fmt):
+            if isinstance(record, Exception):
+                report.fail(line, f"invalid {fmt}: {record}")
+                continue
+            try:
+                record = schema.model_validate(record).model_dump()
+            except (ValidationError, TypeError) as e:
+                report.fail(line, _error_message(e))
+                continue
+            batch.append((line, record))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    return report.as_dict()
+
+
+def export_columns(kind: str) -> List[str]:
+    model, _ = KINDS[kind]
+    return [column.name for column in model.__table__.columns]
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_records(
+    kind: str,
+    fmt: str = "ndjson",
+    user_id: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[str]:
+    """Rows of ``kind`` as NDJSON lines or CSV text, ``batch_size`` rows a chunk."""
+    model, _ = KINDS[kind]
+    columns = export_columns(kind)
+    query = select(*model.__table__.columns).order_by(model.id)
+    if user_id is not None:
+        owner = model.id if model is User else model.user_id
+        query = query.where(owner == user_id)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=batch_size
+        ).execute(query)
+        for rows in result.partitions():
+            for row in rows:
+                if writer:
+                    writer.writerow(
+                        [
+                            (
+                                json.dumps(value)
+                                if name in JSON_FIELDS and value is not None
+                                else _jsonable(value)
+                            )
+                            for name, value in zip(columns, row)
+                        ]
+                    )
+                else:
+                    buffer.write(
+                        json.dumps(
+                            {name: _jsonable(v) for name, v in zip(columns, row)}
+                        )
+                    )
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if writer and buffer.tell():
+        yield buffer.getvalue()
+
+
+def guess_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("import", "export"):
+        sub = commands.add_parser(command)
+        sub.add_argument("kind", choices=sorted(KINDS))
+        sub.add_argument("path", help="File to read or write; '-' for stdin/stdout")
+        sub.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Defaults to csv for .csv paths and ndjson otherwise",
+        )
+    commands.choices["import"].add_argument(
+        "--batch-size", type=int, default=BATCH_SIZE
+    )
+    commands.choices["export"].add_argument("--user-id", type=int)
+    args = parser.parse_args()
+    fmt = guess_format(args.path, args.format)
+
+    if args.command == "import":
+        stream = (
+            sys.stdin
+            if args.path == "-"
+            else open(args.path, encoding="utf-8", newline="")
+        )
+        with stream:
+            report = import_records(args.kind, stream, fmt, args.batch_size)
+        if args.kind == "progress" and report["inserted"]:
+            with SessionLocal() as db:
+                refit_mastery(db)
+        for error in report["errors"]:
+            print(f"line {error['line']}: {error['error']}", file=sys.stderr)
+        print(
+            f"Imported {report['inserted']} {args.kind} records, "
+            f"{report['failed']} rejected, in {report['seconds']}s"
+        )
+    else:
+        out = (
+            sys.stdout
+            if args.path == "-"
+            else open(args.path, "w", encoding="utf-8", newline="")
+        )
+        with out:
+            for chunk in export_records(args.kind, fmt, args.user_id):
+                out.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+"""Columnar copies of progress and flashcard-review events for analytics.
+
+Each database shard has its own copy under ``COLUMNAR_DIR/shard<n>``, since
+row ids are only unique within a shard. Events are exported incrementally
+(by row id) into one directory per dataset and month, with one ``.npy``
+file per column. Subjects and topics
+are normalized and dictionary-encoded as int32 codes. Queries memory-map
+only the months they need and work on whole columns with NumPy.
+
+``manifest.json`` lists the current directory of every partition together
+with the string dictionary and the export watermarks. A rewritten
+partition goes to a fresh directory and the manifest is replaced
+atomically, so readers never see a half-written month. Writers take a
+``flock`` on the shard's ``.lock`` file. Cohort reports merge every shard's
+copy. Run the export periodically, e.g. from cron:
+
+    python -m utils.columnar
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Collection, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models.database import SHARD, engines
+from sqlalchemy import text
+from utils.question_bank import normalize_key
+
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", "analytics")
+EXPORT_BATCH_SIZE = 200000
+
+SCORE_BINS = np.linspace(0, 100, 11)
+PERCENTILES = (10, 25, 50, 75, 90)
+# Topics need this many attempts in the cohort to be ranked
+MIN_TOPIC_ATTEMPTS = 5
+# A student whose average on a topic is below this is struggling with it
+STRUGGLING_SCORE = 60.0
+TOP_TOPICS = 10
+# Group keys below this with a dense bincount instead of sorting
+DENSE_KEY_LIMIT = 1 << 24
+
+# Dataset -> (source query, [(column, dtype)]). Queries select rows after
+# the watermark id; the last column is the event time in Unix seconds.
+DATASETS = {
+    "progress": (
+        "SELECT id, user_id, subject, topic, score, time_spent, "
+        "CAST(strftime('%s', coalesce(completed_at, '1970-01-01')) AS INTEGER) "
+        "FROM progress WHERE id > :after AND user_id IS NOT NULL "
+        "ORDER BY id LIMIT :limit",
+        [
+            ("id", np.int64),
+            ("user_id", np.int64),
+            ("subject", np.int32),
+            ("topic", np.int32),
+            ("score", np.float32),  # NaN when not scored
+            ("time_spent", np.float32),  # Seconds, NaN when unknown
+            ("timestamp", np.int64),
+        ],
+    ),
+    "reviews": (
+        "SELECT r.id, r.user_id, f.subject, f.topic, r.mastery_level, r.correct, "
+        "CAST(strftime('%s', coalesce(r.reviewed_at, '1970-01-01')) AS INTEGER) "
+        "FROM flashcard_reviews r JOIN flashcards f ON f.id = r.flashcard_id "
+        "WHERE r.id > :after ORDER BY r.id LIMIT :limit",
+        [
+            ("id", np.int64),
+            ("user_id", np.int64),
+            ("subject", np.int32),
+            ("topic", np.int32),
+            ("mastery_level", np.float32),
+            ("correct", np.int8),
+            ("timestamp", np.int64),
+        ],
+    ),
+}
+STRING_COLUMNS = {"subject", "topic"}
+# Dataset -> table its row ids come from
+SOURCE_TABLES = {"progress": "progress", "reviews": "flashcard_reviews"}
+
+
+def shard_root(shard: int, root: str = COLUMNAR_DIR) -> str:
+    return os.path.join(root, f"shard{shard}")
+
+
+def _manifest_path(root: str) -> str:
+    return os.path.join(root, "manifest.json")
+
+
+@lru_cache(maxsize=4)
+def _read_manifest(path: str, mtime: float) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_manifest(root: str = COLUMNAR_DIR) -> Dict:
+    path = _manifest_path(root)
+    try:
+        return _read_manifest(path, os.path.getmtime(path))
+    except FileNotFoundError:
+        return {"version": 0, "watermarks": {}, "partitions": {}, "strings": []}
+
+
+def _write_manifest(root: str, manifest: Dict):
+    path = _manifest_path(root)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+@contextmanager
+def _locked(root: str):
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _month_keys(timestamps: np.ndarray) -> np.ndarray:
+    return timestamps.astype("datetime64[s]").astype("datetime64[M]").astype(str)
+
+
+def _read_partition(root: str, directory: str, dataset: str) -> Dict[str, np.ndarray]:
+    return {
+        name: np.load(os.path.join(root, directory, f"{name}.npy"), mmap_mode="r")
+        for name, _ in DATASETS[dataset][1]
+    }
+
+
+def _encode(values: Sequence, strings: List[str], codes: Dict[str, int]) -> np.ndarray:
+    encoded = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        key = normalize_key(value or "")
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(strings)
+            strings.append(key)
+        encoded[i] = code
+    return encoded
+
+
+def _write_partition(
+    root: str, directory: str, dataset: str, parts: List[Dict[str, np.ndarray]]
+):
+    os.makedirs(os.path.join(root, directory))
+    for name, dtype in DATASETS[dataset][1]:
+        np.save(
+            os.path.join(root, directory, f"{name}.npy"),
+            np.concatenate([p[name] for p in parts]).astype(dtype, copy=False),
+        )
+
+
+def export(
+    shard: int = SHARD, root: str = COLUMNAR_DIR, batch_size: int = EXPORT_BATCH_SIZE
+) -> Dict:
+    """Append a shard's events newer than the watermarks; returns rows per dataset."""
+    started = time.perf_counter()
+    root = shard_root(shard, root)
+    with _locked(root):
+        report = _export(root, engines[shard], batch_size)
+    return {**report, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _export(root: str, engine, batch_size: int) -> Dict:
+    manifest = json.loads(json.dumps(load_manifest(root)))  # Private copy
+    version = manifest["version"] + 1
+    strings = manifest["strings"]
+    codes = {s: i for i, s in enumerate(strings)}
+    exported, replaced = {}, []
+
+    with engine.connect() as conn:
+        for dataset, (query, columns) in DATASETS.items():
+            watermark = manifest["watermarks"].get(dataset, 0)
+            partitions = manifest["partitions"].setdefault(dataset, {})
+            pending: Dict[str, List[Dict[str, np.ndarray]]] = {}
+            count = 0
+            while True:
+                rows = conn.execute(
+                    text(query), {"after": watermark, "limit": batch_size}
+                ).all()
+                if not rows:
+                    break
+                raw = list(zip(*rows))
+                block = {}
+                for (name, dtype), values in zip(columns, raw):
+                    if name in STRING_COLUMNS:
+                        block[name] = _encode(values, strings, codes)
+                    elif np.issubdtype(dtype, np.floating):
+                        block[name] = np.array(
+                            [np.nan if v is None else v for v in values], dtype=dtype
+                        )
+                    else:
+                        block[name] = np.array(values, dtype=dtype)
+                months = _month_keys(block["timestamp"])
+                for month in np.unique(months):
+                    selected = months == month
+                    pending.setdefault(str(month), []).append(
+                        {name: values[selected] for name, values in block.items()}
+                    )
+                watermark = int(block["id"][-1])
+                count += len(rows)
+
+            # Rewrite each touched month into a new directory: old rows + new
+            for month, blocks in pending.items():
+                old = partitions.get(month)
+                parts = [_read_partition(root, old, dataset)] if old else []
+                directory = os.path.join(dataset, f"{month}.{version}")
+                _write_partition(root, directory, dataset, parts + blocks)
+                partitions[month] = directory
+                if old:
+                    replaced.append(old)
+            manifest["watermarks"][dataset] = watermark
+            exported[dataset] = count
+
+    manifest["version"] = version
+    manifest["exported_at"] = datetime.utcnow().isoformat()
+    _write_manifest(root, manifest)
+    # Readers holding the old files keep their mappings after unlinking
+    for directory in replaced:
+        shutil.rmtree(os.path.join(root, directory), ignore_errors=True)
+    return exported
+
+
+def forget(shard: int, ids: Dict[str, Collection[int]], root: str = COLUMNAR_DIR):
+    """Drop exported events by source row id, e.g. rows moved to another shard.
+
+    ``ids`` maps a dataset to row ids in the shard's ``SOURCE_TABLES`` table.
+    """
+    root = shard_root(shard, root)
+    with _locked(root):
+        manifest = json.loads(json.dumps(load_manifest(root)))
+        version = manifest["version"] + 1
+        replaced = []
+        for dataset, row_ids in ids.items():
+            dropped = np.asarray(sorted(row_ids), dtype=np.int64)
+            partitions = manifest["partitions"].get(dataset, {})
+            for month, old in list(partitions.items()):
+                columns = _read_partition(root, old, dataset)
+                keep = ~np.isin(columns["id"], dropped)
+                if keep.all():
+                    continue
+                directory = os.path.join(dataset, f"{month}.{version}")
+                _write_partition(
+                    root,
+                    directory,
+                    dataset,
+                    [{name: values[keep] for name, values in columns.items()}],
+                )
+                partitions[month] = directory
+                replaced.append(old)
+        if not replaced:
+            return
+        manifest["version"] = version
+        _write_manifest(root, manifest)
+    for directory in replaced:
+        shutil.rmtree(os.path.join(root, directory), ignore_errors=True)
+
+
+def _unix(moment: datetime) -> int:
+    """Unix seconds, reading naive datetimes as UTC like ``strftime('%s')``."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _month(moment: datetime) -> str:
+    return np.datetime64(_unix(moment), "s").astype("datetime64[M]").astype(str)
+
+
+def _select(
+    dataset: str,
+    manifest: Dict,
+    root: str,
+    user_ids: Optional[np.ndarray],
+    subject: Optional[int],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    names: Sequence[str],
+) -> Dict[str, np.ndarray]:
+    """Matching events across the partitions overlapping [since, until)."""
+    first = _month(since) if since else None
+    last = _month(until) if until else None
+    chunks = {name: [] for name in names}
+    for month, directory in sorted(manifest["partitions"].get(dataset, {}).items()):
+        if (first and month < first) or (last and month > last):
+            continue
+        columns = _read_partition(root, directory, dataset)
+        mask = np.ones(len(columns["id"]), dtype=bool)
+        if user_ids is not None:
+            mask &= np.isin(columns["user_id"], user_ids)
+        if subject is not None:
+            mask &= columns["subject"] == subject
+        if since:
+            mask &= columns["timestamp"] >= _unix(since)
+        if until:
+            mask &= columns["timestamp"] < _unix(until)
+        for name in names:
+            chunks[name].append(columns[name][mask])
+    return {
+        name: (
+            np.concatenate(parts)
+            if parts
+            else np.empty(0, dtype=dict(DATASETS[dataset][1])[name])
+        )
+        for name, parts in chunks.items()
+    }
+
+
+def _group(keys: np.ndarray):
+    """Like ``np.unique(keys, return_inverse=True)``, without a sort when dense."""
+    if len(keys) and keys.min() >= 0 and keys.max() < DENSE_KEY_LIMIT:
+        present = np.bincount(keys) > 0
+        return np.flatnonzero(present), (np.cumsum(present) - 1)[keys]
+    return np.unique(keys, return_inverse=True)
+
+
+def _topic_groups(events: Dict[str, np.ndarray], n_codes: int):
+    """Group events by (subject, topic), so equal topic names in different
+    subjects stay apart. Returns the pair keys and each event's group."""
+    return _group(events["subject"].astype(np.int64) * n_codes + events["topic"])
+
+
+def _topic_label(strings: List[str], pairs: np.ndarray, n_codes: int, g: int) -> Dict:
+    return {
+        "subject": strings[pairs[g] // n_codes],
+        "topic": strings[pairs[g] % n_codes],
+    }
+
+
+def _progress_report(events: Dict[str, np.ndarray], strings: List[str]) -> Dict:
+    scored = ~np.isnan(events["score"])
+    scores = events["score"][scored].astype(np.float64)
+    histogram, _ = np.histogram(scores, bins=SCORE_BINS)
+
+    # Per-student averages
+    students, student_index = _group(events["user_id"][scored])
+    student_means = np.bincount(student_index, scores) / np.maximum(
+        np.bincount(student_index), 1
+    )
+    student_histogram, _ = np.histogram(student_means, bins=SCORE_BINS)
+
+    # Per-topic aggregates over (subject, topic) groups
+    n_codes = max(len(strings), 1)
+    topic_pairs, topics = _topic_groups(events, n_codes)
+    n_topics = len(topic_pairs)
+    attempts = np.bincount(topics[scored], minlength=n_topics)
+    topic_means = np.bincount(topics[scored], scores, minlength=n_topics) / np.maximum(
+        attempts, 1
+    )
+    minutes = (
+        np.bincount(topics, np.nan_to_num(events["time_spent"]), minlength=n_topics)
+        / 60
+    )
+
+    # Students per topic and those averaging below the struggling score
+    pairs, pair_index = _group(student_index * n_topics + topics[scored])
+    pair_means = np.bincount(pair_index, scores) / np.bincount(pair_index)
+    pair_topics = pairs % max(n_topics, 1)
+    students_per_topic = np.bincount(pair_topics, minlength=n_topics)
+    struggling = np.bincount(
+        pair_topics, pair_means < STRUGGLING_SCORE, minlength=n_topics
+    )
+
+    ranked = np.flatnonzero(attempts >= MIN_TOPIC_ATTEMPTS)
+    weakest = ranked[np.argsort(topic_means[ranked], kind="stable")][:TOP_TOPICS]
+    busiest = np.argsort(-minutes, kind="stable")[:TOP_TOPICS]
+    return {
+        "events": int(len(topics)),
+        "scored": int(len(scores)),
+        "students": int(len(students)),
+        "mean_score": round(float(scores.mean()), 1) if len(scores) else None,
+        "percentiles": (
+            {
+                str(p): round(float(v), 1)
+                for p, v in zip(PERCENTILES, np.percentile(scores, PERCENTILES))
+            }
+            if len(scores)
+            else {}
+        ),
+        "score_histogram": {"bins": SCORE_BINS.tolist(), "counts": histogram.tolist()},
+        "student_average_histogram": {
+            "bins": SCORE_BINS.tolist(),
+            "counts": student_histogram.tolist(),
+        },
+        "struggling_topics": [
+            {
+                **_topic_label(strings, topic_pairs, n_codes, t),
+                "mean_score": round(float(topic_means[t]), 1),
+                "attempts": int(attempts[t]),
+                "students": int(students_per_topic[t]),
+                "struggling_students": int(struggling[t]),
+            }
+            for t in weakest
+        ],
+        "time_on_topic": [
+            {
+                **_topic_label(strings, topic_pairs, n_codes, t),
+                "minutes": round(float(minutes[t]), 1),
+            }
+            for t in busiest
+            if minutes[t] > 0
+        ],
+    }
+
+
+def _review_report(events: Dict[str, np.ndarray], strings: List[str]) -> Dict:
+    n_codes = max(len(strings), 1)
+    topic_pairs, topics = _topic_groups(events, n_codes)
+    reviews = np.bincount(topics, minlength=len(topic_pairs))
+    recalled = np.bincount(topics, events["correct"], minlength=len(topic_pairs))
+    ranked = np.flatnonzero(reviews >= MIN_TOPIC_ATTEMPTS)
+    rates = recalled[ranked] / reviews[ranked]
+    order = np.argsort(rates, kind="stable")[:TOP_TOPICS]
+    return {
+        "reviews": int(len(topics)),
+        "recall_rate": (
+            round(float(events["correct"].mean()), 3) if len(topics) else None
+        ),
+        "hardest_decks": [
+            {
+                **_topic_label(strings, topic_pairs, n_codes, ranked[i]),
+                "recall_rate": round(float(rates[i]), 3),
+                "reviews": int(reviews[ranked[i]]),
+            }
+            for i in order
+        ],
+    }
+
+
+def _shard_events(
+    root: str,
+    strings: List[str],
+    codes: Dict[str, int],
+    cohort: Optional[np.ndarray],
+    subject: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+) -> Dict:
+    """One shard's selected events, with strings recoded into ``strings``."""
+    manifest = load_manifest(root)
+    remap = np.asarray(
+        [codes.setdefault(key, len(codes)) for key in manifest["strings"]],
+        dtype=np.int32,
+    )
+    strings.extend(list(codes)[len(strings) :])
+    subject_code = None
+    if subject:
+        try:
+            subject_code = manifest["strings"].index(normalize_key(subject))
+        except ValueError:
+            subject_code = -1  # Unknown subject: matches nothing
+
+    events = {
+        "progress": _select(
+            "progress",
+            manifest,
+            root,
+            cohort,
+            subject_code,
+            since,
+            until,
+            ("user_id", "subject", "topic", "score", "time_spent"),
+        ),
+        "reviews": _select(
+            "reviews",
+            manifest,
+            root,
+            cohort,
+            subject_code,
+            since,
+            until,
+            ("subject", "topic", "correct"),
+        ),
+    }
+    for columns in events.values():
+        for name in STRING_COLUMNS:
+            columns[name] = remap[columns[name]] if len(remap) else columns[name]
+    return {**events, "exported_at": manifest.get("exported_at")}
+
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def cohort_report(
+    user_ids: Optional[Sequence[int]] = None,
+    subject: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    root: str = COLUMNAR_DIR,
+) -> Dict:
+    """Score distributions, struggling topics and time on topic for a cohort.
+
+    ``user_ids`` of None covers every student. Merges every shard's copy and
+    reflects the oldest of their last exports.
+    """
+    started = time.perf_counter()
+    cohort = np.asarray(sorted(set(user_ids)), dtype=np.int64) if user_ids else None
+    strings: List[str] = []
+    codes: Dict[str, int] = {}
+    shards = [
+        _shard_events(
+            shard_root(shard, root), strings, codes, cohort, subject, since, until
+        )
+        for shard in range(len(engines))
+    ]
+    exported = [s["exported_at"] for s in shards if s["exported_at"]]
+    return {
+        "progress": _progress_report(_concat([s["progress"] for s in shards]), strings),
+        "flashcards": _review_report(_concat([s["reviews"] for s in shards]), strings),
+        "exported_at": min(exported) if len(exported) == len(shards) else None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+if __name__ == "__main__":
+    for shard in range(len(engines)):
+        report = export(shard)
+        print(
+            f"Shard {shard}: exported {report['progress']} progress events and "
+            f"{report['reviews']} flashcard reviews in {report['seconds']}s"
+        )
@@ -0,0 +1,147 @@
+"""Train compression dictionaries and compress existing rows.
+
+Columns typed ``CompressedText``/``CompressedJSON`` in ``models.database``
+are compressed as they are written. ``train`` builds a new preset
+dictionary from recent values of all of them; ``migrate`` rewrites the rows
+not yet stored with the current dictionary, so it both converts databases
+created before compression and re-encodes rows after retraining.
+
+    python -m utils.compression_dictionary train
+    python -m utils.compression_dictionary migrate --vacuum
+"""
+
+import argparse
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from models import compression
+from models.database import (
+    Base,
+    CompressedText,
+    CompressionDictionary,
+    directory_engine,
+    engine,
+)
+from sqlalchemy import insert
+
+# Most recent values per column used to train a dictionary
+TRAIN_SAMPLES = 2000
+MIGRATE_BATCH_SIZE = 500
+
+
+def compressed_columns() -> List[Tuple[str, str]]:
+    """``(table, column)`` for every compressed column."""
+    return [
+        (table.name, column.name)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, CompressedText)
+    ]
+
+
+def _samples(conn, per_column: int) -> Iterator[str]:
+    for table, column in compressed_columns():
+        rows = conn.exec_driver_sql(
+            f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL "
+            "ORDER BY id DESC LIMIT ?",
+            (per_column,),
+        )
+        for (value,) in rows:
+            yield compression.decompress(value)
+
+
+def train(per_column: int = TRAIN_SAMPLES) -> Dict:
+    """Store a dictionary trained on current content; returns its id and size."""
+    with engine.connect() as conn:
+        samples = list(_samples(conn, per_column))
+    dictionary = compression.train_dictionary(samples)
+    # Dictionaries are shared by all shards, so rows can move between them
+    with directory_engine.begin() as conn:
+        dictionary_id = conn.execute(
+            insert(CompressionDictionary).values(data=dictionary, samples=len(samples))
+        ).inserted_primary_key[0]
+    compression.reload()
+    return {"id": dictionary_id, "bytes": len(dictionary), "samples": len(samples)}
+
+
+def _stored_size(value) -> int:
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+
+
+def migrate(batch_size: int = MIGRATE_BATCH_SIZE) -> Dict:
+    """Re-encode stored values with the current dictionary, in batches."""
+    started = time.perf_counter()
+    report = {"rows": 0, "bytes_before": 0, "bytes_after": 0}
+    with engine.connect() as conn:
+        for table, column in compressed_columns():
+            last_id = 0
+            while True:
+                rows = conn.exec_driver_sql(
+                    f"SELECT id, {column} FROM {table} WHERE id > ? "
+                    "ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                updates = []
+                for row_id, value in rows:
+                    size = _stored_size(value)
+                    report["bytes_before"] += size
+                    if compression.is_current(value):
+                        report["bytes_after"] += size
+                        continue
+                    stored = compression.compress(compression.decompress(value))
+                    report["bytes_after"] += _stored_size(stored)
+                    if stored != value:
+                        updates.append((stored, row_id))
+                if updates:
+                    conn.exec_driver_sql(
+                        f"UPDATE {table} SET {column} = ? WHERE id = ?", updates
+                    )
+                conn.commit()
+                report["rows"] += len(updates)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("train").add_argument(
+        "--samples",
+        type=int,
+        default=TRAIN_SAMPLES,
+        help="Most recent values per column to train on",
+    )
+    migrate_parser = commands.add_parser("migrate")
+    migrate_parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE)
+    migrate_parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="Rebuild the database afterwards to return the freed pages",
+    )
+    args = parser.parse_args()
+
+    if args.command == "train":
+        report = train(args.samples)
+        print(
+            f"Trained dictionary {report['id']} ({report['bytes']} bytes) "
+            f"from {report['samples']} values"
+        )
+        return
+    report = migrate(args.batch_size)
+    ratio = report["bytes_before"] / max(report["bytes_after"], 1)
+    print(
+        f"Rewrote {report['rows']} values: {report['bytes_before']} -> "
+        f"{report['bytes_after']} bytes ({ratio:.1f}x) in {report['seconds']}s"
+    )
+    if args.vacuum:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
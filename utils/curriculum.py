@@ -0,0 +1,117 @@
+"""Topic prerequisite graphs, one DAG per subject.
+
+The graphs are read from the JSON file named by ``CURRICULUM_PATH``:
+
+    {"math": {"algebra": ["arithmetic"], "calculus": ["algebra"]}}
+
+mapping each subject to its topics and each topic to the topics it builds
+on. Subjects and topics are normalized like question bank keys. The parsed
+graphs are cached in memory and reloaded when the file changes.
+"""
+
+import heapq
+import json
+import os
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Set
+
+from utils.question_bank import normalize_key
+
+CURRICULUM_PATH = os.getenv("CURRICULUM_PATH", "curriculum.json")
+
+Graph = Dict[str, List[str]]  # Topic -> prerequisite topics
+
+
+class CurriculumError(ValueError):
+    pass
+
+
+def _check_acyclic(subject: str, graph: Graph):
+    visiting, done = set(), set()
+    for root in graph:
+        if root in done:
+            continue
+        stack = [(root, iter(graph[root]))]
+        visiting.add(root)
+        while stack:
+            topic, prerequisites = stack[-1]
+            for prerequisite in prerequisites:
+                if prerequisite in visiting:
+                    raise CurriculumError(
+                        f"Prerequisite cycle in {subject} through {prerequisite!r}"
+                    )
+                if prerequisite not in done:
+                    visiting.add(prerequisite)
+                    stack.append((prerequisite, iter(graph.get(prerequisite, ()))))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(topic)
+                done.add(topic)
+
+
+@lru_cache(maxsize=4)
+def _load(path: str, mtime: float) -> Dict[str, Graph]:
+    with open(path) as f:
+        raw = json.load(f)
+    graphs = {}
+    for subject, topics in raw.items():
+        graph: Graph = {}
+        for topic, prerequisites in topics.items():
+            graph[normalize_key(topic)] = [normalize_key(p) for p in prerequisites]
+        for prerequisites in list(graph.values()):
+            for prerequisite in prerequisites:
+                graph.setdefault(prerequisite, [])
+        _check_acyclic(subject, graph)
+        graphs[normalize_key(subject)] = graph
+    return graphs
+
+
+def load_curriculum(path: str = CURRICULUM_PATH) -> Dict[str, Graph]:
+    """All subject graphs; empty when no curriculum file exists."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    return _load(path, mtime)
+
+
+def prerequisite_graph(subject: str) -> Graph:
+    return load_curriculum().get(normalize_key(subject), {})
+
+
+def with_prerequisites(graph: Graph, topics: Iterable[str]) -> Set[str]:
+    """``topics`` plus everything they transitively depend on."""
+    found, stack = set(), list(topics)
+    while stack:
+        topic = stack.pop()
+        if topic not in found:
+            found.add(topic)
+            stack.extend(graph.get(topic, ()))
+    return found
+
+
+def topological_order(
+    graph: Graph, topics: Iterable[str], priority: Callable[[str], tuple]
+) -> List[str]:
+    """Order ``topics`` so prerequisites come first, ties broken by ``priority``.
+
+    Prerequisites outside ``topics`` are treated as already satisfied.
+    """
+    topics = set(topics)
+    waiting = {t: {p for p in graph.get(t, ()) if p in topics} for t in topics}
+    dependents: Dict[str, List[str]] = {}
+    for topic, prerequisites in waiting.items():
+        for prerequisite in prerequisites:
+            dependents.setdefault(prerequisite, []).append(topic)
+    ready = [(priority(t), t) for t, p in waiting.items() if not p]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, topic = heapq.heappop(ready)
+        order.append(topic)
+        for dependent in dependents.get(topic, ()):
+            waiting[dependent].discard(topic)
+            if not waiting[dependent]:
+                heapq.heappush(ready, (priority(dependent), dependent))
+    return order
@@ -0,0 +1,186 @@
+"""Server-side aggregates for the Streamlit dashboard pages.
+
+Everything a page needs is computed in a handful of indexed aggregate
+queries, so clients no longer download whole tables to count rows.
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+from models.database import (
+    ArchivedSummary,
+    Flashcard,
+    InteractiveElement,
+    Lesson,
+    Progress,
+    QuestionPaper,
+    StudyPlan,
+    TopicMastery,
+    User,
+)
+from sqlalchemy import case, func, literal, or_, select, union_all
+from sqlalchemy.orm import Session
+from utils.mastery import MASTERY_TARGET, recommend
+
+MASTERED_THRESHOLD = 0.8
+# A card is due once this many days have passed since its last review,
+# doubling with each review: 1, 2, 4, ... days
+MAX_REVIEW_INTERVAL_DAYS = 30
+RECENT_ACTIVITY_LIMIT = 5
+RECOMMENDATION_LIMIT = 3
+
+
+def _count(model, user_id: int):
+    return (
+        select(func.count()).select_from(model).where(model.user_id == user_id)
+    ).scalar_subquery()
+
+
+def due_flashcards_clause(now: datetime):
+    interval = func.min(
+        literal(1).op("<<")(func.coalesce(Flashcard.review_count, 0)),
+        MAX_REVIEW_INTERVAL_DAYS,
+    )
+    return or_(
+        Flashcard.last_reviewed.is_(None),
+        func.julianday(now) - func.julianday(Flashcard.last_reviewed) >= interval,
+    )
+
+
+def build_dashboard(db: Session, user_id: int) -> Optional[Dict]:
+    """Counts, per-subject aggregates and recent activity for one user."""
+    counts = db.execute(
+        select(
+            select(User.id).where(User.id == user_id).scalar_subquery(),
+            _count(Lesson, user_id),
+            _count(StudyPlan, user_id),
+            _count(QuestionPaper, user_id),
+        )
+    ).one()
+    if counts[0] is None:
+        return None
+
+    # Live rows plus the summaries of rows moved to the archive
+    live = (
+        select(
+            Progress.subject,
+            func.count(),
+            func.count(Progress.score),
+            func.sum(Progress.score),
+            func.sum(Progress.time_spent),
+            func.max(Progress.completed_at),
+        )
+        .where(Progress.user_id == user_id)
+        .group_by(Progress.subject)
+    )
+    archived = select(
+        ArchivedSummary.subject,
+        ArchivedSummary.entries,
+        ArchivedSummary.scored,
+        ArchivedSummary.score_sum,
+        ArchivedSummary.time_spent,
+        ArchivedSummary.last_at,
+    ).where(
+        ArchivedSummary.user_id == user_id,
+        ArchivedSummary.collection == "progress",
+    )
+    history = union_all(live, archived).subquery()
+    subject_column, *totals, last_column = history.c
+    subjects = {}
+    for row in db.execute(
+        select(
+            subject_column,
+            *(func.sum(column) for column in totals),
+            func.max(last_column),
+        ).group_by(subject_column)
+    ):
+        subject, entries, scored, score_sum, time_spent, last_activity = row
+        subjects[subject] = {
+            "completed_lessons": entries,
+            "quizzes_taken": scored,
+            "quiz_score": round(score_sum / scored if scored else 0.0, 1),
+            "time_spent": round((time_spent or 0) / 60),  # minutes
+            "last_activity": last_activity.isoformat() if last_activity else None,
+        }
+
+    cards = db.execute(
+        select(
+            func.count(),
+            func.sum(case((Flashcard.mastery_level >= MASTERED_THRESHOLD, 1), else_=0)),
+            func.sum(case((due_flashcards_clause(datetime.utcnow()), 1), else_=0)),
+        ).where(Flashcard.user_id == user_id)
+    ).one()
+
+    elements = db.execute(
+        select(
+            func.count(),
+            func.sum(
+                case((InteractiveElement.completion_status.is_(True), 1), else_=0)
+            ),
+        ).where(InteractiveElement.user_id == user_id)
+    ).one()
+    archived_elements = db.execute(
+        select(
+            func.sum(ArchivedSummary.entries), func.sum(ArchivedSummary.completed)
+        ).where(
+            ArchivedSummary.user_id == user_id,
+            ArchivedSummary.collection == "interactive_elements",
+        )
+    ).one()
+
+    mastery = db.execute(
+        select(
+            func.count(),
+            func.sum(case((TopicMastery.mastery >= MASTERY_TARGET, 1), else_=0)),
+            func.avg(TopicMastery.mastery),
+        ).where(TopicMastery.user_id == user_id)
+    ).one()
+
+    recent = db.execute(
+        select(
+            Progress.subject,
+            Progress.topic,
+            Progress.score,
+            Progress.completed_at,
+        )
+        .where(Progress.user_id == user_id)
+        .order_by(Progress.completed_at.desc())
+        .limit(RECENT_ACTIVITY_LIMIT)
+    ).all()
+
+    return {
+        "user_id": user_id,
+        "counts": {
+            "lessons": counts[1],
+            "study_plans": counts[2],
+            "question_papers": counts[3],
+            "progress_entries": sum(s["completed_lessons"] for s in subjects.values()),
+        },
+        "subjects": subjects,
+        "flashcards": {
+            "total": cards[0],
+            "mastered": cards[1] or 0,
+            "due": cards[2] or 0,
+        },
+        "interactive_elements": {
+            "total": elements[0] + (archived_elements[0] or 0),
+            "completed": (elements[1] or 0) + (archived_elements[1] or 0),
+        },
+        "mastery": {
+            "topics": mastery[0],
+            "mastered": mastery[1] or 0,
+            "average": round(mastery[2] or 0.0, 3),
+        },
+        "recommendations": recommend(db, user_id, RECOMMENDATION_LIMIT),
+        "recent_activity": [
+            {
+                "subject": row.subject,
+                "topic": row.topic,
+                "score": row.score,
+                "completed_at": (
+                    row.completed_at.isoformat() if row.completed_at else None
+                ),
+            }
+            for row in recent
+        ],
+    }
@@ -0,0 +1,98 @@
+"""Stale-content fallbacks for when the Ollama queue is too deep.
+
+When ``OllamaClient.is_overloaded`` reports that a new generation would
+wait longer than the queue budget, the lesson, quiz and flashcard routes
+answer immediately with the closest content already stored for the same
+subject, topic and level, marked ``stale``, and queue a fresh generation
+in the background. Only the user's own and shared content is served.
+"""
+
+import logging
+import random
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from models.database import Flashcard, Lesson, Question
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from utils.question_bank import bank_key
+
+logger = logging.getLogger(__name__)
+
+STALE_FLASHCARD_LIMIT = 20
+
+# Regenerations queued in this process, to avoid piling up duplicates
+_regenerating: Set[Tuple] = set()
+
+
+def stale_lesson(
+    db: Session, user_id: Optional[int], subject: str, topic: str, level: str
+) -> Optional[Lesson]:
+    """Newest stored lesson on the topic, preferring the same level and own lessons."""
+    owners = Lesson.user_id.is_(None)
+    if user_id is not None:
+        owners = or_(owners, Lesson.user_id == user_id)
+    return (
+        db.query(Lesson)
+        .filter(
+            func.lower(Lesson.subject) == subject.lower(),
+            func.lower(Lesson.topic) == topic.lower(),
+            owners,
+        )
+        .order_by(
+            (func.lower(Lesson.level) == level.lower()).desc(),
+            Lesson.user_id.isnot(None).desc(),
+            Lesson.created_at.desc(),
+        )
+        .first()
+    )
+
+
+def stale_quiz(
+    db: Session,
+    subject: str,
+    topic: str,
+    level: str,
+    num_questions: int,
+    question_types: Optional[List[str]] = None,
+) -> List[Question]:
+    """Up to ``num_questions`` bank questions, including ones the user has seen."""
+    subject, topic, level = bank_key(subject, topic, level)
+    query = db.query(Question).filter(
+        Question.subject == subject,
+        Question.topic == topic,
+        Question.level == level,
+    )
+    if question_types:
+        query = query.filter(Question.question_type.in_(question_types))
+    questions = query.all()
+    return random.sample(questions, min(num_questions, len(questions)))
+
+
+def stale_flashcards(
+    db: Session, user_id: int, subject: str, topic: str
+) -> List[Flashcard]:
+    """The user's existing cards on the topic, least recently reviewed first."""
+    return (
+        db.query(Flashcard)
+        .filter(
+            Flashcard.user_id == user_id,
+            func.lower(Flashcard.subject) == subject.lower(),
+            func.lower(Flashcard.topic) == topic.lower(),
+        )
+        .order_by(Flashcard.last_reviewed.asc().nullsfirst())
+        .limit(STALE_FLASHCARD_LIMIT)
+        .all()
+    )
+
+
+async def regenerate_once(key: Tuple, regenerate: Callable[[], Awaitable]):
+    """Run a background regeneration unless one for ``key`` is already queued."""
+    if key in _regenerating:
+        return
+    _regenerating.add(key)
+    try:
+        await regenerate()
+    except Exception:
+        logger.exception("Background regeneration failed for %s", key)
+    finally:
+        _regenerating.discard(key)
@@ -0,0 +1,278 @@
+"""Bounded summaries of a learner's history for LLM prompts.
+
+Prompts used to embed the raw profile and progress history, so they grew
+with every session a student completed. These digests keep a fixed shape
+(a capped number of weak topics, recent scores and milestones plus a few
+aggregates) computed in SQL, so their size does not depend on how long the
+student has used the system.
+"""
+
+import json
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from models.database import (
+    ArchivedSummary,
+    Flashcard,
+    Progress,
+    StudyPlan,
+    TopicMastery,
+    User,
+)
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session
+from utils.dashboard import MASTERED_THRESHOLD, due_flashcards_clause
+from utils.mastery import MASTERY_TARGET
+from utils.tokens import truncate_to_tokens
+
+RECENT_SCORES = 5
+WEAK_TOPICS = 5
+STRONG_TOPICS = 3
+WEAK_DECKS = 3
+UPCOMING_MILESTONES = 3
+MAX_SUBJECTS = 8
+# Scores are compared across two windows of this many days for the trend
+TREND_DAYS = 30
+# Average-score change, in points, below which the trend counts as steady
+TREND_THRESHOLD = 3.0
+# Cap on free-form profile fields such as learning goals
+PROFILE_FIELD_TOKENS = 60
+
+
+def _compact(value: Any) -> Optional[str]:
+    if not value:
+        return None
+    text = value if isinstance(value, str) else json.dumps(value, separators=(",", ":"))
+    return truncate_to_tokens(text, PROFILE_FIELD_TOKENS)
+
+
+def profile_digest(user: User) -> Dict:
+    subjects = list((user.subjects or {}).items())
+    return {
+        "subjects": subjects[:MAX_SUBJECTS],
+        "more_subjects": max(0, len(subjects) - MAX_SUBJECTS),
+        "learning_goals": _compact(user.learning_goals),
+        "study_preferences": _compact(user.study_preferences),
+    }
+
+
+def progress_digest(db: Session, user_id: int, now: Optional[datetime] = None) -> Dict:
+    """Score aggregates, trend, recent scores and weakest/strongest topics."""
+    now = now or datetime.utcnow()
+    recent_start = now - timedelta(days=TREND_DAYS)
+    previous_start = recent_start - timedelta(days=TREND_DAYS)
+    totals = db.execute(
+        select(
+            func.count(Progress.score),
+            func.avg(Progress.score),
+            func.avg(case((Progress.completed_at >= recent_start, Progress.score))),
+            func.avg(
+                case(
+                    (
+                        and_(
+                            Progress.completed_at >= previous_start,
+                            Progress.completed_at < recent_start,
+                        ),
+                        Progress.score,
+                    )
+                )
+            ),
+        ).where(Progress.user_id == user_id)
+    ).one()
+    sessions, average, recent_average, previous_average = totals
+    # Overall figures include sessions moved to the archive
+    archived, archived_sum = db.execute(
+        select(
+            func.sum(ArchivedSummary.scored), func.sum(ArchivedSummary.score_sum)
+        ).where(
+            ArchivedSummary.user_id == user_id,
+            ArchivedSummary.collection == "progress",
+        )
+    ).one()
+    if archived:
+        average = ((average or 0.0) * sessions + archived_sum) / (sessions + archived)
+        sessions += archived
+
+    trend = None
+    if recent_average is not None and previous_average is not None:
+        change = recent_average - previous_average
+        trend = {
+            "change": round(change, 1),
+            "direction": (
+                "steady"
+                if abs(change) < TREND_THRESHOLD
+                else "improving" if change > 0 else "declining"
+            ),
+        }
+
+    recent = db.execute(
+        select(Progress.subject, Progress.topic, Progress.score, Progress.completed_at)
+        .where(Progress.user_id == user_id, Progress.score.isnot(None))
+        .order_by(Progress.completed_at.desc())
+        .limit(RECENT_SCORES)
+    ).all()
+
+    def topics(order, limit, *conditions):
+        return [
+            {
+                "subject": row.subject,
+                "topic": row.topic,
+                "mastery": round(row.mastery, 2),
+                "attempts": row.attempts,
+            }
+            for row in db.query(TopicMastery)
+            .filter(TopicMastery.user_id == user_id, *conditions)
+            .order_by(order)
+            .limit(limit)
+        ]
+
+    return {
+        "sessions": sessions,
+        "average_score": round(average, 1) if average is not None else None,
+        "recent_average": (
+            round(recent_average, 1) if recent_average is not None else None
+        ),
+        "trend": trend,
+        "recent_scores": [
+            {
+                "subject": subject,
+                "topic": topic,
+                "score": round(score, 1),
+                "date": completed_at.date().isoformat() if completed_at else None,
+            }
+            for subject, topic, score, completed_at in recent
+        ],
+        "weak_topics": topics(
+            TopicMastery.mastery, WEAK_TOPICS, TopicMastery.mastery < MASTERY_TARGET
+        ),
+        "strong_topics": topics(
+            TopicMastery.mastery.desc(),
+            STRONG_TOPICS,
+            TopicMastery.mastery >= MASTERY_TARGET,
+        ),
+    }
+
+
+def flashcard_digest(db: Session, user_id: int) -> Dict:
+    total, mastered, due = db.execute(
+        select(
+            func.count(),
+            func.sum(case((Flashcard.mastery_level >= MASTERED_THRESHOLD, 1), else_=0)),
+            func.sum(case((due_flashcards_clause(datetime.utcnow()), 1), else_=0)),
+        ).where(Flashcard.user_id == user_id)
+    ).one()
+    recall = func.avg(func.coalesce(Flashcard.mastery_level, 0.0))
+    weakest = db.execute(
+        select(Flashcard.subject, Flashcard.topic, recall)
+        .where(Flashcard.user_id == user_id)
+        .group_by(Flashcard.subject, Flashcard.topic)
+        .order_by(recall)
+        .limit(WEAK_DECKS)
+    ).all()
+    return {
+        "total": total,
+        "mastered": mastered or 0,
+        "due": due or 0,
+        "weakest_decks": [
+            {"subject": subject, "topic": topic, "recall": round(level, 2)}
+            for subject, topic, level in weakest
+        ],
+    }
+
+
+def study_plan_digest(db: Session, user_id: int) -> Dict:
+    active = (
+        db.query(StudyPlan)
+        .filter(StudyPlan.user_id == user_id, StudyPlan.status == "Active")
+        .order_by(StudyPlan.created_at.desc())
+    )
+    latest = active.first()
+    today = date.today().isoformat()
+    upcoming = [
+        milestone
+        for milestone in (latest.milestones or [] if latest else [])
+        if isinstance(milestone, dict) and milestone.get("date", "") >= today
+    ]
+    return {
+        "active": active.count(),
+        "upcoming_milestones": upcoming[:UPCOMING_MILESTONES],
+    }
+
+
+def learner_digest(db: Session, user: User) -> Dict:
+    return {
+        "profile": profile_digest(user),
+        "progress": progress_digest(db, user.id),
+        "flashcards": flashcard_digest(db, user.id),
+        "study_plans": study_plan_digest(db, user.id),
+    }
+
+
+def _topic(entry: Dict) -> str:
+    return f"{entry['subject']}/{entry['topic']}"
+
+
+def format_digest(digest: Dict) -> str:
+    """Render a digest as the fixed-format text block used in prompts."""
+    profile = digest["profile"]
+    progress = digest["progress"]
+    cards = digest["flashcards"]
+    plans = digest["study_plans"]
+
+    subjects = ", ".join(f"{s} ({level})" for s, level in profile["subjects"])
+    if profile["more_subjects"]:
+        subjects += f" and {profile['more_subjects']} more"
+    activity = f"{progress['sessions']} scored sessions"
+    if progress["average_score"] is not None:
+        activity += f", average {progress['average_score']}%"
+    if progress["recent_average"] is not None:
+        activity += f"; last {TREND_DAYS} days {progress['recent_average']}%"
+    if progress["trend"]:
+        trend = progress["trend"]
+        activity += f" ({trend['change']:+} points, {trend['direction']})"
+
+    lines = [
+        f"Subjects: {subjects or 'none'}",
+        f"Goals: {profile['learning_goals'] or 'none'}",
+        f"Study preferences: {profile['study_preferences'] or 'none'}",
+        f"Activity: {activity}",
+        "Recent scores: "
+        + (
+            "; ".join(
+                f"{s['date']} {_topic(s)} {s['score']}%"
+                for s in progress["recent_scores"]
+            )
+            or "none"
+        ),
+        "Weak topics: "
+        + (
+            "; ".join(
+                f"{_topic(t)} {t['mastery']:.0%} mastery over {t['attempts']} attempts"
+                for t in progress["weak_topics"]
+            )
+            or "none"
+        ),
+        "Strong topics: "
+        + (
+            "; ".join(
+                f"{_topic(t)} {t['mastery']:.0%}" for t in progress["strong_topics"]
+            )
+            or "none"
+        ),
+        f"Flashcards: {cards['total']} cards, {cards['due']} due, "
+        f"{cards['mastered']} mastered; weakest decks: "
+        + (
+            "; ".join(
+                f"{_topic(d)} {d['recall']:.0%} recall" for d in cards["weakest_decks"]
+            )
+            or "none"
+        ),
+        f"Study plans: {plans['active']} active; next milestones: "
+        + (
+            "; ".join(
+                f"{_topic(m)} by {m['date']}" for m in plans["upcoming_milestones"]
+            )
+            or "none"
+        ),
+    ]
+    return "\n        ".join(lines)
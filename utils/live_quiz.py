@@ -0,0 +1,361 @@
+"""Live classroom quizzes over WebSockets.
+
+A teacher opens a session on a set of bank questions and students join it
+over a WebSocket. The server pushes each question when the teacher moves
+on, grades answers against the answer key as they arrive and pushes a
+leaderboard to teacher sockets, at most every ``LEADERBOARD_INTERVAL``
+seconds however fast answers come in. Nothing is written while a session
+runs: when it ends, every student's results go to the ``persist`` callback
+in one batch.
+
+Per student the session keeps one byte per question and a few numbers, and
+each question is encoded once and sent to every socket as is. Sessions
+live in the worker process that created them, so with several workers a
+session's sockets must all reach the same worker (e.g. route on the code).
+
+Messages are JSON objects:
+
+- server to student: ``question`` (without its answer), ``answered``, and
+  ``ended`` with the score and answer key;
+- student to server: ``{"index": n, "answer": "..."}`` for question ``n``;
+- server to teacher: ``leaderboard``;
+- teacher to server: ``{"action": "next"}`` or ``{"action": "end"}``.
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from models.database import Question
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from utils.question_bank import grade_answer, public_question
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_INTERVAL = 0.5
+# A socket that cannot take a message within this long misses it
+SEND_TIMEOUT = 5.0
+MAX_ANSWER_CHARS = 1000
+# Sessions still open after this long are ended
+SESSION_TTL_SECONDS = 4 * 3600
+MAX_SESSIONS = 100
+
+# A participant's state for each question
+UNSEEN, SEEN, WRONG, RIGHT = range(4)
+
+
+class TooManySessions(Exception):
+    pass
+
+
+class Participant:
+    __slots__ = ("user_id", "name", "socket", "states", "response_seconds", "joined")
+
+    def __init__(self, user_id: int, name: str, total: int):
+        self.user_id = user_id
+        self.name = name
+        self.socket: Optional[WebSocket] = None
+        self.states = bytearray(total)
+        # Summed time to answer, which breaks ties on the leaderboard
+        self.response_seconds = 0.0
+        self.joined = time.monotonic()
+
+    @property
+    def correct(self) -> int:
+        return self.states.count(RIGHT)
+
+    @property
+    def answered(self) -> int:
+        return self.states.count(RIGHT) + self.states.count(WRONG)
+
+
+async def _send(socket: WebSocket, message: str) -> bool:
+    try:
+        await asyncio.wait_for(socket.send_text(message), SEND_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+
+async def broadcast(sockets: Iterable[WebSocket], message: str) -> int:
+    """Send an encoded message to every socket; returns how many got it."""
+    sent = await asyncio.gather(*(_send(socket, message) for socket in sockets))
+    return sum(sent)
+
+
+class LiveQuiz:
+    def __init__(
+        self,
+        code: str,
+        questions: List[Question],
+        shard: int,
+        persist: Callable[["LiveQuiz"], None],
+        names: Optional[Tuple[str, str]] = None,
+    ):
+        self.code = code
+        self.questions = questions
+        self.shard = shard  # Shard whose question bank the questions are from
+        self.names = names  # Subject and topic as the teacher typed them
+        self.current = -1
+        self.asked_at = 0.0
+        self.created = time.monotonic()
+        self.ended_at: Optional[float] = None
+        self.participants: Dict[int, Participant] = {}
+        self.teachers: Set[WebSocket] = set()
+        self._persist = persist
+        self._messages = [
+            json.dumps(
+                {
+                    "type": "question",
+                    "index": index,
+                    "total": len(questions),
+                    "question": public_question(question),
+                }
+            )
+            for index, question in enumerate(questions)
+        ]
+        self._changed = asyncio.Event()
+        self._publisher: Optional[asyncio.Task] = None
+
+    @property
+    def ended(self) -> bool:
+        return self.ended_at is not None
+
+    def connected(self) -> List[Participant]:
+        return [p for p in self.participants.values() if p.socket is not None]
+
+    async def join(self, user_id: int, name: str, socket: WebSocket) -> Participant:
+        """Add a student, or reattach one who reconnected, and send the question."""
+        participant = self.participants.get(user_id)
+        if participant is None:
+            participant = Participant(user_id, name, len(self.questions))
+            self.participants[user_id] = participant
+        elif participant.socket is not None:
+            await participant.socket.close(code=4409, reason="Joined elsewhere")
+        participant.socket = socket
+        if self.current >= 0:
+            if participant.states[self.current] == UNSEEN:
+                participant.states[self.current] = SEEN
+            await _send(socket, self._messages[self.current])
+        self._changed.set()
+        return participant
+
+    def leave(self, participant: Participant, socket: WebSocket):
+        if participant.socket is socket:
+            participant.socket = None
+            self._changed.set()
+
+    def answer(self, participant: Participant, index: int, answer) -> Optional[bool]:
+        """Grade an answer to the current question; None if it is not accepted."""
+        if self.ended or not 0 <= index == self.current < len(self.questions):
+            return None
+        if participant.states[index] != SEEN:
+            return None
+        correct = grade_answer(
+            self.questions[index],
+            str(answer)[:MAX_ANSWER_CHARS] if answer is not None else None,
+        )
+        participant.states[index] = RIGHT if correct else WRONG
+        participant.response_seconds += time.monotonic() - max(
+            self.asked_at, participant.joined
+        )
+        self._changed.set()
+        return correct
+
+    async def advance(self):
+        """Push the next question, or end the session after the last one."""
+        if self.current + 1 >= len(self.questions):
+            await self.end()
+            return
+        self.current += 1
+        self.asked_at = time.monotonic()
+        students = self.connected()
+        for participant in students:
+            participant.states[self.current] = SEEN
+        await broadcast((p.socket for p in students), self._messages[self.current])
+        self._changed.set()
+
+    def leaderboard(self) -> Dict:
+        ranked = sorted(
+            self.participants.values(),
+            key=lambda p: (-p.correct, p.response_seconds),
+        )
+        current = self.current
+        return {
+            "type": "leaderboard",
+            "code": self.code,
+            "question": current,
+            "total": len(self.questions),
+            "connected": len(self.connected()),
+            "answered": (
+                sum(p.states[current] >= WRONG for p in ranked) if current >= 0 else 0
+            ),
+            "ended": self.ended,
+            "entries": [
+                {
+                    "rank": rank,
+                    "user_id": p.user_id,
+                    "name": p.name,
+                    "correct": p.correct,
+                    "answered": p.answered,
+                    "connected": p.socket is not None,
+                }
+                for rank, p in enumerate(ranked, 1)
+            ],
+        }
+
+    def watch(self, socket: WebSocket):
+        """Add a teacher socket to the leaderboard's recipients."""
+        self.teachers.add(socket)
+        if self._publisher is None:
+            self._publisher = asyncio.create_task(self._publish())
+        self._changed.set()
+
+    async def _publish(self):
+        # One leaderboard per interval, however many answers arrive
+        while not self.ended:
+            await self._changed.wait()
+            self._changed.clear()
+            await broadcast(list(self.teachers), json.dumps(self.leaderboard()))
+            await asyncio.sleep(LEADERBOARD_INTERVAL)
+
+    def results(self, participant: Participant) -> List[Dict]:
+        """Outcomes of the questions a student was shown; unanswered ones count as wrong."""
+        return [
+            {
+                "question_id": question.id,
+                "subject": question.subject,
+                "topic": question.topic,
+                "difficulty": question.difficulty,
+                "correct": state == RIGHT,
+            }
+            for question, state in zip(self.questions, participant.states)
+            if state != UNSEEN
+        ]
+
+    def time_spent(self, participant: Participant) -> int:
+        return int((self.ended_at or time.monotonic()) - participant.joined)
+
+    async def end(self):
+        """Persist every result in one batch, send final scores and close."""
+        if self.ended:
+            return
+        self.ended_at = time.monotonic()
+        sessions.pop(self.code, None)
+        if self._publisher is not None:
+            self._publisher.cancel()
+        saved = True
+        try:
+            await asyncio.to_thread(self._persist, self)
+        except Exception:
+            logger.exception("Failed to save live quiz %s", self.code)
+            saved = False
+
+        key = [
+            {
+                "id": question.id,
+                "correct_answer": question.correct_answer,
+                "explanation": question.explanation,
+            }
+            for question in self.questions
+        ]
+        students = self.connected()
+        await asyncio.gather(
+            *(
+                _send(
+                    p.socket,
+                    json.dumps(
+                        {
+                            "type": "ended",
+                            "correct": p.correct,
+                            "total": len(self.questions),
+                            "saved": saved,
+                            "answers": key,
+                        }
+                    ),
+                )
+                for p in students
+            )
+        )
+        await broadcast(list(self.teachers), json.dumps(self.leaderboard()))
+        for socket in [p.socket for p in students] + list(self.teachers):
+            try:
+                await socket.close()
+            except Exception:
+                pass
+
+
+sessions: Dict[str, LiveQuiz] = {}
+
+
+async def create_session(
+    questions: List[Question],
+    shard: int,
+    persist: Callable[[LiveQuiz], None],
+    names: Optional[Tuple[str, str]] = None,
+) -> LiveQuiz:
+    """Open a session; its join code is ``quiz.code``."""
+    now = time.monotonic()
+    for quiz in list(sessions.values()):
+        if now - quiz.created > SESSION_TTL_SECONDS:
+            await quiz.end()
+    if len(sessions) >= MAX_SESSIONS:
+        raise TooManySessions("Too many live quizzes are running; end one first")
+    code = secrets.token_hex(3).upper()
+    while code in sessions:
+        code = secrets.token_hex(3).upper()
+    quiz = sessions[code] = LiveQuiz(code, questions, shard, persist, names)
+    return quiz
+
+
+async def serve_student(quiz: LiveQuiz, socket: WebSocket, user_id: int, name: str):
+    participant = await quiz.join(user_id, name, socket)
+    try:
+        async for text in socket.iter_text():
+            try:
+                message = json.loads(text)
+                index = int(message["index"])
+                answer = message.get("answer")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                await socket.send_json(
+                    {"type": "error", "detail": 'Expected {"index": n, "answer": ...}'}
+                )
+                continue
+            correct = quiz.answer(participant, index, answer)
+            await socket.send_json(
+                {
+                    "type": "answered",
+                    "index": index,
+                    "accepted": correct is not None,
+                    "correct": correct,
+                }
+            )
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # Closed by the client, or by the end of the session
+    finally:
+        quiz.leave(participant, socket)
+
+
+async def serve_teacher(quiz: LiveQuiz, socket: WebSocket):
+    quiz.watch(socket)
+    try:
+        async for text in socket.iter_text():
+            try:
+                action = json.loads(text).get("action")
+            except (ValueError, AttributeError):
+                action = None
+            if action == "next":
+                await quiz.advance()
+            elif action == "end":
+                await quiz.end()
+            else:
+                await socket.send_json(
+                    {"type": "error", "detail": 'Expected {"action": "next" or "end"}'}
+                )
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        quiz.teachers.discard(socket)
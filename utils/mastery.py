@@ -0,0 +1,268 @@
+"""Bayesian Knowledge Tracing over progress history.
+
+Every scored ``Progress`` row is evidence about whether a user knows a
+topic. Scores are percentages and are used as soft evidence: a 70% score
+counts as 0.7 of a correct answer. The per-topic estimate lives in
+``topic_mastery``, is updated in O(1) by ``update_mastery`` as each new row
+arrives and can be rebuilt from scratch with ``refit_mastery``, starting
+from ``mastery_baseline`` for topics with archived history:
+
+    python -m utils.mastery
+
+The refit sorts all events once and then advances every (user, topic)
+sequence one step at a time with NumPy. Sequences are ordered longest
+first, so the sequences still active at step k are always a prefix of the
+state vector and every step is a single slice operation.
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.database import MasteryBaseline, Progress, SessionLocal, TopicMastery
+from sqlalchemy import delete, insert, text
+from sqlalchemy.orm import Session
+from utils.question_bank import normalize_key
+
+# BKT parameters: prior knowledge, learning per practice, guess and slip
+P_INIT = 0.3
+P_LEARN = 0.15
+P_GUESS = 0.2
+P_SLIP = 0.1
+
+MASTERY_TARGET = 0.8
+# Suggest refreshing mastered topics not practiced for this long
+REVIEW_AFTER_DAYS = 14
+INSERT_BATCH_SIZE = 10000
+
+
+def bkt_step(mastery, evidence):
+    """Posterior after observing ``evidence`` (0-1), then the learning transition.
+
+    Works element-wise on floats or NumPy arrays.
+    """
+    known_correct = mastery * (1 - P_SLIP)
+    correct = known_correct / (known_correct + (1 - mastery) * P_GUESS)
+    known_wrong = mastery * P_SLIP
+    wrong = known_wrong / (known_wrong + (1 - mastery) * (1 - P_GUESS))
+    posterior = evidence * correct + (1 - evidence) * wrong
+    return posterior + (1 - posterior) * P_LEARN
+
+
+def score_evidence(score):
+    return np.clip(np.asarray(score, dtype=np.float64) / 100.0, 0.0, 1.0)
+
+
+def trace(
+    groups: np.ndarray,
+    evidence: np.ndarray,
+    n_groups: int,
+    initial: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Final mastery per group for events sorted by (group, time).
+
+    Groups start from ``initial`` when given, otherwise from ``P_INIT``.
+    """
+    lengths = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    position = np.arange(len(groups)) - starts[groups]
+
+    # Slot 0 holds the longest sequence, so groups active at step k are
+    # slots [0, active[k]) and their events are contiguous after sorting
+    by_length = np.argsort(-lengths, kind="stable")
+    slot = np.empty(n_groups, dtype=np.int64)
+    slot[by_length] = np.arange(n_groups)
+    order = np.lexsort((slot[groups], position))
+    step_evidence = evidence[order]
+    active = np.bincount(position, minlength=int(lengths.max(initial=0)))
+
+    state = np.full(n_groups, P_INIT) if initial is None else initial[by_length]
+    offset = 0
+    for count in active:
+        state[:count] = bkt_step(state[:count], step_evidence[offset : offset + count])
+        offset += count
+    return state[slot]
+
+
+def _load_events(
+    db: Session,
+) -> Tuple[List[Tuple[int, str, str]], Dict[str, np.ndarray]]:
+    """Numeric event columns plus the raw (user, subject, topic) key per group."""
+    keys = db.execute(
+        text(
+            "SELECT user_id, subject, topic FROM progress "
+            "WHERE score IS NOT NULL AND user_id IS NOT NULL "
+            "GROUP BY user_id, subject, topic ORDER BY user_id, subject, topic"
+        )
+    ).all()
+    result = db.execute(
+        text(
+            "SELECT DENSE_RANK() OVER (ORDER BY user_id, subject, topic) - 1, "
+            "julianday(completed_at), score FROM progress "
+            "WHERE score IS NOT NULL AND user_id IS NOT NULL"
+        )
+    )
+    chunks = []
+    while True:
+        rows = result.fetchmany(100000)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+    events = np.concatenate(chunks) if chunks else np.empty((0, 3))
+    return keys, {
+        "group": events[:, 0].astype(np.int64),
+        "time": np.nan_to_num(events[:, 1]),
+        "score": events[:, 2],
+    }
+
+
+def refit_mastery(db: Session) -> Dict:
+    """Rebuild ``topic_mastery`` from the whole progress history."""
+    started = time.perf_counter()
+    raw_keys, events = _load_events(db)
+
+    baselines = {
+        (row.user_id, row.subject, row.topic): row for row in db.query(MasteryBaseline)
+    }
+
+    # Merge raw keys that differ only in case or spacing
+    normalized: Dict[Tuple[int, str, str], int] = {}
+    raw_to_group = np.empty(len(raw_keys), dtype=np.int64)
+    for i, (user_id, subject, topic) in enumerate(raw_keys):
+        key = (user_id, normalize_key(subject), normalize_key(topic))
+        raw_to_group[i] = normalized.setdefault(key, len(normalized))
+    groups = raw_to_group[events["group"]]
+    # Topics with only archived history keep their baseline
+    for key in baselines:
+        normalized.setdefault(key, len(normalized))
+
+    order = np.lexsort((events["time"], groups))
+    groups = groups[order]
+    evidence = score_evidence(events["score"][order])
+    times = events["time"][order]
+    n_groups = len(normalized)
+    initial = np.full(n_groups, P_INIT)
+    for key, baseline in baselines.items():
+        initial[normalized[key]] = baseline.mastery
+    mastery = trace(groups, evidence, n_groups, initial)
+
+    attempts = np.bincount(groups, minlength=n_groups)
+    last = np.cumsum(attempts) - 1
+    fitted = time.perf_counter() - started
+
+    db.execute(delete(TopicMastery))
+    rows = []
+    for key, g in normalized.items():
+        user_id, subject, topic = key
+        baseline = baselines.get(key)
+        row = {
+            "user_id": user_id,
+            "subject": subject,
+            "topic": topic,
+            "mastery": float(mastery[g]),
+            "attempts": int(attempts[g]) + (baseline.attempts if baseline else 0),
+        }
+        if attempts[g]:
+            i = last[g]
+            row["last_score"] = float(evidence[i])
+            row["last_practiced"] = _from_julian(times[i])
+        else:
+            row["last_score"] = baseline.last_score
+            row["last_practiced"] = baseline.last_practiced
+        rows.append(row)
+        if len(rows) >= INSERT_BATCH_SIZE:
+            db.execute(insert(TopicMastery), rows)
+            rows = []
+    if rows:
+        db.execute(insert(TopicMastery), rows)
+    db.commit()
+    return {
+        "events": len(groups),
+        "topics": n_groups,
+        "fit_seconds": round(fitted, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _from_julian(day: float) -> Optional[datetime]:
+    if not day:
+        return None
+    return datetime(1970, 1, 1) + timedelta(days=day - 2440587.5)
+
+
+def update_mastery(db: Session, progress: Progress) -> Optional[TopicMastery]:
+    """Fold one new progress row into the user's estimate; the caller commits."""
+    if progress.score is None or progress.user_id is None:
+        return None
+    key = (
+        progress.user_id,
+        normalize_key(progress.subject),
+        normalize_key(progress.topic),
+    )
+    row = db.get(TopicMastery, key)
+    if row is None:
+        row = TopicMastery(
+            user_id=key[0], subject=key[1], topic=key[2], mastery=P_INIT, attempts=0
+        )
+        db.add(row)
+    evidence = float(score_evidence(progress.score))
+    row.mastery = float(bkt_step(row.mastery, evidence))
+    row.attempts += 1
+    row.last_score = evidence
+    row.last_practiced = progress.completed_at or datetime.utcnow()
+    return row
+
+
+def serialize_mastery(row: TopicMastery) -> Dict:
+    return {
+        "subject": row.subject,
+        "topic": row.topic,
+        "mastery": round(row.mastery, 3),
+        "attempts": row.attempts,
+        "last_practiced": (
+            row.last_practiced.isoformat() if row.last_practiced else None
+        ),
+    }
+
+
+def recommend(db: Session, user_id: int, limit: int = 5) -> List[Dict]:
+    """Weakest topics first, then mastered topics that are due a refresh."""
+    rows = (
+        db.query(TopicMastery)
+        .filter(TopicMastery.user_id == user_id)
+        .order_by(TopicMastery.mastery)
+        .all()
+    )
+    review_before = datetime.utcnow() - timedelta(days=REVIEW_AFTER_DAYS)
+    recommendations = [
+        {
+            **serialize_mastery(row),
+            "action": "practice",
+            "reason": f"Estimated mastery is {row.mastery:.0%}, "
+            f"below the {MASTERY_TARGET:.0%} target",
+        }
+        for row in rows
+        if row.mastery < MASTERY_TARGET
+    ]
+    recommendations += [
+        {
+            **serialize_mastery(row),
+            "action": "review",
+            "reason": f"Mastered, but not practiced in over {REVIEW_AFTER_DAYS} days",
+        }
+        for row in sorted(rows, key=lambda r: r.last_practiced or datetime.min)
+        if row.mastery >= MASTERY_TARGET
+        and (row.last_practiced is None or row.last_practiced < review_before)
+    ]
+    return recommendations[:limit]
+
+
+if __name__ == "__main__":
+    with SessionLocal() as db:
+        report = refit_mastery(db)
+    print(
+        f"Refit {report['topics']} topics from {report['events']} events: "
+        f"{report['fit_seconds']}s to fit, {report['total_seconds']}s in total"
+    )
@@ -1,20 +1,330 @@
+import asyncio
+import hashlib
 import json
-from typing import Dict, List, Optional
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 
 import httpx
+import numpy as np
+
+from utils.timing import record_ollama_durations, timed
+from utils.tokens import estimate_tokens, truncate_to_tokens
+from utils.usage import recorder as usage_recorder
+from utils.vector_index import VectorIndex
+
+EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", "cache")
+# Cosine similarity above which a past generation is served for a new request
+CACHE_SIMILARITY_THRESHOLD = float(os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.92"))
+# Cosine similarity above which a flashcard counts as a near-duplicate
+DUPLICATE_CARD_THRESHOLD = float(os.getenv("DUPLICATE_CARD_THRESHOLD", "0.9"))
+# Looser similarity accepted from the cache while the backend is overloaded
+STALE_SIMILARITY_THRESHOLD = float(os.getenv("STALE_SIMILARITY_THRESHOLD", "0.8"))
+# Serve stale content instead of queueing when the estimated wait exceeds this
+QUEUE_WAIT_BUDGET = float(os.getenv("QUEUE_WAIT_BUDGET_SECONDS", "20"))
+# Generations the Ollama server runs concurrently (its OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))
+# Assumed generation time for a model until one has been measured
+DEFAULT_GENERATION_SECONDS = 20.0
+LATENCY_SMOOTHING = 0.2
+# Lesson contexts kept for follow-up generations on the same topic
+TOPIC_SESSION_LIMIT = int(os.getenv("TOPIC_SESSION_LIMIT", "512"))
+TOPIC_SESSION_TTL = float(os.getenv("TOPIC_SESSION_TTL_SECONDS", "3600"))
+
+# Shared opening of every prompt. Keeping it byte-identical, with the fixed
+# instructions next and request-specific values last, lets the model server
+# reuse its cached prompt prefix between requests.
+PROMPT_PREFIX = """You are an expert AI tutor. Write clear, accurate and well-structured material pitched at the student's level.
+        """
+
+# Upper bound on each method's prompt, in estimated tokens. The open-ended
+# parts of a prompt (reference excerpts, paper text, learner digest, plan
+# topics) are trimmed to fit, so prompt-eval time stays flat.
+PROMPT_BUDGETS = {
+    "lesson": 2000,
+    "quiz": 2000,
+    "question_batch": 600,
+    "interactive_element": 500,
+    "flashcards": 500,
+    "study_plan": 1200,
+    "paper_analysis": 6000,
+}
+# Cap on user-supplied lesson preferences within the lesson budget
+PREFERENCES_TOKENS = 150
+# Part of the study-plan budget kept for the topic list
+STUDY_PLAN_TOPIC_TOKENS = 400
+
+SessionKey = Tuple[int, str, str, str]  # (user_id, subject, topic, model)
+
+
+class TopicSessions:
+    """Bounded LRU of Ollama ``context`` arrays from users' latest lessons.
+
+    A follow-up generation on the same topic and model passes the stored
+    context back, so Ollama skips re-evaluating the lesson prompt and text
+    and only evaluates the new instructions.
+    """
+
+    def __init__(
+        self, limit: int = TOPIC_SESSION_LIMIT, ttl: float = TOPIC_SESSION_TTL
+    ):
+        self.limit = limit
+        self.ttl = ttl
+        self._entries: "OrderedDict[SessionKey, Tuple[float, List[int]]]" = (
+            OrderedDict()
+        )
+
+    @staticmethod
+    def key(user_id: int, subject: str, topic: str, model: str) -> SessionKey:
+        return (
+            user_id,
+            " ".join(subject.lower().split()),
+            " ".join(topic.lower().split()),
+            model,
+        )
+
+    def get(self, key: SessionKey) -> Optional[List[int]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, context = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return context
+
+    def put(self, key: SessionKey, context: List[int]):
+        self._entries[key] = (time.monotonic(), context)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.limit:
+            self._entries.popitem(last=False)
 
 
 class OllamaClient:
-    def __init__(self, base_url: str = "http://localhost:11434"):
+    def __init__(
+        self,
+        base_url: str = "http://localhost:11434",
+        cache_dir: Optional[str] = CACHE_DIR,
+    ):
         self.base_url = base_url
         self.client = httpx.AsyncClient()
+        # Running totals for throughput reporting
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "prompt_eval_count": 0,
+            "eval_count": 0,
+            "prompts_trimmed": 0,
+        }
+        # Load tracking for degraded serving: generations waiting on or
+        # running in this client and smoothed generation time, per model
+        self.in_flight: Dict[str, int] = {}
+        self.generation_seconds: Dict[str, float] = {}
+        self.sessions = TopicSessions()
+        self.generation_index = None
+        self.flashcard_index = None
+        if cache_dir:
+            self.generation_index = VectorIndex(os.path.join(cache_dir, "generations"))
+            self.flashcard_index = VectorIndex(os.path.join(cache_dir, "flashcards"))
+
+    def estimated_wait(self, model: str) -> float:
+        """Seconds a new ``model`` generation would likely wait for the backend.
+
+        Only this process's requests are visible, so with several workers this
+        underestimates the shared queue.
+        """
+        per_generation = self.generation_seconds.get(model, DEFAULT_GENERATION_SECONDS)
+        in_flight = self.in_flight.get(model, 0)
+        return in_flight / OLLAMA_NUM_PARALLEL * per_generation
+
+    def is_overloaded(self, model: str) -> bool:
+        return self.estimated_wait(model) > QUEUE_WAIT_BUDGET
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text with the local embedding model, or None if unavailable."""
+        try:
+            with timed("embed"):
+                response = await self.client.post(
+                    f"{self.base_url}/api/embeddings",
+                    json={"model": EMBEDDING_MODEL, "prompt": text},
+                )
+            response.raise_for_status()
+            return np.asarray(response.json()["embedding"], dtype=np.float32)
+        except (httpx.HTTPError, KeyError, ValueError):
+            return None
+
+    async def _generate(
+        self,
+        model: str,
+        prompt: str,
+        cache_key: Optional[Tuple[str, str]] = None,
+        session_key: Optional[SessionKey] = None,
+        **options,
+    ) -> Dict:
+        """Run a generation, serving semantically similar past requests from cache.
+
+        ``cache_key`` is a ``(namespace, text)`` pair: the namespace must match
+        exactly (method, model and options), while the text is compared by
+        embedding similarity so paraphrased topics share one generation.
+        The returned Ollama ``context`` is kept under ``session_key`` for
+        follow-up generations and dropped from the result otherwise. Follow-ups
+        passing a ``context`` continue one user's lesson, so they bypass the
+        shared cache in both directions.
+        """
+        embedding = None
+        if options.get("context"):
+            cache_key = None
+        if cache_key and self.generation_index is not None:
+            namespace, key_text = cache_key
+            threshold = CACHE_SIMILARITY_THRESHOLD
+            if self.is_overloaded(model):
+                threshold = min(threshold, STALE_SIMILARITY_THRESHOLD)
+            embedding = await self.embed(key_text)
+            if embedding is not None:
+                for similarity, payload in self.generation_index.search(
+                    namespace, embedding
+                ):
+                    if similarity >= threshold:
+                        self.stats["cache_hits"] += 1
+                        usage_recorder.record(model, None, cached=True)
+                        return {
+                            **payload,
+                            "cached": True,
+                            "similarity": similarity,
+                            "stale": similarity < CACHE_SIMILARITY_THRESHOLD,
+                        }
+
+        self.in_flight[model] = self.in_flight.get(model, 0) + 1
+        started = time.perf_counter()
+        try:
+            with timed("llm"):
+                response = await self.client.post(
+                    f"{self.base_url}/api/generate",
+                    json={"model": model, "prompt": prompt, "stream": False, **options},
+                )
+        finally:
+            self.in_flight[model] -= 1
+        result = response.json()
+        # Ollama's own duration excludes time spent queued behind other requests
+        service = result.get("total_duration", 0) / 1e9 or (
+            time.perf_counter() - started
+        )
+        previous = self.generation_seconds.get(model)
+        self.generation_seconds[model] = (
+            service
+            if previous is None
+            else previous + LATENCY_SMOOTHING * (service - previous)
+        )
+        record_ollama_durations(result)
+        self.stats["requests"] += 1
+        self.stats["prompt_eval_count"] += result.get("prompt_eval_count", 0)
+        self.stats["eval_count"] += result.get("eval_count", 0)
+        usage_recorder.record(model, result)
+        context = result.pop("context", None)
+        if session_key is not None and context:
+            self.sessions.put(session_key, context)
+
+        if embedding is not None and "response" in result:
+            try:
+                self.generation_index.add(
+                    cache_key[0],
+                    embedding,
+                    {
+                        "model": model,
+                        "key": cache_key[1],
+                        "response": result["response"],
+                        "created_at": datetime.utcnow().isoformat(),
+                    },
+                )
+            except ValueError:
+                pass  # Embedding model changed dimension; skip caching
+        return result
+
+    @staticmethod
+    def _cache_key(method: str, model: str, subject: str, topic: str, **options):
+        namespace = json.dumps(
+            [method, model, subject.strip().lower(), options], sort_keys=True
+        )
+        return namespace, f"{subject}: {topic}"
+
+    def _fit(self, method: str, prompt: str, *tail: str) -> int:
+        """Tokens left for open-ended text in ``method``'s budget."""
+        used = estimate_tokens(prompt) + sum(estimate_tokens(t) for t in tail)
+        return max(0, PROMPT_BUDGETS[method] - used)
+
+    def _within_budget(self, method: str, prompt: str) -> str:
+        """Last-resort cut for prompts still over budget, e.g. a huge topic.
+
+        Request values come last in every prompt, so the instructions survive.
+        """
+        return self._trim(prompt, PROMPT_BUDGETS[method])
+
+    def _trim(self, text: str, max_tokens: int) -> str:
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        self.stats["prompts_trimmed"] += 1
+        return truncate_to_tokens(text, max_tokens)
+
+    def _references_section(
+        self, reference_material: Optional[List[str]], max_tokens: int
+    ) -> str:
+        if not reference_material:
+            return ""
+        header = """
+        Align with the style and coverage of these excerpts from the student's past papers:
+        ---
+        """
+        room = max_tokens - estimate_tokens(header) - 2
+        if room <= 0:
+            return ""
+        excerpts = self._trim("\n---\n".join(reference_material), room)
+        return f"""{header}{excerpts}
+        ---"""
+
+    @staticmethod
+    def _references_digest(reference_material: Optional[List[str]]) -> Optional[str]:
+        if not reference_material:
+            return None
+        return hashlib.sha1("\0".join(reference_material).encode()).hexdigest()
+
+    def _follow_up(
+        self, user_id: Optional[int], subject: str, topic: str, model: str
+    ) -> Tuple[str, Dict]:
+        """Prompt note and options continuing the user's lesson on this topic."""
+        if user_id is None:
+            return "", {}
+        context = self.sessions.get(TopicSessions.key(user_id, subject, topic, model))
+        if not context:
+            return "", {}
+        return (
+            "\n        Build on the lesson above and stay consistent with it.",
+            {"context": context},
+        )
 
     async def generate_lesson(
-        self, subject: str, topic: str, level: str, preferences: Optional[Dict] = None
+        self,
+        subject: str,
+        topic: str,
+        level: str,
+        preferences: Optional[Dict] = None,
+        reference_material: Optional[List[str]] = None,
+        user_id: Optional[int] = None,
     ) -> Dict:
-        """Generate a personalized lesson based on user preferences and learning style."""
-        prompt = f"""Generate a comprehensive lesson on {topic} for {subject} at {level} level.
-        Consider the following preferences: {json.dumps(preferences) if preferences else 'None'}
+        """Generate a personalized lesson based on user preferences and learning style.
+
+        With ``user_id``, the lesson starts a topic session that later quiz,
+        flashcard and interactive generations on the same model continue.
+        """
+        preferences_text = (
+            truncate_to_tokens(json.dumps(preferences), PREFERENCES_TOKENS)
+            if preferences
+            else "None"
+        )
+        prompt = f"""{PROMPT_PREFIX}Task: write a comprehensive lesson.
         Include:
         1. Introduction and learning objectives
         2. Key concepts with examples
@@ -23,32 +333,69 @@ class OllamaClient:
         5. Summary and key takeaways
         6. Additional resources for further learning
         7. Real-world applications
-        8. Common misconceptions and how to avoid them"""
+        8. Common misconceptions and how to avoid them
+        Subject: {subject}
+        Topic: {topic}
+        Level: {level}
+        Preferences: {preferences_text}"""
+        prompt += self._references_section(
+            reference_material, self._fit("lesson", prompt)
+        )
+        prompt = self._within_budget("lesson", prompt)
 
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
+        return await self._generate(
+            "mixtral",
+            prompt,
+            self._cache_key(
+                "lesson",
+                "mixtral",
+                subject,
+                topic,
+                level=level.lower(),
+                preferences=preferences,
+                references=self._references_digest(reference_material),
+            ),
+            session_key=(
+                TopicSessions.key(user_id, subject, topic, "mixtral")
+                if user_id is not None
+                else None
+            ),
         )
-        return response.json()
 
     async def generate_interactive_element(
-        self, subject: str, topic: str, element_type: str
+        self,
+        subject: str,
+        topic: str,
+        element_type: str,
+        user_id: Optional[int] = None,
     ) -> Dict:
         """Generate interactive learning elements like simulations, exercises, or visualizations."""
-        prompt = f"""Generate an interactive {element_type} for {topic} in {subject}.
+        note, options = self._follow_up(user_id, subject, topic, "mixtral")
+        prompt = f"""{PROMPT_PREFIX}Task: create an interactive learning element.
         Include:
         1. Clear instructions
         2. Interactive components
         3. Expected outcomes
         4. Learning objectives
         5. Assessment criteria
-        6. Feedback mechanism"""
+        6. Feedback mechanism
+        Subject: {subject}
+        Topic: {topic}
+        Element type: {element_type}"""
+        prompt = self._within_budget("interactive_element", prompt) + note
 
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
+        return await self._generate(
+            "mixtral",
+            prompt,
+            self._cache_key(
+                "interactive_element",
+                "mixtral",
+                subject,
+                topic,
+                element_type=element_type,
+            ),
+            **options,
         )
-        return response.json()
 
     async def generate_quiz(
         self,
@@ -57,52 +404,97 @@ class OllamaClient:
         level: str,
         num_questions: int = 5,
         question_types: List[str] = ["multiple_choice"],
+        reference_material: Optional[List[str]] = None,
     ) -> Dict:
-        """Generate a quiz with various question types and difficulty levels."""
-        prompt = f"""Generate a {num_questions}-question quiz on {topic} for {subject} at {level} level.
-        Include the following question types: {', '.join(question_types)}
-        For each question:
-        1. Question text
-        2. Options (if applicable)
-        3. Correct answer
-        4. Detailed explanation
-        5. Difficulty level
-        6. Time estimate for answering
-        7. Hints (if applicable)
-        8. Common mistakes to watch out for"""
-
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "deepseek-r1", "prompt": prompt, "stream": False},
-        )
-        return response.json()
-
-    async def generate_study_plan(self, user_profile: Dict, goals: Dict) -> Dict:
-        """Generate a personalized study plan based on user profile and goals."""
-        prompt = f"""Create a personalized study plan based on:
-        User Profile: {json.dumps(user_profile)}
-        Learning Goals: {json.dumps(goals)}
-        Include:
-        1. Weekly schedule with time slots
-        2. Topic priorities and dependencies
-        3. Practice recommendations
-        4. Progress milestones
-        5. Resource recommendations
-        6. Revision strategy
-        7. Break and rest periods
-        8. Motivation techniques
-        9. Progress tracking methods"""
-
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
-        )
-        return response.json()
+        """Generate a quiz as JSON in the question bank's format, so it can be graded."""
+        prompt = f"""{PROMPT_PREFIX}Task: write a quiz.
+        Respond with JSON only, in this format:
+        {{"questions": [{{"question": "...", "type": "...", "options": ["..."], "correct_answer": "...", "explanation": "...", "difficulty": "Easy|Medium|Hard"}}]}}
+        Leave "options" empty for questions without answer choices, and make
+        "correct_answer" exactly match one of the options when there are some.
+        Explanations should point out common mistakes.
+        Subject: {subject}
+        Topic: {topic}
+        Level: {level}
+        Number of questions: {num_questions}
+        Question types: {', '.join(question_types)}"""
+        prompt += self._references_section(
+            reference_material, self._fit("quiz", prompt)
+        )
+        prompt = self._within_budget("quiz", prompt)
+
+        return await self._generate(
+            "deepseek-r1",
+            prompt,
+            self._cache_key(
+                "quiz",
+                "deepseek-r1",
+                subject,
+                topic,
+                level=level.lower(),
+                num_questions=num_questions,
+                question_types=sorted(question_types),
+                references=self._references_digest(reference_material),
+                format="json",
+            ),
+            format="json",
+        )
+
+    async def generate_question_batch(
+        self,
+        subject: str,
+        topic: str,
+        level: str,
+        count: int = 10,
+        question_types: List[str] = ["multiple_choice"],
+    ) -> Dict:
+        """Generate structured questions for the question bank as JSON."""
+        prompt = f"""{PROMPT_PREFIX}Task: write distinct quiz questions for a question bank.
+        Mix difficulties: about 30% Easy, 50% Medium and 20% Hard.
+        Respond with JSON only, in this format:
+        {{"questions": [{{"question": "...", "type": "...", "options": ["..."], "correct_answer": "...", "explanation": "...", "difficulty": "Easy|Medium|Hard"}}]}}
+        Leave "options" empty for questions without answer choices, and make
+        "correct_answer" exactly match one of the options when there are some.
+        Subject: {subject}
+        Topic: {topic}
+        Level: {level}
+        Number of questions: {count}
+        Question types: {', '.join(question_types)}"""
+        prompt = self._within_budget("question_batch", prompt)
+
+        return await self._generate("deepseek-r1", prompt, format="json")
+
+    async def generate_study_plan(
+        self, learner_digest: str, topics: List[Dict]
+    ) -> Dict:
+        """Write the narrative for an already scheduled study plan.
+
+        ``learner_digest`` is the bounded summary from ``utils.digest``.
+        """
+        prompt = f"""{PROMPT_PREFIX}Task: write a short, motivating overview of a study plan.
+        The schedule is fixed: do not add, drop or reorder topics.
+        Cover:
+        1. Why the topics come in this order
+        2. What to focus on in each topic
+        3. Practice and revision strategy
+        4. Motivation techniques
+        Learner: """
+        plan = "; ".join(
+            f"{t['subject']}/{t['topic']} ({t['sessions']} sessions)" for t in topics
+        )
+        # The digest is bounded already; the topic list takes what is left
+        prompt += self._trim(
+            learner_digest,
+            self._fit("study_plan", prompt) - STUDY_PLAN_TOPIC_TOKENS,
+        )
+        prompt += "\n        Topics in order: "
+        prompt += self._trim(plan, self._fit("study_plan", prompt))
+
+        return await self._generate("mixtral", prompt)
 
     async def analyze_question_paper(self, content: str, subject: str) -> Dict:
         """Analyze a question paper and provide insights."""
-        prompt = f"""Analyze this {subject} question paper:
-        {content}
+        prompt = f"""{PROMPT_PREFIX}Task: analyze a question paper.
         Provide:
         1. Topic distribution and weightage
         2. Difficulty levels and patterns
@@ -113,53 +505,91 @@ class OllamaClient:
         7. Time management tips
         8. Scoring strategy
         9. Important formulas/theorems to remember
-        10. Practice recommendations"""
-
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
-        )
-        return response.json()
+        10. Practice recommendations
+        Subject: {subject}
+        Paper:
+        """
+        prompt += self._trim(content, self._fit("paper_analysis", prompt))
 
-    async def get_learning_recommendations(self, progress_data: Dict) -> Dict:
-        """Generate personalized learning recommendations based on progress."""
-        prompt = f"""Analyze this learning progress data and provide recommendations:
-        {json.dumps(progress_data)}
-        Include:
-        1. Strengths and weaknesses
-        2. Suggested focus areas
-        3. Learning resources
-        4. Practice strategies
-        5. Time management tips
-        6. Motivation strategies
-        7. Study techniques
-        8. Revision schedule
-        9. Practice test recommendations
-        10. Mindset and attitude tips"""
-
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
-        )
-        return response.json()
+        return await self._generate("mixtral", prompt)
 
     async def generate_flashcards(
-        self, subject: str, topic: str, num_cards: int = 10
+        self,
+        subject: str,
+        topic: str,
+        num_cards: int = 10,
+        user_id: Optional[int] = None,
     ) -> Dict:
         """Generate flashcards for quick revision."""
-        prompt = f"""Generate {num_cards} flashcards for {topic} in {subject}.
+        note, options = self._follow_up(user_id, subject, topic, "mixtral")
+        prompt = f"""{PROMPT_PREFIX}Task: write flashcards for quick revision.
         For each flashcard:
         1. Front: Key concept or question
         2. Back: Detailed explanation or answer
         3. Category: Easy/Medium/Hard
         4. Related concepts
-        5. Memory aids or mnemonics"""
+        5. Memory aids or mnemonics
+        Subject: {subject}
+        Topic: {topic}
+        Number of flashcards: {num_cards}"""
+        prompt = self._within_budget("flashcards", prompt) + note
 
-        response = await self.client.post(
-            f"{self.base_url}/api/generate",
-            json={"model": "mixtral", "prompt": prompt, "stream": False},
+        return await self._generate(
+            "mixtral",
+            prompt,
+            self._cache_key(
+                "flashcards", "mixtral", subject, topic, num_cards=num_cards
+            ),
+            **options,
         )
-        return response.json()
+
+    async def filter_duplicate_flashcards(
+        self, user_id: int, subject: str, cards: List[Tuple[str, str]]
+    ) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """Drop cards that are near-duplicates of the user's deck or of each other.
+
+        Returns ``(index, embedding)`` for each kept card; pass the embeddings to
+        ``remember_flashcards`` once the cards are stored. Cards are all kept
+        when embeddings are unavailable.
+        """
+        if self.flashcard_index is None:
+            return [(i, None) for i in range(len(cards))]
+        namespace = f"{user_id}:{subject.strip().lower()}"
+        embeddings = await asyncio.gather(
+            *(self.embed(f"{front}\n{back}") for front, back in cards)
+        )
+        kept = []
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                kept.append((i, None))
+                continue
+            matches = self.flashcard_index.search(namespace, embedding)
+            if matches and matches[0][0] >= DUPLICATE_CARD_THRESHOLD:
+                continue
+            batch = [e for _, e in kept if e is not None and e.shape == embedding.shape]
+            if batch:
+                unit = embedding / (np.linalg.norm(embedding) or 1.0)
+                others = np.stack(batch)
+                others /= np.linalg.norm(others, axis=1, keepdims=True) + 1e-12
+                if (others @ unit).max() >= DUPLICATE_CARD_THRESHOLD:
+                    continue
+            kept.append((i, embedding))
+        return kept
+
+    def remember_flashcards(
+        self, user_id: int, subject: str, cards: List[Tuple[int, Optional[np.ndarray]]]
+    ):
+        """Add stored ``(flashcard_id, embedding)`` pairs to the duplicate index."""
+        if self.flashcard_index is None:
+            return
+        namespace = f"{user_id}:{subject.strip().lower()}"
+        for flashcard_id, embedding in cards:
+            if embedding is None:
+                continue
+            try:
+                self.flashcard_index.add(namespace, embedding, {"id": flashcard_id})
+            except ValueError:
+                pass
 
     async def close(self):
         await self.client.aclose()
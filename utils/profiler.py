@@ -0,0 +1,80 @@
+"""On-demand stack-sampling profiler for the running process.
+
+A background thread snapshots every thread's Python stack with
+``sys._current_frames()`` at a fixed interval for a bounded window and
+aggregates the samples into the collapsed-stack format read by
+flamegraph.pl, speedscope and similar tools. Nothing is hooked into request
+handling, so the profiler costs nothing while no profile is running.
+
+Samples can be restricted to one route: a sample is kept only when the
+route's endpoint function is on the sampled stack, which works for async
+endpoints (running on the event loop thread) as well as sync ones (running
+in the threadpool).
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Set
+
+MAX_DURATION_SECONDS = 60
+MIN_INTERVAL_SECONDS = 0.001
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def route_endpoint_codes(routes) -> Dict[str, Set]:
+    """Map each route path to the code objects of its endpoint functions."""
+    codes: Dict[str, Set] = {}
+    for route in routes:
+        endpoint = getattr(route, "endpoint", None)
+        if endpoint is None:
+            continue
+        endpoint = getattr(endpoint, "__wrapped__", endpoint)
+        code = getattr(endpoint, "__code__", None)
+        if code is not None:
+            codes.setdefault(route.path, set()).add(code)
+    return codes
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(
+    duration: float,
+    interval: float = 0.005,
+    only_codes: Optional[Set] = None,
+) -> str:
+    """Sample all threads for ``duration`` seconds; return collapsed stacks.
+
+    Raises ``ProfilerBusy`` if another profile is already running.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        duration = min(max(duration, 0.0), MAX_DURATION_SECONDS)
+        interval = max(interval, MIN_INTERVAL_SECONDS)
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                if only_codes is not None and not only_codes.intersection(codes):
+                    continue
+                stacks[";".join(_frame_label(c) for c in reversed(codes))] += 1
+            time.sleep(interval)
+    finally:
+        _running.release()
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,410 @@
+"""Pre-generated question bank and quiz assembly.
+
+Questions are generated in the background per (subject, topic, level) and
+stored individually; quizzes are assembled by sampling questions the user
+has not seen yet, mixed across difficulties. Live generation is only needed
+when a user has exhausted the bank for a topic, and its questions are added
+to the bank so they are graded the same way.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from models.database import (
+    ItemCalibration,
+    Progress,
+    Question,
+    QuestionExposure,
+    SessionLocal,
+    User,
+)
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+DIFFICULTY_MIX = {"Easy": 0.3, "Medium": 0.5, "Hard": 0.2}
+# Refill a topic when a user has fewer unseen questions than this
+LOW_WATER_MARK = int(os.getenv("QUESTION_BANK_LOW_WATER_MARK", "20"))
+REFILL_BATCH_SIZE = int(os.getenv("QUESTION_BANK_REFILL_BATCH", "10"))
+
+# Topics with a refill in flight in this process
+_refilling: Set[Tuple[str, str, str]] = set()
+
+
+def normalize_key(value: str) -> str:
+    return " ".join(value.lower().split())
+
+
+def bank_key(subject: str, topic: str, level: str) -> Tuple[str, str, str]:
+    return normalize_key(subject), normalize_key(topic), normalize_key(level)
+
+
+def parse_questions(text: str) -> List[Dict]:
+    """Extract well-formed questions from a JSON generation."""
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+    start, end = text.find("{"), text.rfind("}")
+    try:
+        data = json.loads(text[start : end + 1] if start >= 0 else text)
+    except json.JSONDecodeError:
+        return []
+    items = data.get("questions", []) if isinstance(data, dict) else data
+    questions = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        question = str(item.get("question") or "").strip()
+        answer = str(item.get("correct_answer") or "").strip()
+        if not question or not answer:
+            continue
+        options = [str(o) for o in item.get("options") or []]
+        if options and answer not in options:
+            continue
+        difficulty = str(item.get("difficulty") or "Medium").capitalize()
+        questions.append(
+            {
+                "question": question,
+                "question_type": str(item.get("type") or "multiple_choice"),
+                "options": options,
+                "correct_answer": answer,
+                "explanation": item.get("explanation"),
+                "difficulty": difficulty if difficulty in DIFFICULTY_MIX else "Medium",
+            }
+        )
+    return questions
+
+
+def store_questions(
+    db: Session, subject: str, topic: str, level: str, questions: List[Dict]
+) -> List[Question]:
+    """Add generated questions to the bank; ones already there are reused.
+
+    Returns the stored questions in the order given.
+    """
+    subject, topic, level = bank_key(subject, topic, level)
+    existing = {
+        q.question: q
+        for q in db.query(Question).filter(
+            Question.subject == subject,
+            Question.topic == topic,
+            Question.level == level,
+            Question.question.in_([q["question"] for q in questions]),
+        )
+    }
+    stored = []
+    for question in questions:
+        row = existing.get(question["question"])
+        if row is None:
+            row = existing[question["question"]] = Question(
+                subject=subject, topic=topic, level=level, **question
+            )
+            db.add(row)
+        stored.append(row)
+    db.commit()
+    return stored
+
+
+def bank_size(db: Session, subject: str, topic: str, level: str) -> int:
+    subject, topic, level = bank_key(subject, topic, level)
+    return (
+        db.query(Question)
+        .filter(
+            Question.subject == subject,
+            Question.topic == topic,
+            Question.level == level,
+        )
+        .count()
+    )
+
+
+def _unseen_query(db: Session, user_id: Optional[int], key, question_types):
+    subject, topic, level = key
+    query = db.query(Question.id, Question.difficulty).filter(
+        Question.subject == subject,
+        Question.topic == topic,
+        Question.level == level,
+    )
+    if question_types:
+        query = query.filter(Question.question_type.in_(question_types))
+    if user_id is not None:
+        query = query.outerjoin(
+            QuestionExposure,
+            and_(
+                QuestionExposure.question_id == Question.id,
+                QuestionExposure.user_id == user_id,
+            ),
+        ).filter(QuestionExposure.id.is_(None))
+    return query
+
+
+def _mix_counts(num_questions: int) -> Dict[str, int]:
+    """Split a quiz length across difficulties by largest remainder."""
+    exact = {d: share * num_questions for d, share in DIFFICULTY_MIX.items()}
+    counts = {d: int(v) for d, v in exact.items()}
+    for d in sorted(exact, key=lambda d: exact[d] - counts[d], reverse=True):
+        if sum(counts.values()) >= num_questions:
+            break
+        counts[d] += 1
+    return counts
+
+
+def nearest_calibrated(
+    db: Session,
+    user_id: int,
+    key: Tuple[str, str, str],
+    target: float,
+    count: int,
+    question_types: Optional[List[str]] = None,
+) -> Optional[List[int]]:
+    """Unseen calibrated questions closest to ``target`` difficulty.
+
+    Two range scans outward from the target on the calibration index, so the
+    cost grows with ``count`` rather than the bank size. Returns None when
+    fewer than ``count`` calibrated questions are left.
+    """
+    subject, topic, level = key
+    unseen = ~exists().where(
+        QuestionExposure.user_id == user_id,
+        QuestionExposure.question_id == ItemCalibration.item_id,
+    )
+    query = select(ItemCalibration.item_id, ItemCalibration.difficulty).where(
+        ItemCalibration.kind == "question",
+        ItemCalibration.subject == subject,
+        ItemCalibration.topic == topic,
+        ItemCalibration.level == level,
+        unseen,
+    )
+    if question_types:
+        query = query.join(Question, Question.id == ItemCalibration.item_id).where(
+            Question.question_type.in_(question_types)
+        )
+    harder = db.execute(
+        query.where(ItemCalibration.difficulty >= target)
+        .order_by(ItemCalibration.difficulty)
+        .limit(count)
+    ).all()
+    easier = db.execute(
+        query.where(ItemCalibration.difficulty < target)
+        .order_by(ItemCalibration.difficulty.desc())
+        .limit(count)
+    ).all()
+    nearest = sorted(harder + easier, key=lambda row: abs(row[1] - target))[:count]
+    if len(nearest) < count:
+        return None
+    return [item_id for item_id, _ in nearest]
+
+
+def assemble_quiz(
+    db: Session,
+    user_id: Optional[int],
+    subject: str,
+    topic: str,
+    level: str,
+    num_questions: int,
+    question_types: Optional[List[str]] = None,
+    target_difficulty: Optional[float] = None,
+) -> Tuple[Optional[List[Question]], int]:
+    """Sample an unseen quiz from the bank.
+
+    With ``target_difficulty`` (see ``utils.irt``) the calibrated questions
+    nearest to it are chosen; otherwise, or when too few are calibrated, the
+    quiz is sampled at random across the difficulty mix.
+
+    Returns ``(questions, remaining)`` where ``remaining`` is how many unseen
+    questions the user has left afterwards; ``questions`` is None when the
+    bank cannot fill the quiz.
+    """
+    key = bank_key(subject, topic, level)
+    chosen = None
+    if target_difficulty is not None and user_id is not None:
+        chosen = nearest_calibrated(
+            db, user_id, key, target_difficulty, num_questions, question_types
+        )
+    if chosen is not None:
+        available = _unseen_query(db, user_id, key, question_types).count()
+    else:
+        candidates = _unseen_query(db, user_id, key, question_types).all()
+        available = len(candidates)
+        if available < num_questions:
+            return None, available
+
+        by_difficulty: Dict[str, List[int]] = {}
+        for question_id, difficulty in candidates:
+            by_difficulty.setdefault(difficulty or "Medium", []).append(question_id)
+        chosen = []
+        for difficulty, count in _mix_counts(num_questions).items():
+            pool = by_difficulty.get(difficulty, [])
+            chosen += random.sample(pool, min(count, len(pool)))
+        if len(chosen) < num_questions:
+            # Top up from any difficulty when one tier runs short
+            rest = list({qid for qid, _ in candidates} - set(chosen))
+            chosen += random.sample(rest, num_questions - len(chosen))
+        random.shuffle(chosen)
+
+    questions = {q.id: q for q in db.query(Question).filter(Question.id.in_(chosen))}
+    if user_id is not None:
+        record_exposures(db, user_id, chosen)
+    return [questions[qid] for qid in chosen], available - num_questions
+
+
+def record_exposures(db: Session, user_id: int, question_ids: List[int]):
+    """Note questions served to a user; only these can be graded for them."""
+    db.add_all(
+        QuestionExposure(user_id=user_id, question_id=qid) for qid in question_ids
+    )
+    db.commit()
+
+
+def grade_answer(question: Question, answer: Optional[str]) -> bool:
+    """Compare an answer to the key; option letters ("B", "b)") also count."""
+    if answer is None:
+        return False
+    given = normalize_key(str(answer))
+    if given == normalize_key(question.correct_answer):
+        return True
+    options = question.options or []
+    letter = given.rstrip(").")
+    if len(letter) == 1 and "a" <= letter < chr(ord("a") + len(options)):
+        return normalize_key(options[ord(letter) - ord("a")]) == normalize_key(
+            question.correct_answer
+        )
+    return False
+
+
+def grade_submission(
+    db: Session, user_id: int, answers: Dict[int, Optional[str]]
+) -> List[Dict]:
+    """Grade answers server-side and record the outcomes on the exposures.
+
+    Only questions served to the user and not graded yet count; answers to
+    any other id are skipped. The caller commits.
+    """
+    questions = {q.id: q for q in db.query(Question).filter(Question.id.in_(answers))}
+    # Grade the most recent open exposure of each question
+    exposures = {
+        exposure.question_id: exposure
+        for exposure in db.query(QuestionExposure)
+        .filter(
+            QuestionExposure.user_id == user_id,
+            QuestionExposure.question_id.in_(answers),
+            QuestionExposure.correct.is_(None),
+        )
+        .order_by(QuestionExposure.served_at)
+    }
+    results = []
+    for question_id, answer in answers.items():
+        question = questions.get(question_id)
+        exposure = exposures.get(question_id)
+        if question is None or exposure is None:
+            continue
+        correct = grade_answer(question, answer)
+        exposure.correct = correct
+        results.append(
+            {
+                "question_id": question_id,
+                "subject": question.subject,
+                "topic": question.topic,
+                "difficulty": question.difficulty,
+                "answer": answer,
+                "correct": correct,
+                "correct_answer": question.correct_answer,
+                "explanation": question.explanation,
+            }
+        )
+    return results
+
+
+def display_names(
+    db: Session,
+    user_id: int,
+    keys: Iterable[Tuple[str, str]],
+    given: Optional[Tuple[str, str]] = None,
+) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """Spellings to record normalized (subject, topic) bank keys under.
+
+    The user's latest progress on the topic wins, so quiz results join the
+    rows the user entered themselves; then profile subjects and ``given``
+    names (as the quiz was requested); then the keys themselves.
+    """
+    subjects: Dict[str, str] = {}
+    topics: Dict[Tuple[str, str], str] = {}
+    if given:
+        subject, topic = given
+        subjects[normalize_key(subject)] = subject.strip()
+        topics[normalize_key(subject), normalize_key(topic)] = topic.strip()
+    user = db.get(User, user_id)
+    for subject in (user.subjects or {}) if user else {}:
+        subjects[normalize_key(subject)] = subject
+    rows = db.execute(
+        select(Progress.subject, Progress.topic)
+        .where(Progress.user_id == user_id)
+        .group_by(Progress.subject, Progress.topic)
+        .order_by(func.max(Progress.id))
+    )
+    for subject, topic in rows:
+        subjects[normalize_key(subject)] = subject
+        topics[normalize_key(subject), normalize_key(topic)] = topic
+    return {
+        (subject, topic): (
+            subjects.get(subject, subject),
+            topics.get((subject, topic), topic),
+        )
+        for subject, topic in keys
+    }
+
+
+def public_question(question: Question) -> Dict:
+    """A question as shown to learners, without its answer.
+
+    The key is only returned once the answer is graded.
+    """
+    return {
+        "id": question.id,
+        "question": question.question,
+        "type": question.question_type,
+        "options": question.options or [],
+        "difficulty": question.difficulty,
+    }
+
+
+def render_quiz(questions: List[Question]) -> str:
+    """Plain-text rendering matching the shape of a live-generated quiz."""
+    lines = []
+    for number, question in enumerate(questions, 1):
+        lines.append(f"{number}. {question.question}")
+        for letter, option in zip("ABCDEFGH", question.options or []):
+            lines.append(f"   {letter}) {option}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+async def refill_question_bank(
+    client,
+    subject: str,
+    topic: str,
+    level: str,
+    question_types: Optional[List[str]] = None,
+    batch_size: int = REFILL_BATCH_SIZE,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> int:
+    """Generate one batch of questions for a topic unless one is in flight."""
+    key = bank_key(subject, topic, level)
+    if key in _refilling:
+        return 0
+    _refilling.add(key)
+    try:
+        response = await client.generate_question_batch(
+            subject, topic, level, batch_size, question_types or ["multiple_choice"]
+        )
+        questions = parse_questions(response.get("response", ""))
+        with session_factory() as db:
+            return len(store_questions(db, subject, topic, level, questions))
+    except Exception:
+        logger.exception("Question bank refill failed for %s", key)
+        return 0
+    finally:
+        _refilling.discard(key)
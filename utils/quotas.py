@@ -0,0 +1,240 @@
+"""Token-bucket admission control for the generation routes.
+
+Each request is charged an estimated generation cost against the caller's
+buckets, one across all routes and one for the route, and against a bucket
+for the client address, however many user ids the address claims to be.
+Requests costing more than a bucket holds are refused outright. Bucket state lives in a small SQLite file so every uvicorn worker on the
+host shares it; point ``QUOTA_DB_PATH`` at ``/dev/shm`` to keep it in
+memory. Tiers (bucket sizes and refill rates) come from the JSON file named
+by ``QUOTA_CONFIG``, falling back to ``DEFAULT_CONFIG``.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from models.database import User
+from sqlalchemy.orm import Session
+
+QUOTAS_ENABLED = os.getenv("QUOTAS_ENABLED", "1").lower() in ("1", "true", "yes")
+QUOTA_DB_PATH = os.getenv("QUOTA_DB_PATH", "quotas.db")
+QUOTA_CONFIG = os.getenv("QUOTA_CONFIG")
+# Buckets untouched this long have refilled under any tier and are dropped
+IDLE_BUCKET_SECONDS = 3600
+
+DEFAULT_CONFIG = {
+    "default_tier": "standard",
+    "tiers": {
+        "standard": {
+            "capacity": 100,
+            "refill_per_minute": 20,
+            "routes": {
+                "/api/flashcards": {"capacity": 40, "refill_per_minute": 5},
+                "/api/upload-paper": {"capacity": 40, "refill_per_minute": 4},
+            },
+        },
+        "premium": {"capacity": 400, "refill_per_minute": 80, "routes": {}},
+    },
+    # Per client address, shared by every user behind it (e.g. a school)
+    "client": {"capacity": 400, "refill_per_minute": 80},
+    # User id -> tier name
+    "users": {},
+}
+
+# Route -> (base cost, cost per unit): units are questions, cards or
+# thousands of characters of an uploaded paper
+ROUTE_COSTS = {
+    "/api/lesson": (8, 0),
+    "/api/quiz": (2, 1),
+    "/api/study-plan": (10, 0),
+    "/api/upload-paper": (4, 1),
+    "/api/interactive-element": (6, 0),
+    "/api/flashcards": (2, 1),
+}
+
+Bucket = Tuple[str, float, float]  # (key, capacity, refill per second)
+
+
+@lru_cache(maxsize=1)
+def load_config() -> Dict:
+    if not QUOTA_CONFIG:
+        return DEFAULT_CONFIG
+    with open(QUOTA_CONFIG) as f:
+        return json.load(f)
+
+
+def request_cost(route: str, units: float = 0) -> float:
+    base, per_unit = ROUTE_COSTS.get(route, (1, 0))
+    return base + per_unit * units
+
+
+def buckets_for(caller: str, user_id: Optional[int], route: str) -> List[Bucket]:
+    config = load_config()
+    tier_name = config.get("users", {}).get(str(user_id), config["default_tier"])
+    tier = config["tiers"][tier_name]
+    buckets = [(caller, tier["capacity"], tier["refill_per_minute"] / 60)]
+    route_limits = tier.get("routes", {}).get(route)
+    if route_limits:
+        buckets.append(
+            (
+                f"{caller}|{route}",
+                route_limits["capacity"],
+                route_limits["refill_per_minute"] / 60,
+            )
+        )
+    return buckets
+
+
+def client_bucket(address: Optional[str]) -> Bucket:
+    limits = load_config().get("client", DEFAULT_CONFIG["client"])
+    return (f"client:{address}", limits["capacity"], limits["refill_per_minute"] / 60)
+
+
+class BucketStore:
+    """Token buckets in SQLite, updated atomically across processes."""
+
+    def __init__(self, path: str = QUOTA_DB_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._pruned = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def take(
+        self, buckets: List[Bucket], cost: float, now: Optional[float] = None
+    ) -> Tuple[bool, float, float]:
+        """Charge ``cost`` to every bucket, or to none if any is short.
+
+        Returns ``(allowed, remaining, retry_after)`` where ``remaining`` is
+        the lowest balance across the buckets and ``retry_after`` the seconds
+        until all of them could cover the cost.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                levels = []
+                for key, capacity, rate in buckets:
+                    row = conn.execute(
+                        "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                    ).fetchone()
+                    tokens = capacity
+                    if row is not None:
+                        tokens = min(capacity, row[0] + (now - row[1]) * rate)
+                    levels.append((key, tokens, cost, rate))
+
+                allowed = all(tokens >= charge for _, tokens, charge, _ in levels)
+                if allowed:
+                    levels = [(k, t - c, c, r) for k, t, c, r in levels]
+                conn.executemany(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET "
+                    "tokens = excluded.tokens, updated = excluded.updated",
+                    [(key, tokens, now) for key, tokens, _, _ in levels],
+                )
+                if now - self._pruned > IDLE_BUCKET_SECONDS:
+                    conn.execute(
+                        "DELETE FROM buckets WHERE updated < ?",
+                        (now - IDLE_BUCKET_SECONDS,),
+                    )
+                    self._pruned = now
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        remaining = min(tokens for _, tokens, _, _ in levels)
+        retry_after = max(
+            (max(charge - tokens, 0) / rate if rate else math.inf)
+            for _, tokens, charge, rate in levels
+        )
+        return allowed, remaining, 0.0 if allowed else retry_after
+
+
+store = BucketStore()
+
+
+def enforce_quota(
+    http_request: Request, db: Session, user_id: Optional[int], units: float = 0
+):
+    """Admit a generation request or raise a 429 with the reset time.
+
+    Unknown users get a 404 before anything is charged. Anonymous callers
+    are limited per client address.
+    """
+    if not QUOTAS_ENABLED:
+        return
+    if user_id is not None and db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    route = http_request.url.path
+    address = http_request.client.host if http_request.client else None
+    caller = f"user:{user_id}" if user_id is not None else f"ip:{address}"
+    buckets = [client_bucket(address)] + buckets_for(caller, user_id, route)
+    cost = request_cost(route, units)
+    capacity = min(capacity for _, capacity, _ in buckets)
+    if cost > capacity:
+        raise HTTPException(
+            status_code=413,
+            detail={
+                "message": "Request is larger than the generation quota allows",
+                "route": route,
+                "cost": cost,
+                "capacity": capacity,
+            },
+        )
+    allowed, remaining, retry_after = store.take(buckets, cost)
+    if allowed:
+        return
+    retry_after = math.ceil(retry_after) if math.isfinite(retry_after) else 3600
+    raise HTTPException(
+        status_code=429,
+        detail={
+            "message": "Generation quota exceeded, please retry later",
+            "route": route,
+            "cost": cost,
+            "remaining": round(remaining, 2),
+            "retry_after": retry_after,
+            "reset_at": int(time.time()) + retry_after,
+        },
+        headers={
+            "Retry-After": str(retry_after),
+            "X-RateLimit-Remaining": str(int(remaining)),
+            "X-RateLimit-Reset": str(int(time.time()) + retry_after),
+        },
+    )
+
+
+def within_quota(
+    http_request: Request, db: Session, user_id: Optional[int], units: float = 0
+) -> bool:
+    """Charge like ``enforce_quota`` but report a refusal instead of raising.
+
+    For background generations that a response does not wait on.
+    """
+    try:
+        enforce_quota(http_request, db, user_id, units)
+    except HTTPException as e:
+        if e.status_code == 404:
+            raise
+        return False
+    return True
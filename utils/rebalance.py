@@ -0,0 +1,248 @@
+"""Move tenants between database shards while the service keeps running.
+
+A move marks the tenant's users read-only in the shard directory, waits for
+every process to see that, copies their rows into the target shard in one
+transaction, points the directory at the target and, once cached routes
+have expired, deletes the rows from the source. Other tenants on either
+shard are unaffected, and the moving tenant can keep reading throughout;
+its writes are answered with 503 until the copy is done.
+
+Rows get new ids in the target shard (ids other than user ids are only
+unique within a shard). Question exposures refer to the source shard's
+question bank and are not copied, and rows already moved to a cold archive
+by ``utils.archive`` stay in the source shard's archive. Moved rows are
+dropped from the source shard's columnar analytics copy (``utils.columnar``)
+and exported again from the target under their new ids.
+
+    python -m utils.rebalance status
+    python -m utils.rebalance move --tenant "Springfield High" --to 2
+    python -m utils.rebalance move --user-id 42 --to 1
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional
+
+from models.database import (
+    ROUTE_CACHE_SECONDS,
+    SHARD_PATHS,
+    Base,
+    DataVersion,
+    QuestionExposure,
+    QuestionPaper,
+    ShardDirectory,
+    User,
+    directory_engine,
+    engines,
+)
+from models.search import MAX_CHUNKS_PER_PAPER
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as upsert
+from utils import columnar
+
+# Extra wait on top of the route cache, for requests already in flight
+GRACE_SECONDS = 2.0
+# Tables that are not per-user data, or are rebuilt rather than copied
+SKIPPED_TABLES = {
+    "generation_usage",
+    "compression_dictionaries",
+    DataVersion.__tablename__,
+    QuestionExposure.__tablename__,
+}
+
+
+def user_tables():
+    """Tables holding per-user rows, parents before children."""
+    return [
+        table
+        for table in Base.metadata.sorted_tables
+        if table.name not in SKIPPED_TABLES
+        and (table is User.__table__ or "user_id" in table.c)
+    ]
+
+
+def _owner(table):
+    return table.c.id if table is User.__table__ else table.c.user_id
+
+
+def _remapped(table) -> bool:
+    """Rows of tables with a surrogate ``id`` key get a new id in the target."""
+    return table is not User.__table__ and list(table.primary_key.columns) == [
+        table.c.get("id")
+    ]
+
+
+def _copy_users(source, target, user_ids: List[int]) -> Dict[str, Dict[int, int]]:
+    """Copy the users' rows; returns old -> new ids per remapped table."""
+    ids: Dict[str, Dict[int, int]] = {}
+    for table in user_tables():
+        mapping = ids[table.name] = {}
+        foreign = {
+            column.name: fk.column.table.name
+            for column in table.columns
+            for fk in column.foreign_keys
+            if fk.column.table.name in ids and fk.column.table is not User.__table__
+        }
+        rows = source.execute(
+            select(table)
+            .where(_owner(table).in_(user_ids))
+            .order_by(*table.primary_key)
+        ).mappings()
+        for row in rows:
+            values = dict(row)
+            for column, parent in foreign.items():
+                if values[column] is not None:
+                    values[column] = ids[parent].get(values[column], values[column])
+            if _remapped(table):
+                old_id = values.pop("id")
+                mapping[old_id] = target.execute(
+                    insert(table).values(**values)
+                ).inserted_primary_key[0]
+            else:
+                target.execute(insert(table).values(**values))
+
+    # Passages of uploaded papers, keyed by paper id
+    for old_id, new_id in ids[QuestionPaper.__tablename__].items():
+        chunks = source.exec_driver_sql(
+            "SELECT rowid - ?, scope, paper_id, body FROM paper_chunks "
+            "WHERE rowid >= ? AND rowid < ?",
+            (
+                old_id * MAX_CHUNKS_PER_PAPER,
+                old_id * MAX_CHUNKS_PER_PAPER,
+                (old_id + 1) * MAX_CHUNKS_PER_PAPER,
+            ),
+        ).all()
+        if chunks:
+            target.exec_driver_sql(
+                "INSERT INTO paper_chunks(rowid, scope, paper_id, body) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (new_id * MAX_CHUNKS_PER_PAPER + n, scope, new_id, body)
+                    for n, scope, _, body in chunks
+                ],
+            )
+
+    # Row ids changed, so every moved collection needs a version (and ETag)
+    # that neither shard has served before
+    versions = source.execute(
+        select(DataVersion.__table__).where(DataVersion.user_id.in_(user_ids))
+    ).mappings()
+    stmt = upsert(DataVersion)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DataVersion.user_id, DataVersion.collection],
+        set_={"version": DataVersion.version + stmt.excluded.version},
+    )
+    for row in versions:
+        target.execute(stmt, {**row, "version": row["version"] + 1})
+    return ids
+
+
+def _set_directory(user_ids: List[int], **values):
+    with directory_engine.begin() as conn:
+        conn.execute(
+            update(ShardDirectory)
+            .where(ShardDirectory.user_id.in_(user_ids))
+            .values(**values)
+        )
+
+
+def move(
+    to: int,
+    tenant: Optional[str] = None,
+    user_id: Optional[int] = None,
+    wait: float = ROUTE_CACHE_SECONDS + GRACE_SECONDS,
+) -> Dict:
+    """Move a tenant's users, or one user, to shard ``to``."""
+    if not 0 <= to < len(engines):
+        raise ValueError(f"No shard {to}; there are {len(engines)}")
+    started = time.perf_counter()
+    with directory_engine.connect() as conn:
+        owner = (
+            ShardDirectory.tenant == tenant
+            if tenant is not None
+            else ShardDirectory.user_id == user_id
+        )
+        entries = conn.execute(
+            select(ShardDirectory.user_id, ShardDirectory.shard).where(owner)
+        ).all()
+    by_shard: Dict[int, List[int]] = {}
+    for entry in entries:
+        if entry.shard != to:
+            by_shard.setdefault(entry.shard, []).append(entry.user_id)
+    moved = sum(len(ids) for ids in by_shard.values())
+    if not moved:
+        return {"users": 0, "seconds": 0.0}
+
+    for shard, user_ids in by_shard.items():
+        _set_directory(user_ids, read_only=True)
+        try:
+            time.sleep(wait)
+            with engines[shard].connect() as source, engines[to].begin() as target:
+                copied = _copy_users(source, target, user_ids)
+        except Exception:
+            _set_directory(user_ids, read_only=False)
+            raise
+        _set_directory(user_ids, shard=to, read_only=False)
+
+        # Processes may still route to the source until their cache expires
+        time.sleep(wait)
+        with engines[shard].begin() as source:
+            for table in reversed(user_tables()):
+                source.execute(delete(table).where(_owner(table).in_(user_ids)))
+            for model in (QuestionExposure, DataVersion):
+                source.execute(delete(model).where(model.user_id.in_(user_ids)))
+        columnar.forget(
+            shard,
+            {
+                dataset: copied[table].keys()
+                for dataset, table in columnar.SOURCE_TABLES.items()
+            },
+        )
+    return {"users": moved, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def status() -> List[Dict]:
+    with directory_engine.connect() as conn:
+        rows = conn.execute(
+            select(
+                ShardDirectory.shard,
+                func.count(),
+                func.count(func.distinct(ShardDirectory.tenant)),
+            ).group_by(ShardDirectory.shard)
+        ).all()
+    counts = {shard: (users, tenants) for shard, users, tenants in rows}
+    return [
+        {
+            "shard": shard,
+            "path": path,
+            "users": counts.get(shard, (0, 0))[0],
+            "tenants": counts.get(shard, (0, 0))[1],
+        }
+        for shard, path in enumerate(SHARD_PATHS)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    move_parser = commands.add_parser("move")
+    owner = move_parser.add_mutually_exclusive_group(required=True)
+    owner.add_argument("--tenant")
+    owner.add_argument("--user-id", type=int)
+    move_parser.add_argument("--to", type=int, required=True, help="Target shard")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for shard in status():
+            print(
+                f"{shard['shard']}: {shard['path']} - {shard['users']} users, "
+                f"{shard['tenants']} tenants"
+            )
+        return
+    report = move(args.to, args.tenant, args.user_id)
+    print(f"Moved {report['users']} users to shard {args.to} in {report['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Retrieval of relevant question-paper passages for generation prompts.
+
+Papers are split into short passages and indexed per user and subject with
+FTS5 (see ``models.search``); at generation time only the best bm25 matches
+for the topic are included, packed under a fixed token budget.
+"""
+
+import os
+import re
+from typing import List, Optional
+
+from models.database import QuestionPaper
+from models.search import index_paper_chunks, search_paper_chunks
+from sqlalchemy.orm import Session
+from utils.tokens import estimate_tokens, truncate_to_tokens
+
+CHUNK_TOKENS = int(os.getenv("PAPER_CHUNK_TOKENS", "160"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("PAPER_CONTEXT_TOKENS", "600"))
+CONTEXT_TOP_K = int(os.getenv("PAPER_CONTEXT_TOP_K", "5"))
+# Passages are not truncated below this size; a fragment is not worth its cost
+MIN_PASSAGE_TOKENS = 32
+
+
+def chunk_text(content: str, max_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """Split text into passages of at most ``max_tokens``, on paragraph or
+    line boundaries where possible so questions stay intact."""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for block in re.split(r"\n\s*\n|\n(?=\s*(?:Q?\d+[.)]|\([a-z]\)))", content):
+        block = " ".join(block.split())
+        if not block:
+            continue
+        tokens = estimate_tokens(block)
+        if tokens > max_tokens:
+            # An oversized block becomes its own run of word-window chunks
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            words = block.split(" ")
+            step = max(1, int(max_tokens * 0.75))  # ~0.75 words per token
+            chunks += [
+                " ".join(words[i : i + step]) for i in range(0, len(words), step)
+            ]
+            continue
+        if size + tokens > max_tokens and current:
+            chunks.append(" ".join(current))
+            current, size = [], 0
+        current.append(block)
+        size += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def index_paper(db: Session, paper: QuestionPaper, content: str) -> int:
+    """Chunk and index one paper's text; returns the number of passages."""
+    chunks = chunk_text(content)
+    index_paper_chunks(db, paper.id, paper.user_id, paper.subject or "", chunks)
+    return len(chunks)
+
+
+def retrieve_paper_context(
+    db: Session,
+    user_id: Optional[int],
+    subject: str,
+    query: str,
+    top_k: int = CONTEXT_TOP_K,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+) -> List[str]:
+    """Top-k passages for ``query`` from the user's papers, within budget."""
+    if user_id is None or token_budget <= 0:
+        return []
+    passages = []
+    remaining = token_budget
+    for match in search_paper_chunks(db, user_id, subject, query, top_k):
+        passage = match["text"]
+        if estimate_tokens(passage) > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                break
+            passage = truncate_to_tokens(passage, remaining)
+        passages.append(passage)
+        remaining -= estimate_tokens(passage)
+    return passages
+
+
+def reindex_papers(db: Session) -> int:
+    """Rebuild the passage index from every uploaded paper still on disk."""
+    indexed = 0
+    for paper in db.query(QuestionPaper).all():
+        if not paper.file_path or not os.path.exists(paper.file_path):
+            continue
+        with open(paper.file_path, "r", errors="ignore") as f:
+            index_paper(db, paper, f.read())
+        indexed += 1
+    db.commit()
+    return indexed
+
+
+if __name__ == "__main__":
+    from models.database import SessionLocal
+
+    with SessionLocal() as session:
+        print(f"Indexed {reindex_papers(session)} papers")
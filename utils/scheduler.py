@@ -0,0 +1,355 @@
+"""Deterministic study-plan scheduling over the prerequisite graphs.
+
+A plan covers the goal topics the user has not yet mastered together with
+their unmastered prerequisites. Each subject's topics are ordered
+topologically (weakest first among those whose prerequisites are planned
+earlier), subjects are interleaved, and the resulting sessions are packed
+into the weekly time slots from the user's ``study_preferences``:
+
+    {"time_slots": [{"day": "Monday", "start": "18:00", "minutes": 60}],
+     "session_minutes": 30}
+
+When new progress changes a topic's mastery, ``replan`` keeps every day
+before the topic's next scheduled session and repacks only the days after.
+"""
+
+import math
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from models.database import StudyPlan, TopicMastery, User
+from sqlalchemy.orm import Session, undefer
+from utils.curriculum import prerequisite_graph, topological_order, with_prerequisites
+from utils.mastery import MASTERY_TARGET, P_INIT
+from utils.question_bank import normalize_key
+
+DEFAULT_SESSION_MINUTES = 30
+# Used when the user has not set any time slots
+DEFAULT_DAILY_MINUTES = 60
+# Expected mastery gained per study session, for estimating session counts
+MASTERY_PER_SESSION = 0.15
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+TopicKey = Tuple[str, str]  # Normalized (subject, topic)
+Slot = Tuple[Optional[str], int]  # (start "HH:MM" or None, minutes)
+
+
+def sessions_needed(mastery: float) -> int:
+    return max(1, math.ceil((MASTERY_TARGET - mastery) / MASTERY_PER_SESSION))
+
+
+def _parse_slot(slot) -> Optional[Tuple[int, Slot]]:
+    """``(weekday, slot)`` for a well-formed time slot, None otherwise."""
+    if not isinstance(slot, dict):
+        return None
+    day = str(slot.get("day", "")).lower()
+    start = slot.get("start")
+    try:
+        minutes = int(slot.get("minutes") or 0)
+        if start is not None:
+            datetime.strptime(start, "%H:%M")
+    except (TypeError, ValueError):
+        return None
+    if day not in WEEKDAYS or minutes <= 0:
+        return None
+    return WEEKDAYS.index(day), (start, minutes)
+
+
+def preference_errors(preferences: Optional[Dict]) -> List[str]:
+    """Problems with ``study_preferences``, checked when they are saved."""
+    if not preferences:
+        return []
+    errors = []
+    time_slots = preferences.get("time_slots") or []
+    if not isinstance(time_slots, list):
+        return ["time_slots must be a list"]
+    for i, slot in enumerate(time_slots):
+        if _parse_slot(slot) is None:
+            errors.append(
+                f"time_slots[{i}] needs a weekday, positive minutes and an "
+                "optional HH:MM start"
+            )
+    session_minutes = preferences.get("session_minutes")
+    if session_minutes is not None and (
+        not isinstance(session_minutes, int) or session_minutes <= 0
+    ):
+        errors.append("session_minutes must be a positive integer")
+    return errors
+
+
+def weekly_slots(preferences: Optional[Dict]) -> Dict[int, List[Slot]]:
+    """Available slots per weekday (0 = Monday) from ``study_preferences``.
+
+    Malformed slots, e.g. saved before preferences were validated, are skipped.
+    """
+    slots: Dict[int, List[Slot]] = {}
+    time_slots = (preferences or {}).get("time_slots") or []
+    for slot in time_slots if isinstance(time_slots, list) else []:
+        parsed = _parse_slot(slot)
+        if parsed:
+            slots.setdefault(parsed[0], []).append(parsed[1])
+    if not slots:
+        return {day: [(None, DEFAULT_DAILY_MINUTES)] for day in range(7)}
+    for day_slots in slots.values():
+        day_slots.sort(key=lambda s: s[0] or "")
+    return slots
+
+
+def _session_minutes(preferences: Optional[Dict]) -> int:
+    minutes = (preferences or {}).get("session_minutes")
+    if isinstance(minutes, int) and minutes > 0:
+        return minutes
+    return DEFAULT_SESSION_MINUTES
+
+
+def _goal_topics(goals: Optional[Dict]) -> Dict[str, Set[str]]:
+    """Subject -> goal topics; an empty set means the whole subject."""
+    targets: Dict[str, Set[str]] = {}
+    for subject, topics in (goals or {}).items():
+        if isinstance(topics, str):
+            topics = []  # A target level rather than a topic list
+        targets[normalize_key(subject)] = {normalize_key(t) for t in topics or []}
+    return targets
+
+
+def _interleave(queues: List[List[Dict]]) -> List[Dict]:
+    merged = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        merged += [q[i] for q in queues if i < len(q)]
+    return merged
+
+
+def plan_topics(
+    goals: Optional[Dict], mastery: Dict[TopicKey, TopicMastery]
+) -> List[Dict]:
+    """Ordered topics to study with the number of sessions each needs."""
+    queues = []
+    for subject, targets in sorted(_goal_topics(goals).items()):
+        graph = prerequisite_graph(subject)
+        if not targets:
+            targets = set(graph) or {t for s, t in mastery if s == subject}
+        levels = {
+            topic: (
+                mastery[(subject, topic)].mastery
+                if (subject, topic) in mastery
+                else P_INIT
+            )
+            for topic in with_prerequisites(graph, targets)
+        }
+        weak = [topic for topic, level in levels.items() if level < MASTERY_TARGET]
+        order = topological_order(graph, weak, priority=lambda t: (levels[t], t))
+        queues.append(
+            [
+                {
+                    "subject": subject,
+                    "topic": topic,
+                    "mastery": round(levels[topic], 3),
+                    "sessions": sessions_needed(levels[topic]),
+                    "activity": (
+                        "practice" if (subject, topic) in mastery else "learn"
+                    ),
+                }
+                for topic in order
+            ]
+        )
+    return _interleave(queues)
+
+
+def pack(
+    topics: List[Dict],
+    slots: Dict[int, List[Slot]],
+    session_minutes: int,
+    start: date,
+    days: int,
+) -> List[Dict]:
+    """Place the topics' sessions, in order, into ``days`` days of slots."""
+    pending = ((t, n) for t in topics for n in range(t["sessions"]))
+    current = next(pending, None)
+    schedule = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        sessions = []
+        for slot_start, minutes in slots.get(day.weekday(), []):
+            try:
+                begin = (
+                    datetime.combine(day, datetime.strptime(slot_start, "%H:%M").time())
+                    if slot_start
+                    else None
+                )
+            except (TypeError, ValueError):
+                continue  # A malformed slot must not fail the whole plan
+            for k in range(minutes // session_minutes):
+                if current is None:
+                    break
+                topic, _ = current
+                sessions.append(
+                    {
+                        "start": (
+                            (begin + timedelta(minutes=k * session_minutes)).strftime(
+                                "%H:%M"
+                            )
+                            if begin
+                            else None
+                        ),
+                        "minutes": session_minutes,
+                        "subject": topic["subject"],
+                        "topic": topic["topic"],
+                        "activity": topic["activity"],
+                    }
+                )
+                current = next(pending, None)
+        schedule.append({"date": day.isoformat(), "sessions": sessions})
+    return schedule
+
+
+def milestones(schedule: List[Dict]) -> List[Dict]:
+    """Day each topic's last planned session falls on."""
+    finished: Dict[TopicKey, str] = {}
+    for day in schedule:
+        for session in day["sessions"]:
+            finished[(session["subject"], session["topic"])] = day["date"]
+    return [
+        {"subject": subject, "topic": topic, "date": finished_on}
+        for (subject, topic), finished_on in sorted(
+            finished.items(), key=lambda item: (item[1], item[0])
+        )
+    ]
+
+
+def _is_goal_map(goals) -> bool:
+    """Whether ``goals`` maps subjects to topic lists, as plans expect.
+
+    ``learning_goals`` on profiles are free-form and often are not.
+    """
+    return (
+        isinstance(goals, dict)
+        and bool(goals)
+        and all(
+            isinstance(topics, list) and all(isinstance(t, str) for t in topics)
+            for topics in goals.values()
+        )
+    )
+
+
+def _mastery_by_topic(db: Session, user_id: int) -> Dict[TopicKey, TopicMastery]:
+    rows = db.query(TopicMastery).filter(TopicMastery.user_id == user_id)
+    return {(row.subject, row.topic): row for row in rows}
+
+
+def build_plan(
+    db: Session,
+    user: User,
+    goals: Optional[Dict],
+    duration: int,
+    start: Optional[date] = None,
+) -> Dict:
+    """Topics, day-by-day schedule and milestones for a new study plan."""
+    if not goals and _is_goal_map(user.learning_goals):
+        goals = user.learning_goals
+    goals = goals or dict.fromkeys(user.subjects or {}, [])
+    preferences = user.study_preferences or {}
+    topics = plan_topics(goals, _mastery_by_topic(db, user.id))
+    schedule = pack(
+        topics,
+        weekly_slots(preferences),
+        _session_minutes(preferences),
+        start or date.today(),
+        duration,
+    )
+    scheduled = Counter(
+        (s["subject"], s["topic"]) for d in schedule for s in d["sessions"]
+    )
+    return {
+        "goals": goals,
+        "topics": topics,
+        "schedule": schedule,
+        "milestones": milestones(schedule),
+        "unscheduled": [
+            {"subject": t["subject"], "topic": t["topic"]}
+            for t in topics
+            if scheduled[(t["subject"], t["topic"])] < t["sessions"]
+        ],
+    }
+
+
+def replan(
+    db: Session,
+    study_plan: StudyPlan,
+    changed: Iterable[TopicKey],
+    today: Optional[date] = None,
+) -> int:
+    """Repack a plan after mastery changed on ``changed`` topics.
+
+    Days before the first upcoming session of a changed topic are kept
+    as they are. Returns the number of days recomputed; the caller commits.
+    """
+    plan, schedule = study_plan.plan, study_plan.schedule
+    if not isinstance(plan, dict) or not schedule:
+        return 0
+    changed = set(changed)
+    today = (today or date.today()).isoformat()
+    first = next(
+        (
+            i
+            for i, day in enumerate(schedule)
+            if day["date"] >= today
+            and any((s["subject"], s["topic"]) in changed for s in day["sessions"])
+        ),
+        None,
+    )
+    if first is None:
+        return 0
+
+    kept = schedule[:first]
+    done = Counter((s["subject"], s["topic"]) for d in kept for s in d["sessions"])
+    mastery = _mastery_by_topic(db, study_plan.user_id)
+    topics, remaining = [], []
+    for topic in plan["topics"]:
+        key = (topic["subject"], topic["topic"])
+        if key in changed and key in mastery:
+            level = mastery[key].mastery
+            needed = sessions_needed(level) if level < MASTERY_TARGET else 0
+            topic = {
+                **topic,
+                "mastery": round(level, 3),
+                "sessions": done[key] + needed,
+                "activity": "practice",
+            }
+        topics.append(topic)
+        if topic["sessions"] > done[key]:
+            remaining.append({**topic, "sessions": topic["sessions"] - done[key]})
+
+    preferences = db.get(User, study_plan.user_id).study_preferences or {}
+    tail = pack(
+        remaining,
+        weekly_slots(preferences),
+        _session_minutes(preferences),
+        date.fromisoformat(schedule[first]["date"]),
+        len(schedule) - first,
+    )
+    # JSON columns only persist on reassignment
+    study_plan.plan = {**plan, "topics": topics}
+    study_plan.schedule = kept + tail
+    study_plan.milestones = milestones(study_plan.schedule)
+    return len(tail)
+
+
+def replan_active_plans(db: Session, user_id: int, changed: Iterable[TopicKey]) -> int:
+    """Replan every active plan of the user; returns the days recomputed."""
+    changed = set(changed)
+    plans = (
+        db.query(StudyPlan)
+        .options(undefer(StudyPlan.plan))
+        .filter(StudyPlan.user_id == user_id, StudyPlan.status == "Active")
+    )
+    return sum(replan(db, plan, changed) for plan in plans)
@@ -0,0 +1,199 @@
+"""Per-request timing breakdown.
+
+A ``RequestTimings`` object is bound to a context variable for the lifetime
+of each HTTP request. The DB engine hooks, ``OllamaClient`` and the route
+class add phase durations to it; the middleware in ``app.main`` turns them
+into a ``Server-Timing`` header, a structured log line and histograms.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from utils.metrics import registry
+
+logger = logging.getLogger("ai_tutor.timing")
+
+# Server-Timing descriptions for known phases
+PHASE_DESCRIPTIONS = {
+    "db": "SQL queries",
+    "llm": "Ollama HTTP calls",
+    "embed": "Embedding calls",
+    "ollama_load": "Ollama model load",
+    "ollama_prompt_eval": "Ollama prompt evaluation",
+    "ollama_eval": "Ollama token generation",
+    "app": "Endpoint body",
+    "serialize": "Request validation and response serialization",
+}
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Total HTTP request latency",
+    ("method", "route", "status"),
+)
+phase_duration = registry.histogram(
+    "http_request_phase_duration_seconds",
+    "Time spent per request in each phase",
+    ("route", "phase"),
+)
+
+
+class RequestTimings:
+    __slots__ = ("durations", "counts")
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, phase: str, seconds: float):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def begin_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def record(phase: str, seconds: float):
+    """Add time spent in ``phase`` to the current request, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def record_ollama_durations(result: Dict):
+    """Record Ollama's own nanosecond breakdown of a generation."""
+    for key, phase in (
+        ("load_duration", "ollama_load"),
+        ("prompt_eval_duration", "ollama_prompt_eval"),
+        ("eval_duration", "ollama_eval"),
+    ):
+        if result.get(key):
+            record(phase, result[key] / 1e9)
+
+
+def server_timing_header(timings: RequestTimings, total: float) -> str:
+    entries = [f'total;dur={total * 1000:.1f};desc="Total"']
+    for phase, seconds in timings.durations.items():
+        desc = PHASE_DESCRIPTIONS.get(phase, phase)
+        entries.append(f'{phase};dur={seconds * 1000:.1f};desc="{desc}"')
+    return ", ".join(entries)
+
+
+def finish_request(
+    timings: RequestTimings,
+    method: str,
+    path: str,
+    route: str,
+    status: int,
+    total: float,
+):
+    """Feed the histograms and emit one structured log line."""
+    request_duration.observe(total, method, route, str(status))
+    for phase, seconds in timings.durations.items():
+        phase_duration.observe(seconds, route, phase)
+    logger.info(
+        json.dumps(
+            {
+                "event": "request_timing",
+                "method": method,
+                "path": path,
+                "route": route,
+                "status": status,
+                "total_ms": round(total * 1000, 1),
+                "phases_ms": {
+                    phase: round(seconds * 1000, 1)
+                    for phase, seconds in timings.durations.items()
+                },
+                "counts": timings.counts,
+            }
+        )
+    )
+
+
+def instrument_engine(engine):
+    """Attribute SQL execution time to the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        record("db", time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        # A statement that raised never reaches after_cursor_execute
+        conn = context.connection
+        if conn is not None and context.execution_context is not None:
+            started = conn.info.get("query_started")
+            if started:
+                record("db", time.perf_counter() - started.pop())
+
+
+class TimedRoute(APIRoute):
+    """Route that separates endpoint time from framework time.
+
+    The endpoint body is recorded as ``app``; everything else the route
+    handler does (body validation, dependency solving, response encoding
+    and rendering) is recorded as ``serialize``.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+
+            @functools.wraps(endpoint)
+            async def timed_endpoint(*args, **kw):
+                with timed("app"):
+                    return await endpoint(*args, **kw)
+
+        else:
+
+            @functools.wraps(endpoint)
+            def timed_endpoint(*args, **kw):
+                with timed("app"):
+                    return endpoint(*args, **kw)
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            started = time.perf_counter()
+            timings = _current.get()
+            before = timings.durations.get("app", 0.0) if timings else 0.0
+            try:
+                return await handler(request)
+            finally:
+                if timings is not None:
+                    endpoint = timings.durations.get("app", 0.0) - before
+                    framework = time.perf_counter() - started - endpoint
+                    timings.add("serialize", max(framework, 0.0))
+
+        return timed_handler
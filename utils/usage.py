@@ -0,0 +1,205 @@
+"""Generation usage accounting per user, route and model.
+
+``OllamaClient`` reports every generation here. Counters are summed in
+memory per (hour, user, route, model) and a background thread upserts them
+into ``generation_usage`` every few seconds in one transaction, so the
+request path only pays for a dict update. Several worker processes can
+flush into the same table because the upsert adds to existing rows.
+
+Attribution comes from a context variable: the HTTP middleware sets the
+route and endpoints call ``attribute_user`` once they know who is asking.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from models.database import GenerationUsage, directory_engine
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
+# Flush early once this many distinct rows are pending
+MAX_PENDING_ROWS = 1000
+
+COUNTERS = (
+    "requests",
+    "cache_hits",
+    "prompt_tokens",
+    "completion_tokens",
+    "load_seconds",
+    "prompt_eval_seconds",
+    "eval_seconds",
+    "total_seconds",
+)
+BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+}
+GROUP_COLUMNS = {
+    "user": GenerationUsage.user_id,
+    "route": GenerationUsage.route,
+    "model": GenerationUsage.model,
+}
+
+Key = Tuple[datetime, int, str, str]  # (hour, user_id, route, model)
+
+
+class Attribution:
+    __slots__ = ("route", "user_id")
+
+    def __init__(self, route: str = "background", user_id: Optional[int] = None):
+        self.route = route
+        self.user_id = user_id
+
+
+_attribution: ContextVar[Optional[Attribution]] = ContextVar(
+    "usage_attribution", default=None
+)
+
+
+def begin_attribution(route: str) -> Attribution:
+    attribution = Attribution(route)
+    _attribution.set(attribution)
+    return attribution
+
+
+def attribute_user(user_id: Optional[int]):
+    """Charge generations in the current request to ``user_id``."""
+    attribution = _attribution.get()
+    if attribution is None:
+        attribution = begin_attribution("background")
+    attribution.user_id = user_id
+
+
+class UsageRecorder:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[Key, List[float]] = {}
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, model: str, result: Optional[Dict], cached: bool = False):
+        attribution = _attribution.get() or Attribution()
+        key = (
+            datetime.utcnow().replace(minute=0, second=0, microsecond=0),
+            attribution.user_id or 0,
+            attribution.route,
+            model,
+        )
+        result = result or {}
+        values = (
+            0 if cached else 1,
+            1 if cached else 0,
+            result.get("prompt_eval_count", 0),
+            result.get("eval_count", 0),
+            result.get("load_duration", 0) / 1e9,
+            result.get("prompt_eval_duration", 0) / 1e9,
+            result.get("eval_duration", 0) / 1e9,
+            result.get("total_duration", 0) / 1e9,
+        )
+        with self._lock:
+            self._merge(key, values)
+            pending = len(self._pending)
+        if self._thread is None:
+            self._start()
+        if pending >= MAX_PENDING_ROWS:
+            self._wakeup.set()
+
+    def _merge(self, key: Key, values):
+        row = self._pending.get(key)
+        if row is None:
+            self._pending[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                row[i] += value
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="usage-writer", daemon=True
+            )
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write pending counters in one transaction."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        rows = [
+            dict(
+                bucket_start=bucket,
+                user_id=user_id,
+                route=route,
+                model=model,
+                **dict(zip(COUNTERS, values)),
+            )
+            for (bucket, user_id, route, model), values in batch.items()
+        ]
+        stmt = insert(GenerationUsage)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["bucket_start", "user_id", "route", "model"],
+            set_={
+                name: getattr(GenerationUsage, name) + getattr(stmt.excluded, name)
+                for name in COUNTERS
+            },
+        )
+        try:
+            with directory_engine.begin() as conn:
+                conn.execute(stmt, rows)
+        except Exception:
+            logger.exception("Failed to flush %d usage rows", len(rows))
+            # Nothing was committed; keep the counters for the next attempt
+            with self._lock:
+                for key, values in batch.items():
+                    self._merge(key, values)
+
+
+recorder = UsageRecorder()
+
+
+def usage_report(
+    db: Session,
+    bucket: str = "day",
+    group_by: Tuple[str, ...] = ("route", "model"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+) -> List[Dict]:
+    """Roll stored usage up into ``bucket`` periods grouped by ``group_by``."""
+    recorder.flush()
+    period = func.strftime(BUCKET_FORMATS[bucket], GenerationUsage.bucket_start)
+    groups = [GROUP_COLUMNS[name] for name in group_by]
+    query = select(
+        period.label("period"),
+        *groups,
+        *(func.sum(getattr(GenerationUsage, name)).label(name) for name in COUNTERS),
+    )
+    if since is not None:
+        query = query.where(GenerationUsage.bucket_start >= since)
+    if until is not None:
+        query = query.where(GenerationUsage.bucket_start < until)
+    if user_id is not None:
+        query = query.where(GenerationUsage.user_id == user_id)
+    query = query.group_by(period, *groups).order_by(period, *groups)
+    return [dict(row._mapping) for row in db.execute(query)]
@@ -0,0 +1,173 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class VectorIndex:
+    """Append-only cosine-similarity index persisted to disk.
+
+    Vectors live in a memory-mapped ``.npy`` file that grows by doubling;
+    a JSON-lines sidecar holds one ``{"ns", "payload"}`` record per row and is
+    the commit point, so a crash mid-append never exposes a half-written row.
+    Lookups are scoped to a namespace and scan only that namespace's rows.
+
+    Several processes can share an index: writers take an exclusive
+    ``flock`` on a ``.lock`` file and pick up rows appended by others before
+    writing. Only the byte offset of each payload is kept in memory; payloads
+    are read from the sidecar for the rows a search returns.
+    """
+
+    def __init__(self, path: str, initial_capacity: int = 1024):
+        self.vectors_path = f"{path}.npy"
+        self.meta_path = f"{path}.jsonl"
+        self.lock_path = f"{path}.lock"
+        self.initial_capacity = initial_capacity
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.memmap] = None
+        self._vectors_inode: Optional[int] = None
+        self._offsets: List[int] = []
+        self._rows: Dict[str, List[int]] = {}
+        # Bytes of the sidecar already read
+        self._meta_size = 0
+        os.makedirs(os.path.dirname(self.vectors_path) or ".", exist_ok=True)
+        with self._lock, self._file_lock():
+            self._refresh(repair=True)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._vectors is None else self._vectors.shape[1]
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open_vectors(self):
+        try:
+            inode = os.stat(self.vectors_path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._vectors_inode:
+            # First use, or another process grew the file
+            self._vectors = np.lib.format.open_memmap(self.vectors_path, mode="r+")
+            self._vectors_inode = inode
+
+    def _refresh(self, repair: bool = False):
+        """Read sidecar records appended since the last call, by any process.
+
+        With ``repair`` (only under the file lock) a torn final line left by
+        an interrupted append is truncated.
+        """
+        try:
+            size = os.path.getsize(self.meta_path)
+        except FileNotFoundError:
+            size = 0
+        if size > self._meta_size:
+            with open(self.meta_path, "rb") as f:
+                f.seek(self._meta_size)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self._rows.setdefault(record["ns"], []).append(len(self._offsets))
+                    self._offsets.append(self._meta_size)
+                    self._meta_size += len(line)
+            if repair and self._meta_size < size:
+                with open(self.meta_path, "r+b") as f:
+                    f.truncate(self._meta_size)
+        if self._offsets or self._vectors is None:
+            self._open_vectors()
+
+    def _reserve(self, dim: int):
+        count = len(self._offsets)
+        if self._vectors is None:
+            self._vectors = np.lib.format.open_memmap(
+                self.vectors_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(self.initial_capacity, dim),
+            )
+            self._vectors_inode = os.stat(self.vectors_path).st_ino
+        elif self._vectors.shape[1] != dim:
+            raise ValueError(
+                f"Vector dimension {dim} does not match index dimension "
+                f"{self._vectors.shape[1]}"
+            )
+        elif count >= self._vectors.shape[0]:
+            tmp_path = f"{self.vectors_path}.tmp"
+            grown = np.lib.format.open_memmap(
+                tmp_path,
+                mode="w+",
+                dtype=np.float32,
+                shape=(self._vectors.shape[0] * 2, dim),
+            )
+            grown[:count] = self._vectors[:count]
+            grown.flush()
+            del grown
+            self._vectors = None
+            os.replace(tmp_path, self.vectors_path)
+            self._open_vectors()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, namespace: str, vector, payload: Dict) -> int:
+        """Append a vector with its payload and return its row number."""
+        vector = self._normalize(vector)
+        line = (json.dumps({"ns": namespace, "payload": payload}) + "\n").encode()
+        with self._lock, self._file_lock():
+            self._refresh(repair=True)
+            self._reserve(vector.shape[0])
+            row = len(self._offsets)
+            self._vectors[row] = vector
+            self._vectors.flush()
+            with open(self.meta_path, "ab") as f:
+                f.write(line)
+            self._offsets.append(self._meta_size)
+            self._meta_size += len(line)
+            self._rows.setdefault(namespace, []).append(row)
+            return row
+
+    def _payloads(self, rows: List[int]) -> List[Dict]:
+        with open(self.meta_path, "rb") as f:
+            payloads = []
+            for row in rows:
+                f.seek(self._offsets[row])
+                payloads.append(json.loads(f.readline())["payload"])
+        return payloads
+
+    def search(self, namespace: str, vector, k: int = 1) -> List[Tuple[float, Dict]]:
+        """Return up to ``k`` ``(similarity, payload)`` pairs, best first."""
+        with self._lock:
+            self._refresh()
+            rows = self._rows.get(namespace)
+            if not rows or self._vectors is None:
+                return []
+            query = self._normalize(vector)
+            if query.shape[0] != self._vectors.shape[1]:
+                return []
+            rows = np.asarray(rows)
+            scores = self._vectors[rows] @ query
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            payloads = self._payloads([int(rows[i]) for i in top])
+        return [(float(scores[i]), payload) for i, payload in zip(top, payloads)]